@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class MediahubConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mediahub'
+
+    def ready(self):
+        from .config import config_changed
+        from .scanner import rescan_changed
+        from .search import install
+        post_migrate.connect(install, sender=self)
+        config_changed.connect(rescan_changed)
@@ -0,0 +1,154 @@
+import os
+import re
+import time
+import hashlib
+import tempfile
+from urllib.parse import urlparse
+from django.conf import settings
+from .models import MediaItem
+from .tmdb import get_session
+
+# MediaItem field that references files of each artwork directory
+ARTWORK_FIELDS = {
+    "poster": lambda: settings.POSTER_DIR,
+    "backdrop": lambda: settings.BACKDROP_DIR,
+}
+
+TMDB_IMAGE_URL = "https://image.tmdb.org/t/p/"
+# artwork_name() of a TMDB image url: <size>_<file>
+TMDB_NAME = re.compile(r"^(w\d+|h\d+|original)_([^/]+)$")
+
+_last_trim = 0.0
+
+def artwork_name(url):
+    """
+    Cache file name for a TMDB image url, e.g.
+    https://image.tmdb.org/t/p/w500/abc.jpg -> w500_abc.jpg
+    Keyed by the TMDB image path, so the same artwork is only stored once no matter
+    how many items use it or how often the movie file is renamed.
+    """
+    parts = urlparse(url).path.strip("/").split("/")
+    if len(parts) >= 2 and parts[-1]:
+        return f"{parts[-2]}_{parts[-1]}"
+    ext = os.path.splitext(urlparse(url).path)[1] or ".jpg"
+    return hashlib.sha1(url.encode()).hexdigest() + ext
+
+def artwork_url(name):
+    """TMDB url of a cached file name, None for names that are not derived from one."""
+    match = TMDB_NAME.match(name)
+    return f"{TMDB_IMAGE_URL}{match.group(1)}/{match.group(2)}" if match else None
+
+def touch(path):
+    """
+    Mark the artwork at `path` as used now: its mtime is the "last used" stamp for LRU eviction.
+    Refreshed at most every ARTWORK_TOUCH_INTERVAL seconds, not with every request.
+    """
+    try:
+        if time.time() - os.stat(path).st_mtime > settings.ARTWORK_TOUCH_INTERVAL:
+            os.utime(path)
+    except OSError:
+        pass
+
+def fetch_artwork(directory, url):
+    """
+    Return the cache file name of `url` inside `directory`, downloading it if needed.
+    Returns None if the image could not be downloaded.
+    """
+    if not url:
+        return None
+
+    name = artwork_name(url)
+    path = directory / name
+
+    if path.exists():
+        touch(path)
+        return name
+
+    try:
+        resp = get_session().get(url, stream=True, timeout=20)
+        if resp.status_code != 200:
+            return None
+
+        # download to a temp file first, parallel tasks fetching the same artwork must not see partial files
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                for chunk in resp.iter_content(64 * 1024):
+                    fh.write(chunk)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    except Exception:
+        return None
+
+    return name
+
+def referenced_artwork(field):
+    return set(
+        MediaItem.objects.exclude(**{f"{field}__isnull": True})
+            .values_list(field, flat=True)
+            .distinct()
+            .iterator()
+    )
+
+def collect_orphans(dry_run=False):
+    """Delete cached artwork no MediaItem refers to. Returns (files, bytes) removed."""
+    files = size = 0
+    for field, directory in ARTWORK_FIELDS.items():
+        directory = directory()
+        used = referenced_artwork(field)
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name in used:
+                    continue
+                # downloads in progress
+                if entry.name.endswith(".part") and time.time() - entry.stat().st_mtime < 3600:
+                    continue
+                files += 1
+                size += entry.stat().st_size
+                if not dry_run:
+                    os.remove(entry.path)
+    return files, size
+
+def evict_lru(max_bytes=None, dry_run=False):
+    """
+    Delete artwork until all artwork directories together fit into `max_bytes`
+    (settings.ARTWORK_CACHE_MAX_BYTES): files no item refers to first, then the least recently
+    used ones (served or fetched, see touch()). Items keep referring to an evicted file, it is
+    served from TMDB (artwork_media) instead of being downloaded again. Returns (files, bytes) removed.
+    """
+    max_bytes = settings.ARTWORK_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not max_bytes:
+        return 0, 0
+
+    entries = []
+    for field, directory in ARTWORK_FIELDS.items():
+        used = referenced_artwork(field)
+        with os.scandir(directory()) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith(".part"):
+                    st = entry.stat()
+                    entries.append((entry.name in used, st.st_mtime, st.st_size, entry))
+
+    total = sum(size for _, _, size, _ in entries)
+    files = freed = 0
+    for _, _, size, entry in sorted(entries, key=lambda e: e[:2]):
+        if total <= max_bytes:
+            break
+        total -= size
+        files += 1
+        freed += size
+        if not dry_run:
+            os.remove(entry.path)
+
+    return files, freed
+
+def trim_cache():
+    """evict_lru(), but at most once per settings.ARTWORK_TRIM_INTERVAL seconds per process."""
+    global _last_trim
+    now = time.monotonic()
+    if _last_trim and now - _last_trim < settings.ARTWORK_TRIM_INTERVAL:
+        return
+    _last_trim = now
+    evict_lru()
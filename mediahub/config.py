@@ -0,0 +1,113 @@
+import os
+import threading
+from dataclasses import dataclass
+import yaml
+from django.conf import settings
+from django.dispatch import Signal
+from django.utils.text import slugify
+
+# the only profile if config.yaml lists none, existing progress was migrated to it
+DEFAULT_PROFILE = "Default"
+
+# sent by get_config() when it reloaded a changed config.yaml, with the LibraryConfigs that
+# were `added`, `changed` and `removed` compared to the previous load of this process, and the
+# `stamp` (mtime_ns, size) of the file. Every process sends it for the same edit.
+config_changed = Signal()
+
+_config = None
+_config_stamp = None
+_config_lock = threading.Lock()
+
+
+class ConfigError(Exception):
+    """config.yaml is missing or not valid."""
+
+
+@dataclass(frozen=True)
+class LibraryConfig:
+    name: str
+    slug: str
+    path: str
+    type: str = "other"
+    hidden: bool = False
+    sync: bool = False
+    pre_encode: bool = False
+
+
+@dataclass(frozen=True)
+class Config:
+    libraries: tuple
+    hidden_pin: str | None = None
+    profiles: tuple = (DEFAULT_PROFILE,)  # the first one is used until the session picks another
+
+    def library_names(self):
+        return {lib.name for lib in self.libraries}
+
+
+def config_path():
+    return settings.BASE_DIR / "config.yaml"
+
+def parse_config(data):
+    """Config from the parsed YAML of config.yaml, ConfigError for anything that is not usable."""
+    if not isinstance(data, dict):
+        raise ConfigError("config.yaml must be a mapping")
+
+    libraries = []
+    for lib in data.get("libraries") or []:
+        if not isinstance(lib, dict) or not lib.get("name") or not lib.get("path"):
+            raise ConfigError(f"every library needs a name and a path: {lib!r}")
+        libraries.append(LibraryConfig(
+            name=str(lib["name"]),
+            slug=slugify(lib["name"]),
+            path=str(lib["path"]),
+            type=str(lib.get("type", "other")),
+            hidden=bool(lib.get("hidden", False)),
+            sync=bool(lib.get("sync", False)),
+            pre_encode=bool(lib.get("pre_encode", False)),
+        ))
+
+    slugs = [lib.slug for lib in libraries]
+    if len(set(slugs)) != len(slugs):
+        raise ConfigError("library names must be unique")
+
+    profiles = tuple(str(name) for name in data.get("profiles") or [DEFAULT_PROFILE])
+    if len(set(profiles)) != len(profiles) or not all(profiles):
+        raise ConfigError("profile names must be unique and not empty")
+
+    pin = data.get("hidden_pin")
+    return Config(libraries=tuple(libraries), hidden_pin=str(pin) if pin is not None else None, profiles=profiles)
+
+def get_config():
+    """
+    The parsed config.yaml. It is read again only when its mtime or size changed, every other
+    call costs one stat(). A reload sends config_changed.
+    """
+    global _config, _config_stamp
+    path = config_path()
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        raise ConfigError(f"cannot read {path}: {e}")
+    stamp = (st.st_mtime_ns, st.st_size)
+
+    with _config_lock:
+        if stamp == _config_stamp:
+            return _config
+        with open(path, "r") as f:
+            try:
+                config = parse_config(yaml.safe_load(f))
+            except yaml.YAMLError as e:
+                raise ConfigError(f"cannot parse {path}: {e}")
+        previous, _config, _config_stamp = _config, config, stamp
+
+    if previous is not None:
+        old = {lib.name: lib for lib in previous.libraries}
+        new = {lib.name: lib for lib in config.libraries}
+        added = [lib for name, lib in new.items() if name not in old]
+        changed = [lib for name, lib in new.items() if name in old and old[name] != lib]
+        removed = [lib for name, lib in old.items() if name not in new]
+        if added or changed or removed:
+            config_changed.send(
+                sender=Config, config=config, added=added, changed=changed, removed=removed, stamp=stamp
+            )
+    return config
@@ -0,0 +1,117 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from django_q.tasks import async_task
+from .fuzzy import mark_changed
+from .models import EnrichmentState
+from .subtitles import queue_subdl
+
+# set while a chain of process_queue tasks is running (shared cache, the qcluster and the web
+# processes see it); it expires with the lease in case the worker running the chain dies
+WORKER_KEY = "enrichment:worker"
+
+
+def _claimable(now):
+    # pending items, and items whose worker died without finishing them
+    return Q(status=EnrichmentState.PENDING) | Q(status=EnrichmentState.RUNNING, next_retry_at__lt=now)
+
+def _start_worker():
+    """Enqueue process_queue unless a chain of them is running already, it picks up new items itself."""
+    if cache.add(WORKER_KEY, True, settings.ENRICH_LEASE):
+        async_task("mediahub.enrichment.process_queue")
+
+def queue_enrichment(item_ids):
+    """
+    Mark MediaItems for a TMDB lookup and start a worker if anything new became pending.
+    Items that are already pending/running/done, or failed and still waiting for their
+    retry time, are left alone, so repeated scans don't enqueue anything.
+    """
+    item_ids = set(item_ids)
+    # without an api key nothing can be looked up, the items are queued by the first scan after it is set
+    if not item_ids or not settings.TMDB_API_KEY:
+        return 0
+
+    now = timezone.now()
+    known = set(
+        EnrichmentState.objects.filter(media_item_id__in=item_ids).values_list("media_item_id", flat=True)
+    )
+    EnrichmentState.objects.bulk_create(
+        [EnrichmentState(media_item_id=pk) for pk in item_ids - known],
+        ignore_conflicts=True,
+    )
+    retried = EnrichmentState.objects.filter(
+        media_item_id__in=known, status=EnrichmentState.FAILED, next_retry_at__lte=now
+    ).update(status=EnrichmentState.PENDING)
+
+    queued = len(item_ids - known) + retried
+    if queued or EnrichmentState.objects.filter(_claimable(now)).exists():
+        _start_worker()
+    return queued
+
+def retry_delay(attempts):
+    delay = settings.ENRICH_RETRY_BASE * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(delay, settings.ENRICH_RETRY_MAX))
+
+def process_queue(batch_size=None):
+    """
+    django-q task: look up one batch of pending items, then re-enqueue itself while work is left.
+    There is one such chain at a time, see WORKER_KEY.
+    Each item is claimed with a conditional UPDATE, so there is at most one lookup in flight per item
+    even if several of these tasks run at the same time.
+    """
+    from .scanner import tmdb_get
+
+    batch_size = batch_size or settings.ENRICH_BATCH_SIZE
+    cache.set(WORKER_KEY, True, settings.ENRICH_LEASE)
+    now = timezone.now()
+    lease = now + timedelta(seconds=settings.ENRICH_LEASE)
+    matched = 0
+
+    candidates = list(
+        EnrichmentState.objects.filter(_claimable(now))
+            .order_by("updated_at")
+            .values_list("id", "media_item_id")[:batch_size]
+    )
+
+    for state_id, item_id in candidates:
+        claimed = EnrichmentState.objects.filter(Q(id=state_id) & _claimable(now)).update(
+            status=EnrichmentState.RUNNING, next_retry_at=lease
+        )
+        if not claimed:
+            continue
+
+        try:
+            found = tmdb_get(item_id)
+            error = "" if found else "no match on TMDB"
+        except Exception as e:
+            found = False
+            error = str(e) or e.__class__.__name__
+
+        attempts = EnrichmentState.objects.filter(id=state_id).values_list("attempts", flat=True).first()
+        if attempts is None:
+            continue  # item was deleted meanwhile
+        attempts += 1
+
+        # update() instead of save(), a row deleted by a concurrent scan must not be re-inserted
+        EnrichmentState.objects.filter(id=state_id).update(
+            status=EnrichmentState.DONE if found else EnrichmentState.FAILED,
+            attempts=attempts,
+            next_retry_at=None if found else timezone.now() + retry_delay(attempts),
+            last_error=error,
+            updated_at=timezone.now(),
+        )
+        if found:
+            matched += 1
+            # online subtitles need the TMDB id, looked up once here instead of by the player
+            queue_subdl(item_id)
+
+    if matched:
+        # once per batch, not per item: every mark makes the search indexes of all processes catch up
+        mark_changed()
+
+    # cleared before looking for more work: items queued meanwhile are either seen here or start a new chain
+    cache.delete(WORKER_KEY)
+    if EnrichmentState.objects.filter(_claimable(timezone.now())).exists():
+        _start_worker()
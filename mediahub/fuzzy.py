@@ -0,0 +1,225 @@
+import heapq
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+from django.conf import settings
+from .models import FolderItem, Library, MediaItem
+from . import search as fts
+
+# candidates (most shared trigrams) that are scored with the edit distance per query
+CANDIDATES = 200
+# changed rows loaded per query when applying the change log
+CHUNK = 500
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def mark_changed():
+    """
+    Tell the search indexes of all processes that titles / folders changed. Called once per scan
+    and per enrichment batch, every process applies the logged changes on its next search.
+    """
+    if fts.available():
+        fts.prune_changes()
+    settings.SEARCH_STAMP.touch()
+
+def _stamp():
+    try:
+        return settings.SEARCH_STAMP.stat().st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def normalize(text):
+    """Lowercase, accents removed, everything but letters and digits turned into single spaces."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c if c.isalnum() else " " for c in text if not unicodedata.combining(c))
+    return " ".join(text.split())
+
+def trigrams(text, partial_last=False):
+    """
+    Trigrams of every word padded with spaces (" in", "int", ..., "ar "). With `partial_last`
+    the last word gets no trailing pad, it may still be typed.
+    """
+    words = text.split()
+    grams = set()
+    for i, w in enumerate(words):
+        padded = f" {w}" if partial_last and i == len(words) - 1 else f" {w} "
+        grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return grams
+
+def substring_distance(query, text):
+    """Edit distance between `query` and the substring of `text` closest to it (Sellers' algorithm)."""
+    prev = [0] * (len(text) + 1)
+    for i, q in enumerate(query, 1):
+        cur = [i] + [0] * len(text)
+        for j, t in enumerate(text, 1):
+            cur[j] = min(prev[j - 1] + (q != t), prev[j] + 1, cur[j - 1] + 1)
+        prev = cur
+    return min(prev)
+
+FOLDER_FIELDS = ("id", "name", "library_id", "path")
+MEDIA_FIELDS = ("id", "title", "library_id", "file_path", "is_video", "folder_id")
+
+def max_typos(length):
+    return length // 4
+
+
+class FuzzyIndex:
+    """
+    Trigram index over MediaItem titles and FolderItem names. Each document has a number; the
+    posting list of a trigram is an array("I") of document numbers in ascending order. Changed
+    and removed documents are dropped from `docs` and appended again, the posting lists are
+    rebuilt once a third of the numbers is dead. After the first load only the rows in the change
+    log of search.py are read again.
+    """
+
+    def __init__(self):
+        self.docs = []  # document number -> (key, normalized text, row) or None once removed
+        self.by_key = {}  # ("m" / "f", id) -> (document number, row)
+        self.postings = {}
+        self.removed = 0
+        self.libraries = {}  # id -> (slug, hidden)
+        self.folder_paths = {}
+        self.stamp = None
+        self.seq = None  # last change log entry applied, None until loaded (or without the log)
+
+    def add(self, key, text, row):
+        n = len(self.docs)
+        norm = normalize(text)
+        self.docs.append((key, norm, row))
+        self.by_key[key] = (n, row)
+        for gram in trigrams(norm):
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array("I")
+            postings.append(n)
+
+    def remove(self, key):
+        n, _ = self.by_key.pop(key)
+        self.docs[n] = None
+        self.removed += 1
+
+    def rebuild(self):
+        live = [doc for doc in self.docs if doc is not None]
+        self.docs, self.by_key, self.postings, self.removed = [], {}, {}, 0
+        for key, _, row in live:
+            self.add(key, row[0], row)
+
+    def refresh(self):
+        """
+        Catch up with the database: the libraries and the rows changed since the last refresh,
+        or all folders and media items on the first call and when the log can not be used.
+        """
+        self.stamp = _stamp()
+        self.libraries = {pk: (slug, hidden) for pk, slug, hidden in Library.objects.values_list("id", "slug", "hidden")}
+
+        delta = fts.changes_since(self.seq) if self.seq is not None else None
+        if delta is not None and len(delta[1]) * 3 <= len(self.by_key):
+            self.seq, changed = delta
+            rows = {}
+            for kind, model, fields in (("f", FolderItem, FOLDER_FIELDS), ("m", MediaItem, MEDIA_FIELDS)):
+                ids = sorted(pk for k, pk in changed if k == kind)
+                for i in range(0, len(ids), CHUNK):
+                    rows.update(self.load(kind, model.objects.filter(id__in=ids[i:i + CHUNK]).values_list(*fields)))
+                if kind == "f":
+                    for pk in ids:
+                        if ("f", pk) not in rows:
+                            self.folder_paths.pop(pk, None)
+            self.apply(rows, changed)
+        else:
+            # entries logged while the rows are read are applied (again) by the next refresh
+            self.seq = fts.last_change() if fts.available() else None
+            self.folder_paths = {}
+            rows = self.load("f", FolderItem.objects.values_list(*FOLDER_FIELDS).iterator())
+            rows.update(self.load("m", MediaItem.objects.values_list(*MEDIA_FIELDS).iterator()))
+            self.apply(rows, set(self.by_key) | set(rows))
+
+        if self.removed * 3 > len(self.docs):
+            self.rebuild()
+
+    def load(self, kind, values):
+        rows = {}
+        for pk, *row in values:
+            if kind == "f":
+                self.folder_paths[pk] = row.pop()
+            rows[(kind, pk)] = tuple(row)
+        return rows
+
+    def apply(self, rows, keys):
+        """Bring the documents `keys` in line with `rows`, missing from `rows` means deleted."""
+        for key in keys:
+            current = self.by_key.get(key)
+            row = rows.get(key)
+            if current is not None and current[1] != row:
+                self.remove(key)
+                current = None
+            if current is None and row is not None:
+                self.add(key, row[0], row)
+
+    def search(self, query, show_hidden=False, limit=5):
+        """
+        Best matches for `query` as search_view results, no database access. Candidates are the
+        documents sharing most trigrams with the query; they are ranked by the edit distance of
+        the query to the closest part of the title, prefix matches first. Returns None if the
+        query is too short for trigrams.
+        """
+        q = normalize(query)
+        grams = trigrams(q, partial_last=True)
+        if len(q) < 3 or not grams:
+            return None
+
+        counts = Counter()
+        for gram in grams:
+            postings = self.postings.get(gram)
+            if postings is not None:
+                counts.update(postings)
+
+        # every typo breaks at most three trigrams
+        needed = max(1, len(grams) - 3 * max_typos(len(q)))
+        candidates = heapq.nlargest(CANDIDATES, (item for item in counts.items() if item[1] >= needed), key=lambda c: c[1])
+
+        scored = []
+        for n, _ in candidates:
+            doc = self.docs[n]
+            if doc is None:
+                continue
+            key, text, row = doc
+            if not show_hidden and self.libraries.get(row[1], (None, True))[1]:
+                continue
+            distance = substring_distance(q, text)
+            if distance <= max_typos(len(q)):
+                scored.append((distance, not text.startswith(q), len(text), key, row))
+
+        return [self.result(key, row) for *_, key, row in sorted(scored)[:limit]]
+
+    def result(self, key, row):
+        slug = self.libraries.get(row[1], ("",))[0]
+        if key[0] == "f":
+            return {"type": "folder", "title": row[0], "id": key[1], "lib_slug": slug}
+        title, _, file_path, is_video, folder_id = row
+        return {
+            "type": "media",
+            "title": title,
+            "id": key[1],
+            "lib_slug": slug,
+            "file_path": file_path,
+            "isvideo": is_video,
+            "folder": self.folder_paths.get(folder_id),
+        }
+
+
+def get_index():
+    """The process-wide index, built on first use and refreshed after the scanner marked a change."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = FuzzyIndex()
+            _index.refresh()
+        elif _index.stamp != _stamp():
+            _index.refresh()
+        return _index
+
+def search(query, show_hidden=False, limit=5):
+    return get_index().search(query, show_hidden, limit)
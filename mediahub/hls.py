@@ -0,0 +1,301 @@
+import os
+import math
+import time
+import signal
+import threading
+import subprocess
+from django.conf import settings
+from .probe import probe_video
+from .scanner import file_hash
+
+# what browsers play from a plain mp4 without help
+BROWSER_VIDEO_CODECS = {"h264", "vp9", "av1"}
+BROWSER_AUDIO_CODECS = {"aac", "mp3", "opus"}
+# containers /media/stream/ sends as they are
+DIRECT_EXTS = {".mp4", ".mov"}
+
+_jobs = {}  # (media key, profile) -> TranscodeJob
+_jobs_lock = threading.Lock()
+_reaper = None  # thread stopping idle jobs, runs while there are jobs
+
+
+class TranscoderBusy(Exception):
+    """All HLS_MAX_JOBS ffmpeg processes are serving active viewers."""
+
+
+def browser_codecs(item):
+    return item.video_codec in BROWSER_VIDEO_CODECS and (
+        item.audio_codec is None or item.audio_codec in BROWSER_AUDIO_CODECS
+    )
+
+def needs_remux(item):
+    """True if the streams are fine for the browser but the container is not, see mediahub.remux."""
+    return item.ext not in DIRECT_EXTS and browser_codecs(item)
+
+def needs_transcode(item):
+    """True if the browser can not play the file as delivered by /media/stream/ (raw or remuxed)."""
+    # not probed yet: keep the old behaviour, try mp4/mov directly and transcode the rest
+    if item.video_codec is None:
+        return item.ext not in DIRECT_EXTS
+    return not browser_codecs(item)
+
+def ensure_duration(item):
+    """Duration in seconds, probed and stored now if the scanner has not done it."""
+    if item.duration is None:
+        info = probe_video(item.file_path)
+        if info["duration"]:
+            for field, value in info.items():
+                setattr(item, field, value)
+            item.save(update_fields=list(info))
+    return item.duration
+
+def profiles_for(item):
+    """HLS_PROFILES that make sense for the source, i.e. no upscaling (the smallest one is always offered)."""
+    profiles = sorted(settings.HLS_PROFILES.items(), key=lambda p: p[1]["height"])
+    usable = [(name, p) for name, p in profiles if not item.height or p["height"] <= item.height]
+    return usable or profiles[:1]
+
+def master_playlist(item):
+    lines = ["#EXTM3U"]
+    aspect = item.width / item.height if item.width and item.height else 16 / 9
+    for name, p in profiles_for(item):
+        bandwidth = (int(p["video_bitrate"].rstrip("k")) + int(p["audio_bitrate"].rstrip("k"))) * 1000
+        width = int(round(p["height"] * aspect / 2)) * 2
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{p['height']}")
+        lines.append(f"{name}/index.m3u8")
+    return "\n".join(lines) + "\n"
+
+def variant_playlist(duration):
+    seg = settings.HLS_SEGMENT_SECONDS
+    count = math.ceil(duration / seg)
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{seg}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ]
+    for n in range(count):
+        lines.append(f"#EXTINF:{min(seg, duration - n * seg):.3f},")
+        lines.append(f"seg{n:05d}.ts")
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+def segment_path(out_dir, number):
+    return out_dir / f"seg{number:05d}.ts"
+
+def output_args(profile, start, out_dir, list_path, prefix="part"):
+    """
+    ffmpeg output options writing `profile` as out_dir/<prefix>-NNNNN.ts from segment `start` on.
+    The input must be seeked to segment `start`; keyframes and timestamps are aligned to
+    HLS_SEGMENT_SECONDS, so segments of different runs (and renditions) fit together.
+    """
+    seg = settings.HLS_SEGMENT_SECONDS
+    p = settings.HLS_PROFILES[profile]
+    vb = int(p["video_bitrate"].rstrip("k"))
+    return [
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", f"scale=-2:'min(ih,{p['height']})'",
+        "-c:v", "libx264", "-preset", settings.HLS_PRESET, "-pix_fmt", "yuv420p",
+        "-b:v", f"{vb}k", "-maxrate", f"{vb}k", "-bufsize", f"{2 * vb}k",
+        "-force_key_frames", f"expr:gte(t,n_forced*{seg})",
+        "-c:a", "aac", "-ac", "2", "-b:a", p["audio_bitrate"],
+        "-f", "segment", "-segment_time", str(seg), "-segment_format", "mpegts",
+        "-segment_start_number", str(start),
+        "-segment_list", str(list_path), "-segment_list_type", "flat",
+        "-output_ts_offset", str(start * seg),
+        str(out_dir / f"{prefix}-%05d.ts"),
+    ]
+
+def publish_parts(out_dir, list_path):
+    """Rename the parts ffmpeg lists as finished to segNNNNN.ts, return the highest segment number seen (-1 if none)."""
+    try:
+        with open(list_path) as f:
+            names = [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        names = []
+
+    last = -1
+    for name in names:
+        number = int(name[:-len(".ts")].rsplit("-", 1)[1])
+        part = out_dir / name
+        if part.exists():
+            os.replace(part, segment_path(out_dir, number))
+        last = max(last, number)
+    return last
+
+def first_missing(out_dir, start=0):
+    while segment_path(out_dir, start).exists():
+        start += 1
+    return start
+
+
+class TranscodeJob:
+    """
+    One ffmpeg process transcoding `path` from segment `start` onwards into
+    out_dir/job-<pid>-<start>-NNNNN.ts. Finished parts (listed by ffmpeg in the segment list)
+    are renamed to seg-NNNNN.ts, so a killed job never leaves a truncated segment
+    behind. The process is paused once it is HLS_MAX_AHEAD segments ahead of the viewer.
+    """
+
+    def __init__(self, path, out_dir, profile, start):
+        self.out_dir = out_dir
+        self.start = start
+        self.last_requested = start
+        self.produced = start - 1
+        self.touched = time.monotonic()
+        self.paused = False
+        # jobs of other processes may write into the same directory
+        self.prefix = f"job-{os.getpid()}-{start:05d}"
+        self.list_path = out_dir / f"{self.prefix}.list"
+
+        offset = start * settings.HLS_SEGMENT_SECONDS
+        out_dir.mkdir(parents=True, exist_ok=True)
+        self.list_path.unlink(missing_ok=True)
+        self.proc = subprocess.Popen(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-ss", str(offset), "-i", path]
+            + output_args(profile, start, out_dir, self.list_path, self.prefix),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+    @property
+    def running(self):
+        return self.proc.poll() is None
+
+    def collect(self):
+        """Publish segments ffmpeg has finished, pause ffmpeg if it is far enough ahead."""
+        self.produced = max(self.produced, publish_parts(self.out_dir, self.list_path))
+
+        if self.running and not self.paused and self.produced >= self.last_requested + settings.HLS_MAX_AHEAD:
+            self.proc.send_signal(signal.SIGSTOP)
+            self.paused = True
+
+    def request(self, number):
+        self.touched = time.monotonic()
+        self.last_requested = max(self.last_requested, number)
+        if self.paused and self.produced < self.last_requested + settings.HLS_MAX_AHEAD:
+            self.proc.send_signal(signal.SIGCONT)
+            self.paused = False
+
+    def covers(self, number):
+        """True if this job will produce `number` soon, i.e. the viewer did not seek away."""
+        return self.running and self.start <= number <= self.produced + settings.HLS_MAX_AHEAD + 1
+
+    def stop(self):
+        if self.running:
+            if self.paused:
+                self.proc.send_signal(signal.SIGCONT)
+            self.proc.kill()
+            self.proc.wait()
+        self.collect()
+        self.list_path.unlink(missing_ok=True)
+        # the segment ffmpeg was writing when it got killed
+        for part in self.out_dir.glob(f"{self.prefix}-*.ts"):
+            part.unlink(missing_ok=True)
+
+
+def evict_segments():
+    """Delete least recently served segments until HLS_DIR is below HLS_CACHE_MAX_BYTES."""
+    entries = []
+    for root, _, files in os.walk(settings.HLS_DIR):
+        for name in files:
+            if name.startswith("seg"):
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= settings.HLS_CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total -= size
+
+def _reap_jobs():
+    now = time.monotonic()
+    for k, job in list(_jobs.items()):
+        if not job.running or now - job.touched > settings.HLS_JOB_IDLE:
+            job.stop()
+            del _jobs[k]
+
+def reap():
+    """
+    Publish finished segments and stop idle or ended jobs, also when nobody requests segments
+    anymore: a paused ffmpeg of a viewer who left would otherwise keep its slot. Returns True
+    while jobs are left.
+    """
+    with _jobs_lock:
+        for job in _jobs.values():
+            job.collect()
+        _reap_jobs()
+        return bool(_jobs)
+
+def _run_reaper():
+    global _reaper
+    while True:
+        time.sleep(settings.HLS_REAP_INTERVAL)
+        with _jobs_lock:
+            if not _jobs:
+                _reaper = None
+                return
+        reap()
+
+def _start_reaper():
+    thread = threading.Thread(target=_run_reaper, name="mediahub-hls-reaper", daemon=True)
+    thread.start()
+    return thread
+
+def get_segment(item, profile, number, timeout=None):
+    """
+    Path of segment `number` of `item` in `profile`, transcoding it if it is neither
+    pre-encoded nor cached.
+    A job is started at the first missing segment, so seeking never transcodes from zero.
+    Returns None if ffmpeg failed, raises TranscoderBusy if no ffmpeg slot is free.
+    """
+    global _reaper
+    timeout = timeout or settings.HLS_SEGMENT_TIMEOUT
+    key = (file_hash(item.file_path), profile)
+
+    # pre-encoded by mediahub.ladder
+    seg = segment_path(settings.HLS_LADDER_DIR / key[0] / profile, number)
+    if seg.exists():
+        return seg
+
+    out_dir = settings.HLS_DIR / key[0] / profile
+    seg = segment_path(out_dir, number)
+
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if seg.exists():
+            os.utime(seg)  # LRU stamp
+            if job:
+                job.request(number)
+            return seg
+
+        _reap_jobs()
+        job = _jobs.get(key)
+        if job and not job.covers(number):
+            job.stop()
+            del _jobs[key]
+            job = None
+
+        if job is None:
+            if len(_jobs) >= settings.HLS_MAX_JOBS:
+                raise TranscoderBusy()
+            evict_segments()
+            job = _jobs[key] = TranscodeJob(item.file_path, out_dir, profile, first_missing(out_dir, number))
+            if _reaper is None:
+                _reaper = _start_reaper()
+        job.request(number)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with _jobs_lock:
+            job.collect()
+            if seg.exists():
+                return seg
+            if not job.running:
+                job.collect()
+                return seg if seg.exists() else None
+        time.sleep(0.2)
+    return None
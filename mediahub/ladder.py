@@ -0,0 +1,184 @@
+import os
+import math
+import shutil
+import subprocess
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django_q.tasks import async_task
+from .models import EncodeState, MediaItem
+from .enrichment import retry_delay
+from .scanner import file_hash
+from .hls import (
+    ensure_duration, first_missing, master_playlist, output_args, profiles_for, publish_parts, variant_playlist,
+)
+
+
+def _claimable(now):
+    # pending encodes, and encodes whose worker died without finishing them
+    return Q(status=EncodeState.PENDING) | Q(status=EncodeState.RUNNING, next_retry_at__lt=now)
+
+def _running(now):
+    return EncodeState.objects.filter(status=EncodeState.RUNNING, next_retry_at__gte=now)
+
+def queue_encodes(library):
+    """
+    Queue an encode for every video of a `pre_encode` library that has none yet and start
+    up to LADDER_MAX_JOBS workers. For other libraries the encodes are dropped, prune_ladder
+    removes their output.
+    """
+    states = EncodeState.objects.filter(media_item__library=library)
+    if not library.pre_encode:
+        states.delete()
+        return 0
+
+    now = timezone.now()
+    item_ids = set(MediaItem.objects.filter(library=library, is_video=True).values_list("id", flat=True))
+    known = set(states.values_list("media_item_id", flat=True))
+    EncodeState.objects.bulk_create(
+        [EncodeState(media_item_id=pk) for pk in item_ids - known],
+        ignore_conflicts=True,
+    )
+    retried = states.filter(status=EncodeState.FAILED, next_retry_at__lte=now).update(status=EncodeState.PENDING)
+
+    if EncodeState.objects.filter(_claimable(now)).exists():
+        for _ in range(settings.LADDER_MAX_JOBS - _running(now).count()):
+            async_task("mediahub.ladder.encode_next")
+    return len(item_ids - known) + retried
+
+def ladder_dir(item):
+    return settings.HLS_LADDER_DIR / file_hash(item.file_path)
+
+def write_playlists(item, root):
+    """master.m3u8 + <profile>/index.m3u8 next to the segments, the same playlists hls_master / hls_playlist serve."""
+    for name, _ in profiles_for(item):
+        (root / name / "index.m3u8").write_text(variant_playlist(item.duration))
+    (root / "master.m3u8").write_text(master_playlist(item))
+
+def encode_chunk(item):
+    """
+    Encode the next LADDER_CHUNK_SEGMENTS segments of every profile of `item` with one niced
+    ffmpeg (one decode, one output per profile). Resumes at the first segment missing on disk,
+    so an interrupted encode continues where it stopped. Returns True once the ladder is complete.
+    """
+    duration = ensure_duration(item)
+    if not duration:
+        raise ValueError("duration unknown")
+
+    seg = settings.HLS_SEGMENT_SECONDS
+    total = math.ceil(duration / seg)
+    root = ladder_dir(item)
+    profiles = [name for name, _ in profiles_for(item)]
+
+    start = min(first_missing(root / name) for name in profiles)
+    if start < total:
+        count = min(settings.LADDER_CHUNK_SEGMENTS, total - start)
+        cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-y",
+               "-ss", str(start * seg), "-t", str(count * seg), "-i", item.file_path]
+        for name in profiles:
+            (root / name).mkdir(parents=True, exist_ok=True)
+            (root / name / "ladder.list").unlink(missing_ok=True)
+            cmd += output_args(name, start, root / name, root / name / "ladder.list")
+
+        niceness = settings.LADDER_NICE
+        proc = subprocess.Popen(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, preexec_fn=lambda: os.nice(niceness)
+        )
+        try:
+            _, err = proc.communicate(timeout=settings.LADDER_CHUNK_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            _, err = proc.communicate()
+
+        for name in profiles:
+            publish_parts(root / name, root / name / "ladder.list")
+            (root / name / "ladder.list").unlink(missing_ok=True)
+            for part in (root / name).glob("part-*.ts"):
+                part.unlink(missing_ok=True)
+
+        done = min(first_missing(root / name, start) for name in profiles)
+        if done == start:
+            raise RuntimeError(err.decode(errors="replace").strip() or "no segment finished within LADDER_CHUNK_TIMEOUT")
+        if done < total:
+            return False
+
+    write_playlists(item, root)
+    return True
+
+def encode_next():
+    """
+    django-q task: encode one chunk of the oldest unfinished item, then re-enqueue itself while work is left.
+    An encode is claimed with a conditional UPDATE that also checks the number of running encodes,
+    so no more than LADDER_MAX_JOBS ffmpeg processes run at the same time, however many tasks were queued.
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=settings.LADDER_LEASE)
+    running = Coalesce(
+        Subquery(_running(now).values("status").annotate(n=Count("id")).values("n")), 0
+    )
+
+    candidates = EncodeState.objects.filter(_claimable(now)).order_by("id").values_list("id", "media_item_id")
+    for state_id, item_id in candidates[:settings.LADDER_MAX_JOBS + 1]:
+        claimed = (
+            EncodeState.objects.filter(Q(id=state_id) & _claimable(now))
+                .alias(running=running)
+                .filter(running__lt=settings.LADDER_MAX_JOBS)
+                .update(status=EncodeState.RUNNING, next_retry_at=lease)
+        )
+        if claimed:
+            break
+    else:
+        return
+
+    item = MediaItem.objects.filter(id=item_id).first()
+    try:
+        finished = item is not None and encode_chunk(item)
+        error = ""
+    except Exception as e:
+        finished = None
+        error = str(e) or e.__class__.__name__
+
+    state = EncodeState.objects.filter(id=state_id)
+    if finished:
+        state.update(status=EncodeState.DONE, next_retry_at=None, last_error="", updated_at=timezone.now())
+    elif finished is None:
+        attempts = (state.values_list("attempts", flat=True).first() or 0) + 1
+        state.update(
+            status=EncodeState.FAILED,
+            attempts=attempts,
+            next_retry_at=timezone.now() + retry_delay(attempts),
+            last_error=error,
+            updated_at=timezone.now(),
+        )
+    else:
+        # progress was made, give the slot back until the next chunk
+        state.update(status=EncodeState.PENDING, next_retry_at=None, updated_at=timezone.now())
+
+    if EncodeState.objects.filter(_claimable(timezone.now())).exists():
+        async_task("mediahub.ladder.encode_next")
+
+def prune_ladder():
+    """
+    Delete ladders of files that were removed, rewritten or left a pre_encode library,
+    and queue finished encodes again whose output is gone. Returns the number of removed ladders.
+    """
+    keep = set()
+    lost = []
+    for state_id, path, status in EncodeState.objects.values_list("id", "media_item__file_path", "status"):
+        try:
+            key = file_hash(path)
+        except OSError:
+            continue
+        keep.add(key)
+        if status == EncodeState.DONE and not (settings.HLS_LADDER_DIR / key / "master.m3u8").exists():
+            lost.append(state_id)
+    EncodeState.objects.filter(id__in=lost).update(status=EncodeState.PENDING, attempts=0)
+
+    removed = 0
+    for entry in os.scandir(settings.HLS_LADDER_DIR):
+        if entry.is_dir() and entry.name not in keep:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from mediahub.subtitles import find_local_subtitles
+
+
+class Command(BaseCommand):
+    help = "Look for subtitle files and embedded subtitles of videos scanned before subtitles were discovered"
+
+    def add_arguments(self, parser):
+        parser.add_argument("libraries", nargs="*", help="library names from config.yaml (default: all)")
+
+    def handle(self, *args, **options):
+        queued = find_local_subtitles(options["libraries"])
+        self.stdout.write(f"Queued subtitles of {queued} videos, they are converted by the qcluster")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from mediahub.artwork import collect_orphans, evict_lru
+
+
+class Command(BaseCommand):
+    help = "Delete cached posters / backdrops no item refers to and trim the cache to ARTWORK_CACHE_MAX_BYTES"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="only report what would be deleted")
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        verb = "Would remove" if dry_run else "Removed"
+
+        files, size = collect_orphans(dry_run=dry_run)
+        self.stdout.write(f"{verb} {files} orphaned files ({filesizeformat(size)})")
+
+        files, size = evict_lru(dry_run=dry_run)
+        if files:
+            self.stdout.write(f"{verb} {files} least recently used files ({filesizeformat(size)})")
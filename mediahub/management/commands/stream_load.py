@@ -0,0 +1,73 @@
+import statistics
+import threading
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from mediahub.models import MediaItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Play videos from a running MediaHub with concurrent clients and report throughput and latency. "
+        "Each client reads one video front to back in Range requests of --chunk bytes, like a browser player."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="address of the running server, e.g. http://127.0.0.1:8000")
+        parser.add_argument("--clients", type=int, default=8, help="concurrent players (default: 8)")
+        parser.add_argument("--duration", type=float, default=30, help="seconds to run (default: 30)")
+        parser.add_argument("--chunk", type=int, default=2 * 1024 * 1024, help="bytes per Range request (default: 2 MiB)")
+        parser.add_argument("--path", action="append", default=[], help="video to play, repeatable (default: videos from the database)")
+
+    def handle(self, *args, **options):
+        paths = options["path"] or list(
+            MediaItem.objects.filter(is_video=True).order_by("-file_size").values_list("file_path", flat=True)[: options["clients"]]
+        )
+        if not paths:
+            raise CommandError("No videos to play, scan a library or pass --path")
+
+        url = options["url"].rstrip("/") + "/media/stream/"
+        deadline = time.monotonic() + options["duration"]
+        latencies, statuses, received = [], {}, [0]
+        lock = threading.Lock()
+
+        def player(path):
+            session = requests.Session()
+            offset = 0
+            while time.monotonic() < deadline:
+                end = offset + options["chunk"] - 1
+                started = time.monotonic()
+                try:
+                    resp = session.get(url, params={"path": path}, headers={"Range": f"bytes={offset}-{end}"}, timeout=30)
+                    body = resp.content
+                    status = resp.status_code
+                except requests.RequestException as e:
+                    body, status = b"", type(e).__name__
+                elapsed = time.monotonic() - started
+                with lock:
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if status == 206:
+                        latencies.append(elapsed)
+                        received[0] += len(body)
+                # rewind at the end of the file (416) and after errors
+                offset = end + 1 if status == 206 and len(body) == options["chunk"] else 0
+
+        threads = [threading.Thread(target=player, args=(paths[i % len(paths)],)) for i in range(options["clients"])]
+        started = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(f"{options['clients']} clients, {len(paths)} videos, {elapsed:.1f}s")
+        self.stdout.write("responses: " + ", ".join(f"{k}: {v}" for k, v in sorted(statuses.items(), key=str)))
+        self.stdout.write(f"throughput: {received[0] * 8 / elapsed / 1e6:.1f} Mbit/s, "
+                          f"{received[0] * 8 / elapsed / 1e6 / options['clients']:.1f} Mbit/s per client")
+        if len(latencies) > 1:
+            q = statistics.quantiles(latencies, n=100)
+            self.stdout.write(f"latency per chunk: p50 {q[49] * 1000:.0f} ms, p95 {q[94] * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms")
+        self.stdout.write("a client keeps up while its throughput stays above the video bitrate; "
+                          "503s are STREAM_MAX_PER_CLIENT / STREAM_MAX_TOTAL refusing streams "
+                          "(all clients of this command share one address)")
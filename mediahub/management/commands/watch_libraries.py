@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from mediahub.config import ConfigError, get_config
+from mediahub.scanner import scan_once, scan_directories
+
+
+class ChangeCollector:
+    """
+    watchdog event handler that only remembers which directories changed.
+    Bursts (e.g. copying a folder with thousands of photos) are coalesced into one batch.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dirs = set()
+        self.first_event = None
+        self.last_event = None
+
+    def dispatch(self, event):
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+
+        paths = [event.src_path]
+        if getattr(event, "dest_path", None):
+            paths.append(event.dest_path)
+
+        with self.lock:
+            for path in paths:
+                path = os.fsdecode(path)
+                # a changed directory is re-listed itself, a changed file through its directory
+                self.dirs.add(path if event.is_directory else os.path.dirname(path))
+
+            now = time.monotonic()
+            self.first_event = self.first_event or now
+            self.last_event = now
+
+    def take(self, debounce, max_delay):
+        """Return the collected directories once the burst is over, else None."""
+        with self.lock:
+            if not self.dirs:
+                return None
+
+            now = time.monotonic()
+            if now - self.last_event < debounce and now - self.first_event < max_delay:
+                return None
+
+            dirs, self.dirs = self.dirs, set()
+            self.first_event = None
+            return dirs
+
+
+class Command(BaseCommand):
+    help = "Watch all library paths from config.yaml and apply file changes as they happen"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--debounce", type=float, default=settings.WATCH_DEBOUNCE,
+                            help="seconds without new events before changes are applied")
+        parser.add_argument("--max-delay", type=float, default=settings.WATCH_MAX_DELAY,
+                            help="apply changes after this many seconds even if events keep coming")
+
+    def handle(self, *args, **options):
+        try:
+            from watchdog.observers import Observer
+        except ImportError:
+            raise CommandError("watch_libraries needs the watchdog package: pip install watchdog")
+
+        # catch up with everything that changed while nobody was watching
+        scan_once()
+
+        collector = ChangeCollector()
+        observer = Observer()
+        config = get_config()
+        self.watch(observer, collector, config)
+
+        observer.start()
+        try:
+            while True:
+                time.sleep(0.5)
+                # libraries added / moved / removed in config.yaml (the reload queues their scan)
+                try:
+                    latest = get_config()
+                except ConfigError:
+                    latest = config  # being edited, keep watching what we have
+                if latest is not config:
+                    config = latest
+                    self.watch(observer, collector, config)
+
+                dirs = collector.take(options["debounce"], options["max_delay"])
+                if dirs:
+                    self.stdout.write(f"Applying changes in {len(dirs)} directories")
+                    scan_directories(dirs)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            observer.stop()
+            observer.join()
+
+    def watch(self, observer, collector, config):
+        """Watch exactly the library paths of `config`."""
+        observer.unschedule_all()
+        for lib in config.libraries:
+            if not os.path.isdir(lib.path):
+                self.stderr.write(f"Skipping {lib.name}: {lib.path} does not exist")
+                continue
+            observer.schedule(collector, lib.path, recursive=True)
+            self.stdout.write(f"Watching {lib.name} ({lib.path})")
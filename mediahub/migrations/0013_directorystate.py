@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediahub', '0012_collection_mediaitem_collection'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('mtime', models.BigIntegerField()),
+                ('inode', models.BigIntegerField()),
+                ('library', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='directory_states', to='mediahub.library')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediahub', '0014_mediaitem_probe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TmdbCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('endpoint', models.CharField(max_length=200)),
+                ('data', models.JSONField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
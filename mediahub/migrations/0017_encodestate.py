@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediahub', '0016_enrichmentstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='library',
+            name='pre_encode',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='EncodeState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_retry_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('media_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='encode', to='mediahub.mediaitem')),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+
+# fill the new columns for folders scanned before, the same query as scanner.update_folder_totals
+FILL_TOTALS = """
+WITH RECURSIVE tree(ancestor, folder) AS (
+    SELECT id, id FROM mediahub_folderitem
+    UNION ALL
+    SELECT tree.ancestor, f.id FROM tree JOIN mediahub_folderitem f ON f.parent_id = tree.folder
+),
+totals(id, size, items) AS (
+    SELECT tree.ancestor, COALESCE(SUM(m.file_size), 0), COUNT(m.id)
+    FROM tree LEFT JOIN mediahub_mediaitem m ON m.folder_id = tree.folder
+    GROUP BY tree.ancestor
+)
+UPDATE mediahub_folderitem SET
+    total_size = (SELECT size FROM totals WHERE totals.id = mediahub_folderitem.id),
+    total_items = (SELECT items FROM totals WHERE totals.id = mediahub_folderitem.id)
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediahub', '0017_encodestate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folderitem',
+            name='total_items',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='folderitem',
+            name='total_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunSQL(FILL_TOTALS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediahub', '0018_folderitem_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='folderitem',
+            index=models.Index(fields=['parent', 'name', 'id'], name='mediahub_fo_parent__1abfe6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(fields=['library', 'title', 'id'], name='mediahub_me_library_ffa10a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(fields=['folder', 'title', 'id'], name='mediahub_me_folder__c7e39b_idx'),
+        ),
+    ]
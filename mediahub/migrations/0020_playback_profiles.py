@@ -0,0 +1,73 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def first_profile():
+    """First profile of config.yaml, the one a browser without a picked profile uses."""
+    from mediahub.config import DEFAULT_PROFILE, ConfigError, get_config
+    try:
+        return get_config().profiles[0]
+    except ConfigError:
+        return DEFAULT_PROFILE
+
+def assign_default_profile(apps, schema_editor):
+    """Give existing progress to the first profile, keeping the latest row of every media item."""
+    Profile = apps.get_model("mediahub", "Profile")
+    PlaybackProgress = apps.get_model("mediahub", "PlaybackProgress")
+
+    name = first_profile()
+    Profile.objects.get_or_create(name=name)
+    seen = set()
+    duplicates = []
+    for pk, item_id in PlaybackProgress.objects.order_by("-updated_at", "-id").values_list("id", "media_item_id"):
+        if item_id in seen:
+            duplicates.append(pk)
+        seen.add(item_id)
+    PlaybackProgress.objects.filter(id__in=duplicates).delete()
+    PlaybackProgress.objects.update(profile_id=name)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediahub', '0019_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='playbackprogress',
+            name='duration',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='playbackprogress',
+            name='finished',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='playbackprogress',
+            name='profile',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='mediahub.profile'),
+        ),
+        migrations.RunPython(assign_default_profile, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='playbackprogress',
+            name='profile',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='mediahub.profile'),
+        ),
+        migrations.AddIndex(
+            model_name='playbackprogress',
+            index=models.Index(condition=models.Q(('finished', False)), fields=['profile', '-updated_at'], name='progress_continue_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='playbackprogress',
+            constraint=models.UniqueConstraint(fields=('profile', 'media_item'), name='unique_progress_per_profile'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediahub', '0020_playback_profiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaitem',
+            name='file_mtime',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediahub', '0021_mediaitem_file_mtime'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='directorystate',
+            name='path',
+            field=models.CharField(max_length=1024),
+        ),
+        migrations.AddConstraint(
+            model_name='directorystate',
+            constraint=models.UniqueConstraint(fields=('library', 'path'), name='unique_directory_per_library'),
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.db import models
-from django.db.models import Max
+from django.db.models import Max, Q
 
 class Library(models.Model):
     slug = models.SlugField(unique=True)
@@ -7,6 +7,7 @@ class Library(models.Model):
     path = models.TextField()
     hidden = models.BooleanField(default=False)
     sync = models.BooleanField(default=False)
+    pre_encode = models.BooleanField(default=False)  # HLS ladder encoded in the background
 
     LIBRARY_TYPES = [
         ('movies', 'Movies'),
@@ -24,6 +25,13 @@ class FolderItem(models.Model):
     name = models.CharField(max_length=255)
     path = models.CharField(max_length=1024)  # absolute path on disk
     poster = models.CharField(max_length=1024, blank=True, null=True)  # first image path
+    # size and number of all items in this folder and below, maintained by the scanner
+    total_size = models.BigIntegerField(default=0)
+    total_items = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # keyset pagination of library_page
+        indexes = [models.Index(fields=["parent", "name", "id"])]
 
     @property
     def display_label(self):
@@ -32,6 +40,30 @@ class FolderItem(models.Model):
     def __str__(self):
         return self.name
 
+class DirectoryState(models.Model):
+    library = models.ForeignKey(Library, on_delete=models.CASCADE, related_name="directory_states")
+    path = models.CharField(max_length=1024)  # absolute path on disk
+    mtime = models.BigIntegerField()  # st_mtime_ns of the directory at last scan
+    inode = models.BigIntegerField()
+
+    class Meta:
+        # libraries may share or nest directories
+        constraints = [
+            models.UniqueConstraint(fields=["library", "path"], name="unique_directory_per_library"),
+        ]
+
+    def __str__(self):
+        return self.path
+
+class TmdbCache(models.Model):
+    key = models.CharField(max_length=40, unique=True)  # sha1 of endpoint + params
+    endpoint = models.CharField(max_length=200)
+    data = models.JSONField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.endpoint
+
 class Collection(models.Model):
     tmdb_id = models.IntegerField(unique=True)
     name = models.CharField(max_length=300)
@@ -54,9 +86,20 @@ class MediaItem(models.Model):
     description = models.TextField(null=True, blank=True)
     genre = models.JSONField(default=list)
     file_size = models.BigIntegerField(default=0)
+    file_mtime = models.BigIntegerField(null=True, blank=True)  # st_mtime_ns, versions the thumbnail urls
     tmdb_id = models.IntegerField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)  # seconds, from ffprobe
+    video_codec = models.CharField(max_length=32, null=True, blank=True)
+    audio_codec = models.CharField(max_length=32, null=True, blank=True)
     collection = models.ForeignKey(Collection, null=True, blank=True, on_delete=models.SET_NULL, related_name="items")
 
+    class Meta:
+        # keyset pagination of library_page
+        indexes = [
+            models.Index(fields=["library", "title", "id"]),
+            models.Index(fields=["folder", "title", "id"]),
+        ]
+
     @property
     def display_label(self):
         return self.title
@@ -64,11 +107,77 @@ class MediaItem(models.Model):
     def __str__(self):
         return self.title
 
+class EnrichmentState(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    media_item = models.OneToOneField(MediaItem, on_delete=models.CASCADE, related_name="enrichment")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    # failed: earliest time for the next attempt, running: when the claim of a crashed worker expires
+    next_retry_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.media_item_id}: {self.status}"
+
+class EncodeState(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    media_item = models.OneToOneField(MediaItem, on_delete=models.CASCADE, related_name="encode")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    # failed: earliest time for the next attempt, running: when the claim of a crashed worker expires
+    next_retry_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.media_item_id}: {self.status}"
+
+class Profile(models.Model):
+    """A viewer with its own playback progress, the names come from `profiles` in config.yaml."""
+    name = models.CharField(max_length=100, primary_key=True)
+
+    def __str__(self):
+        return self.name
+
 class PlaybackProgress(models.Model):
+    # db_index=False: the unique constraint and the index below start with the profile
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="progress", db_index=False)
     media_item = models.ForeignKey(MediaItem, on_delete=models.CASCADE)
     position = models.IntegerField(default=0)
+    duration = models.IntegerField(null=True, blank=True)  # seconds, as reported by the player
+    finished = models.BooleanField(default=False)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["profile", "media_item"], name="unique_progress_per_profile"),
+        ]
+        indexes = [
+            # "Continue Watching": unfinished items of a profile, most recent first
+            models.Index(fields=["profile", "-updated_at"], condition=Q(finished=False), name="progress_continue_idx"),
+        ]
+
 class Language(models.Model):
     code = models.CharField(max_length=2, primary_key=True)
     language = models.CharField(max_length=20)
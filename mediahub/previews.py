@@ -0,0 +1,75 @@
+import os
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from .thumbnails import thumb_key
+
+_executor = ThreadPoolExecutor(max_workers=settings.PREVIEW_WORKERS, thread_name_prefix="mediahub-preview")
+_jobs = {}  # preview key -> Future of the running extraction
+_jobs_lock = threading.Lock()
+_failed = set()  # keys ffmpeg produced no frame for, not retried until the file changes
+
+
+def preview_path(key):
+    # sharded as previews/ab/<key>.jpg, like the thumbnails
+    return settings.PREVIEW_DIR / key[:2] / f"{key}.jpg"
+
+def generate_preview(path, key=None, seconds=2):
+    """
+    Extract the frame at `seconds` of the video at `path` into its preview file (replacing it).
+    Returns the file, or None if ffmpeg produced no frame.
+    """
+    try:
+        key = key or thumb_key(path)
+    except OSError:
+        return None
+
+    out = preview_path(key)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=out.parent, suffix=".part")
+    os.close(fd)
+    try:
+        subprocess.run([
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-ss", str(seconds), "-i", path,
+            "-vframes", "1", "-q:v", "2", "-f", "image2", tmp,
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+        if not os.path.getsize(tmp):
+            return None
+        os.replace(tmp, out)
+        return out
+    except (OSError, subprocess.SubprocessError):
+        return None
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def _finished(key, future):
+    with _jobs_lock:
+        _jobs.pop(key, None)
+        if future.exception() is not None or future.result() is None:
+            _failed.add(key)
+
+def get_preview(path):
+    """
+    Preview frame of the video at `path` if it exists. Otherwise its extraction is started on the
+    bounded PREVIEW_WORKERS pool, one job per file however many requests ask for it, and None
+    is returned until it is done.
+    """
+    try:
+        key = thumb_key(path)
+    except OSError:
+        return None
+
+    out = preview_path(key)
+    if out.exists():
+        return out
+
+    with _jobs_lock:
+        if key in _jobs or key in _failed:
+            return None
+        future = _jobs[key] = _executor.submit(generate_preview, path, key)
+    # outside the lock: a job that already finished runs the callback right here, and _finished takes the lock
+    future.add_done_callback(lambda f: _finished(key, f))
+    return None
@@ -0,0 +1,101 @@
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from PIL import Image
+from .thumbnails import generate_thumbnails
+from .previews import generate_preview
+from .subtitles import TEXT_SUBTITLE_CODECS
+
+
+def get_image_size(path):
+    try:
+        with Image.open(path) as img:
+            return img.width, img.height
+    except Exception:
+        return None, None
+
+def ffprobe(path):
+    """Run ffprobe once and return its parsed JSON output (format + streams), or None."""
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+            capture_output=True,
+            timeout=60,
+        )
+        if result.returncode != 0:
+            return None
+        return json.loads(result.stdout)
+    except Exception:
+        return None
+
+def probe_video(path, subtitles=False):
+    """
+    Read duration, resolution and codecs of a video file with a single ffprobe call.
+    :param subtitles: also list the embedded text subtitles as "subtitle_tracks", [{"stream", "lang"}]
+    """
+    info = {"width": None, "height": None, "duration": None, "video_codec": None, "audio_codec": None}
+    if subtitles:
+        info["subtitle_tracks"] = []
+
+    data = ffprobe(path)
+    if not data:
+        return info
+
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and info["video_codec"] is None:
+            # attached cover art shows up as a video stream too
+            if stream.get("disposition", {}).get("attached_pic"):
+                continue
+            info["video_codec"] = stream.get("codec_name")
+            info["width"] = stream.get("width")
+            info["height"] = stream.get("height")
+        elif stream.get("codec_type") == "audio" and info["audio_codec"] is None:
+            info["audio_codec"] = stream.get("codec_name")
+        elif stream.get("codec_type") == "subtitle" and subtitles and stream.get("codec_name") in TEXT_SUBTITLE_CODECS:
+            info["subtitle_tracks"].append({"stream": stream["index"], "lang": stream.get("tags", {}).get("language")})
+
+    try:
+        info["duration"] = float(data.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        pass
+
+    return info
+
+def probe_image(path):
+    width, height = get_image_size(path)
+    return {"width": width, "height": height}
+
+def probe_file(path, is_video, preview=False):
+    """
+    Metadata of a new media file, meant to run on a ProbePool worker thread (no ORM access).
+    :param preview: also extract the preview frame of a video
+    """
+    if is_video:
+        info = probe_video(path, subtitles=True)
+        if preview and info["video_codec"]:
+            generate_preview(path)
+        return info
+    info = probe_image(path)
+    if settings.THUMB_PREGENERATE and info["width"]:
+        generate_thumbnails(path)
+    return info
+
+class ProbePool:
+    """
+    Bounded worker pool for probing files. Probing is I/O latency bound (PIL header
+    reads, ffprobe on network shares), so threads scale with the number of workers.
+    """
+
+    def __init__(self, workers=None):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or settings.SCAN_PROBE_WORKERS,
+            thread_name_prefix="mediahub-probe",
+        )
+
+    def submit(self, path, is_video, preview=False):
+        return self.executor.submit(probe_file, path, is_video, preview)
+
+    def shutdown(self, cancel=False):
+        """Wait for the running probes; with `cancel` the queued ones are dropped."""
+        self.executor.shutdown(wait=True, cancel_futures=cancel)
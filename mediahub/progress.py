@@ -0,0 +1,97 @@
+import atexit
+import logging
+import threading
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from .models import MediaItem, PlaybackProgress, Profile
+
+logger = logging.getLogger(__name__)
+
+# positions reported by the players, (profile, media item id) -> (seconds, duration). A thread
+# writes them every PROGRESS_FLUSH_INTERVAL seconds in one transaction, so watching does not
+# take the SQLite write lock every few seconds per stream.
+_pending = {}
+_pending_lock = threading.Lock()
+_wake = threading.Event()
+_flusher = None
+
+
+def _start_flusher():
+    thread = threading.Thread(target=_run, name="mediahub-progress", daemon=True)
+    thread.start()
+    return thread
+
+def record_position(profile, item_id, position, duration=None, final=False):
+    """
+    Buffer the position of a player, no database access.
+    :param duration: length of the video in seconds as the player knows it, None if unknown
+    :param final: the player paused or is closing, write without waiting for the next interval
+    """
+    global _flusher
+    with _pending_lock:
+        _pending[profile, item_id] = (position, duration)
+        if _flusher is None:
+            _flusher = _start_flusher()
+    if final:
+        _wake.set()
+
+def pending_position(profile, item_id):
+    """Buffered position of `item_id` for `profile` not written yet, None if there is none."""
+    with _pending_lock:
+        entry = _pending.get((profile, item_id))
+    return entry[0] if entry else None
+
+def is_finished(position, duration):
+    return bool(duration) and position >= duration * settings.PROGRESS_FINISHED
+
+def flush():
+    """Write all buffered positions in one transaction. Returns the number of positions written."""
+    with _pending_lock:
+        batch = dict(_pending)
+        _pending.clear()
+    if not batch:
+        return 0
+
+    try:
+        with transaction.atomic():
+            Profile.objects.bulk_create([Profile(name=name) for name in {p for p, _ in batch}], ignore_conflicts=True)
+            # the item may have been removed by a scan since it was played
+            existing = set(MediaItem.objects.filter(id__in={i for _, i in batch}).values_list("id", flat=True))
+            rows = [
+                PlaybackProgress(
+                    profile_id=profile, media_item_id=item_id, position=position, duration=duration,
+                    finished=is_finished(position, duration),
+                )
+                for (profile, item_id), (position, duration) in batch.items() if item_id in existing
+            ]
+            # one INSERT ... ON CONFLICT DO UPDATE for all of them
+            PlaybackProgress.objects.bulk_create(
+                rows, update_conflicts=True, unique_fields=["profile", "media_item"],
+                update_fields=["position", "duration", "finished", "updated_at"],
+            )
+    except OperationalError:
+        # e.g. "database is locked" during a scan: retry with the next round, unless a newer position came in
+        with _pending_lock:
+            for key, entry in batch.items():
+                _pending.setdefault(key, entry)
+        raise
+
+    return len(rows)
+
+def _run():
+    while True:
+        _wake.wait(settings.PROGRESS_FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            flush()
+        except Exception:
+            logger.exception("Could not save playback progress")
+        finally:
+            connection.close()
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("Could not save playback progress")
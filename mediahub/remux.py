@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+import threading
+import subprocess
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from .scanner import file_hash
+
+_remuxes = {}  # media key -> Remux
+_remuxes_lock = threading.Lock()
+_failed = set()  # media keys ffmpeg could not remux, served as they are
+
+
+class Remux:
+    """
+    ffmpeg copying the streams of `path` into a fragmented MP4 (no re-encoding). It writes to a
+    per-process part file, which is renamed to `out` once ffmpeg succeeded. Fragmented output can
+    be played while it is being written.
+    """
+
+    def __init__(self, path, out):
+        self.out = out
+        self.part = out.with_name(f"{out.stem}.{os.getpid()}.part")
+        self.proc = subprocess.Popen([
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", path,
+            "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy",
+            "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+            "-f", "mp4", str(self.part),
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.done = threading.Event()
+        threading.Thread(target=self.wait, daemon=True).start()
+
+    def wait(self):
+        try:
+            if self.proc.wait() == 0:
+                os.replace(self.part, self.out)
+            else:
+                _failed.add(self.out.stem)
+        finally:
+            self.part.unlink(missing_ok=True)
+            with _remuxes_lock:
+                _remuxes.pop(self.out.stem, None)
+            self.done.set()
+
+    def ready(self, timeout):
+        """
+        Wait until ffmpeg wrote its first bytes or exited, at most `timeout` seconds.
+        False if the remux failed, the file is then served as it is.
+        """
+        deadline = time.monotonic() + timeout
+        while not self.done.is_set() and time.monotonic() < deadline:
+            try:
+                if self.part.stat().st_size:
+                    return True
+            except FileNotFoundError:
+                pass
+            self.done.wait(0.1)
+        return not (self.done.is_set() and self.out.stem in _failed)
+
+    def follow(self, block_size):
+        """Yield the part file as ffmpeg writes it, until ffmpeg exits."""
+        while True:
+            try:
+                f = open(self.part, "rb")
+                break
+            except FileNotFoundError:
+                if self.done.is_set():
+                    # finished (or failed) before the first read
+                    if not self.out.exists():
+                        return
+                    f = open(self.out, "rb")
+                    break
+                time.sleep(0.1)
+
+        with f:
+            while True:
+                finished = self.done.is_set()
+                data = f.read(block_size)
+                if data:
+                    yield data
+                elif finished:
+                    return
+                else:
+                    time.sleep(0.2)
+
+
+    async def afollow(self, block_size):
+        """follow() for the async stream view, reads run in the default executor."""
+        while not self.part.exists() and not self.done.is_set():
+            await asyncio.sleep(0.1)
+        try:
+            f = await asyncio.to_thread(open, self.part, "rb")
+        except FileNotFoundError:
+            if not self.out.exists():
+                return
+            f = await asyncio.to_thread(open, self.out, "rb")
+
+        try:
+            while True:
+                finished = self.done.is_set()
+                data = await asyncio.to_thread(f.read, block_size)
+                if data:
+                    yield data
+                elif finished:
+                    return
+                else:
+                    await asyncio.sleep(0.2)
+        finally:
+            f.close()
+
+
+def remux_path(item):
+    return settings.REMUX_DIR / f"{file_hash(item.file_path)}.mp4"
+
+def evict_remuxes():
+    """Delete least recently played remuxes until REMUX_DIR is below REMUX_CACHE_MAX_BYTES."""
+    entries = []
+    for entry in os.scandir(settings.REMUX_DIR):
+        if entry.name.endswith(".mp4"):
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= settings.REMUX_CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total -= size
+
+def get_remux(item):
+    """
+    Returns (path, None) if the remux of `item` is cached, otherwise (None, Remux) for
+    the running remux, started here if needed. One remux per file and process.
+    (None, None) means remuxing this file failed (or ffmpeg could not be started).
+    """
+    out = remux_path(item)
+    with _remuxes_lock:
+        if out.exists():
+            os.utime(out)  # LRU stamp
+            return out, None
+        if out.stem in _failed:
+            return None, None
+
+        job = _remuxes.get(out.stem)
+        if job is None:
+            evict_remuxes()
+            try:
+                job = _remuxes[out.stem] = Remux(item.file_path, out)
+            except OSError:
+                # ffmpeg missing or not executable
+                _failed.add(out.stem)
+                return None, None
+        return None, job
+
+def progressive_response(job, asynchronous=False):
+    """
+    200 response streaming a remux that is still running. Without a final size there are no
+    ranges, the player can only seek within what it buffered until the remux is cached.
+    """
+    follow = job.afollow if asynchronous else job.follow
+    resp = StreamingHttpResponse(follow(settings.STREAM_BUFFER_SIZE), content_type="video/mp4")
+    resp["Cache-Control"] = "no-store"
+    return resp
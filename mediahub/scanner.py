@@ -1,31 +1,84 @@
 import os
-import yaml
+import fcntl
 import hashlib
-import requests
 from pathlib import Path
 from django.conf import settings
-from .models import Library, MediaItem, FolderItem, Collection
-from django.utils.text import slugify
+from django.core.cache import cache
+from .models import Library, MediaItem, FolderItem, Collection, DirectoryState, EncodeState, SubtitleItem
+from .config import get_config
+from django.db import connection, transaction
+from django.db.models import Q
 import threading
-from urllib.parse import quote
-from PIL import Image
-import subprocess
 from .util import genres_dict
+from .probe import ProbePool
+from .artwork import fetch_artwork, trim_cache
+from .tmdb import get_client
+from .enrichment import queue_enrichment
+from .fuzzy import mark_changed
+from .subtitles import SUBTITLE_EXTS, local_path, queue_local_subtitles, sidecar_language
+from . import viewcache
 from django_q.tasks import async_task
 import re
+import time
 import logging
 
-_scan_lock = threading.Lock()
+
+
+class ScanLock:
+    """
+    Lock around everything that writes libraries. The web workers, the qcluster and
+    watch_libraries are separate processes, so it is a flock() on settings.SCAN_LOCK_FILE,
+    plus a threading.Lock for the threads of one process (flock is per open file).
+    """
+
+    def __init__(self):
+        self.thread_lock = threading.Lock()
+        self.fd = None
+
+    def acquire(self, blocking=True):
+        if not self.thread_lock.acquire(blocking):
+            return False
+        fd = os.open(settings.SCAN_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BaseException:
+            os.close(fd)
+            self.thread_lock.release()
+            if blocking:
+                raise
+            return False
+        self.fd = fd
+        return True
+
+    def release(self):
+        fd, self.fd = self.fd, None
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+        self.thread_lock.release()
+
+    def locked(self):
+        """True if a scan is running in any process."""
+        if not self.acquire(blocking=False):
+            return True
+        self.release()
+        return False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+_scan_lock = ScanLock()
+# scan_once of all libraries running in this thread, it applies a config.yaml change itself
+_scanning = threading.local()
 logger = logging.getLogger(__name__)
 
 ALLOWED_VIDEO_EXTS = {".mp4", ".mkv", ".avi", ".mov"}
 ALLOWED_IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
 
-def load_config():
-    cfg_path = settings.BASE_DIR / "config.yaml"
-    with open(cfg_path, "r") as f:
-        return yaml.safe_load(f)
-
 def file_hash(path):
     h = hashlib.sha1()
     h.update(str(path).encode())
@@ -33,66 +86,48 @@ def file_hash(path):
     return h.hexdigest()
 
 def tmdb_fetch(title, year):
-    api_key = settings.TMDB_API_KEY
-    if not api_key:
+    """
+    Look a movie up on TMDB. Returns None if TMDB is not configured or has no match,
+    raises TMDBError if TMDB could not be reached.
+    """
+    if not settings.TMDB_API_KEY:
         return None
-    
-    try:
-        r = requests.get(
-            'https://api.themoviedb.org/3/search/movie',
-            params={
-                'query': quote(title),
-                'include_adult': True, 
-                'language': 'en', 
-                'page': 1,
-                'year': year,
-                'api_key': api_key
-                },
-            headers={'accept': 'application/json'},
-            timeout=10
-        )
-        data = r.json()
-        if data["total_results"] < 1:
-            return None
-        data = data["results"][0]
-        otitle = data.get('original_title', title)
-        poster_path = data.get('poster_path')
-        backdrop_path = data.get('backdrop_path')
-        poster_url = "https://image.tmdb.org/t/p/w500" + poster_path if poster_path else None
-        backdrop_url = "https://image.tmdb.org/t/p/original" + backdrop_path if backdrop_path else poster_url
-
-        description = data.get('overview')
-
-        genre_ids = data.get('genre_ids')
-        id = data.get('id')
-
-        genres = []
-        for gid in genre_ids:
-            genres.append(genres_dict[gid])
-
-        r = requests.get(
-            f"https://api.themoviedb.org/3/movie/{id}",
-            params={"api_key": api_key, "language": "en"},
-            headers={'accept': 'application/json'},
-            timeout=10
-        )
-        details = r.json()
-
-        collection = details.get('belongs_to_collection')
-
-        return {
-            "title": otitle, 
-            "poster_url": poster_url, 
-            "backdrop_url": backdrop_url, 
-            "description": description,
-            "genres": genres,
-            "id": id,
-            "collection": collection,
-        }
-    except Exception:
+
+    client = get_client()
+
+    data = client.search_movie(title, year)
+    if data.get("total_results", 0) < 1:
         return None
+    data = data["results"][0]
+    otitle = data.get('original_title', title)
+    poster_path = data.get('poster_path')
+    backdrop_path = data.get('backdrop_path')
+    poster_url = "https://image.tmdb.org/t/p/w500" + poster_path if poster_path else None
+    backdrop_url = "https://image.tmdb.org/t/p/original" + backdrop_path if backdrop_path else poster_url
+
+    description = data.get('overview')
+
+    genre_ids = data.get('genre_ids') or []
+    id = data.get('id')
+
+    genres = [genres_dict[gid] for gid in genre_ids if gid in genres_dict]
+
+    details = client.movie(id)
+
+    collection = details.get('belongs_to_collection')
+
+    return {
+        "title": otitle, 
+        "poster_url": poster_url, 
+        "backdrop_url": backdrop_url, 
+        "description": description,
+        "genres": genres,
+        "id": id,
+        "collection": collection,
+    }
 
 def tmdb_get(id):
+    """Fill title, description, artwork etc. of a MediaItem from TMDB. Returns False if TMDB has no match."""
     media_item = MediaItem.objects.get(id=id)
     # fetch TMDB
     tmdb = tmdb_fetch(media_item.title, media_item.year)
@@ -117,19 +152,14 @@ def tmdb_get(id):
 
         # either backdrop has its own url, or its the poster_url so this is ok
         if tmdb.get("poster_url") and tmdb["poster_url"] != "N/A":
-
-            movie_hash = file_hash(media_item.file_path)
-            poster_cache = f"{movie_hash}.jpg"
-            poster_path = settings.POSTER_DIR / poster_cache
-            backdrop_cache = f"{movie_hash}.jpg"
-            backdrop_path = settings.BACKDROP_DIR / backdrop_cache
-
-            store_image(poster_path, tmdb["poster_url"])
-            store_image(backdrop_path, tmdb["backdrop_url"])
-            
-            media_item.poster = poster_cache
-            media_item.backdrop = backdrop_cache
+            media_item.poster = fetch_artwork(settings.POSTER_DIR, tmdb["poster_url"])
+            media_item.backdrop = fetch_artwork(settings.BACKDROP_DIR, tmdb["backdrop_url"])
         media_item.save()
+        viewcache.bump(media_item.library.slug)
+        trim_cache()
+        return True
+
+    return False
 
 def get_first_image(folder_path):
     for root, dirs, files in os.walk(folder_path):
@@ -139,165 +169,574 @@ def get_first_image(folder_path):
     return None
 
 
-def get_image_size(path):
-    try:
-        with Image.open(path) as img:
-            return img.width, img.height
-    except Exception:
+def parse_title(filename):
+    """Derive (title, year) from a file name like "The_Matrix-1999.mkv"."""
+    name = os.path.splitext(filename)[0]
+    name = name.replace("-", " ").replace("_", " ").strip()
+
+    match = re.search(r"(.*)\b(\d{4})$", name)
+    if match:
+        return match.group(1).strip(), int(match.group(2))
+    return name.strip(), None
+
+PROBE_FIELDS = ["width", "height", "duration", "video_codec", "audio_codec"]
+
+class ScanWriter:
+    """
+    Collects the files found while walking a library and writes them with
+    bulk_create / bulk_update, one transaction per batch. Metadata of new files
+    is read on a ProbePool while the walk continues and joined back in flush().
+    """
+
+    def __init__(self, library, batch_size=None, reprobe=False, preload=True):
+        self.library = library
+        self.batch_size = batch_size or settings.SCAN_BATCH_SIZE
+        # also probe known files that have no metadata yet (e.g. scanned before probing existed)
+        self.reprobe = reprobe
+        self.pool = ProbePool()
+        # tiles of hidden libraries and the player of unsynced ones show a frame of the video
+        self.previews = settings.PREVIEW_PREGENERATE and (library.hidden or not library.sync)
+        # file_path -> (id, folder_id, file_size, poster, is_video, probed, file_mtime)
+        # a full walk lists every file and loads them all with one query, an incremental one
+        # only loads the files of the directories that changed, see load()
+        self.preload = preload
+        self.existing = dict(self.known_rows(MediaItem.objects.filter(library=library))) if preload else {}
+        # path -> (mtime, inode) and path -> FolderItem of the library, loaded on first use by incremental walks
+        self.states = None
+        self.folders = None
+        self.children = None
+        self.to_create = []  # (MediaItem, probe future)
+        self.to_update = {}
+        self.to_reprobe = {}  # id -> probe future
+        self.enrich_ids = set()  # synced videos without poster, handed to queue_enrichment in finish()
+        self.rewritten = set()  # ids of known files whose size or mtime changed
+        self.sidecars = []  # subtitle files listed during the walk, matched to their videos in finish()
+        self.subtitle_tracks = {}  # video id -> embedded text subtitles found by the probe
+        # every file / directory path listed during the walk, used for pruning after a full scan
+        self.seen_files = set()
+        self.seen_dirs = set()
+        self.rows = 0
+        self.started = time.monotonic()
+
+    @staticmethod
+    def known_rows(items):
+        for path, pk, folder_id, size, poster, is_video, width, video_codec, mtime in items.values_list(
+            "file_path", "id", "folder_id", "file_size", "poster", "is_video", "width", "video_codec", "file_mtime"
+        ).iterator():
+            yield path, (pk, folder_id, size, poster, is_video, (video_codec if is_video else width) is not None, mtime)
+
+    def load(self, paths):
+        """Load the known rows of `paths` (the files of one listed directory) if they were not preloaded."""
+        if self.preload:
+            return
+        paths = [path for path in paths if path not in self.existing]
+        for i in range(0, len(paths), self.batch_size):
+            items = MediaItem.objects.filter(library=self.library, file_path__in=paths[i:i + self.batch_size])
+            self.existing.update(self.known_rows(items))
+
+    def dir_state(self, path):
+        """(mtime, inode) of `path` at the last scan, or None."""
+        if self.states is None:
+            self.states = {
+                path: (mtime, inode)
+                for path, mtime, inode in self.library.directory_states.values_list("path", "mtime", "inode").iterator()
+            }
+        return self.states.get(path)
+
+    def known_folder(self, path):
+        self.load_folders()
+        return self.folders.get(path)
+
+    def subfolders(self, folder_item):
+        """Known subfolders of `folder_item` (top level folders for None)."""
+        self.load_folders()
+        return self.children.get(folder_item.id if folder_item else None, [])
+
+    def load_folders(self):
+        if self.folders is not None:
+            return
+        self.folders = {}
+        self.children = {}
+        for folder in self.library.folders.only("id", "library_id", "parent_id", "path").iterator():
+            self.folders[folder.path] = folder
+            self.children.setdefault(folder.parent_id, []).append(folder)
+
+    def add(self, entry, folder_item):
+        """Queue the file behind the os.DirEntry `entry` located in `folder_item`."""
+        full_path = entry.path
+        folder_id = folder_item.id if folder_item else None
+        known = self.existing.get(full_path)
+
+        if known is None:
+            ext = os.path.splitext(entry.name)[-1].lower()
+            if ext in SUBTITLE_EXTS:
+                self.sidecars.append(full_path)
+                return
+            if ext not in ALLOWED_VIDEO_EXTS | ALLOWED_IMAGE_EXTS:
+                return
+
+            is_video = ext in ALLOWED_VIDEO_EXTS
+            title, year = parse_title(entry.name)
+            st = entry.stat()
+
+            item = MediaItem(
+                file_path=full_path,
+                library=self.library,
+                folder=folder_item,
+                file_size=st.st_size,
+                file_mtime=st.st_mtime_ns,
+                title=title,
+                year=year,
+                poster=None,
+                is_video=is_video,
+                ext=ext,
+            )
+            self.to_create.append((item, self.pool.submit(full_path, is_video, self.previews)))
+        else:
+            item_id, known_folder_id, known_size, poster, is_video, probed, known_mtime = known
+            st = entry.stat()
+            size, mtime = st.st_size, st.st_mtime_ns
+            if known_folder_id != folder_id or known_size != size or known_mtime != mtime:
+                self.to_update[item_id] = MediaItem(id=item_id, folder_id=folder_id, file_size=size, file_mtime=mtime)
+            if self.library.sync and is_video and poster is None:
+                self.enrich_ids.add(item_id)
+
+            # a file that changed size or mtime was rewritten (or still being copied when first seen),
+            # rows scanned before the mtime was stored only get it filled in
+            rewritten = known_size != size or (known_mtime is not None and known_mtime != mtime)
+            if rewritten:
+                self.rewritten.add(item_id)
+            if (self.reprobe and not probed) or rewritten:
+                self.to_reprobe[item_id] = self.pool.submit(full_path, is_video, self.previews)
+
+        if len(self.to_create) + len(self.to_update) + len(self.to_reprobe) >= self.batch_size:
+            self.flush()
+
+    def pending_ids(self):
+        return set(self.to_update)
+
+    def forget(self, paths):
+        """Drop deleted files from the preloaded set so they are not updated later."""
+        for path in paths:
+            self.existing.pop(path, None)
+
+    def flush(self):
+        if not self.to_create and not self.to_update and not self.to_reprobe:
+            return
+
+        new_items = []
+        new_tracks = []
+        for item, future in self.to_create:
+            info = future.result()
+            new_tracks.append(info.pop("subtitle_tracks", None))
+            for field, value in info.items():
+                setattr(item, field, value)
+            new_items.append(item)
+
+        probed = []
+        for item_id, future in self.to_reprobe.items():
+            item = MediaItem(id=item_id, **{field: None for field in PROBE_FIELDS})
+            info = future.result()
+            tracks = info.pop("subtitle_tracks", None)
+            if tracks:
+                self.subtitle_tracks[item_id] = tracks
+            for field, value in info.items():
+                setattr(item, field, value)
+            probed.append(item)
+
+        with transaction.atomic():
+            created = MediaItem.objects.bulk_create(new_items, batch_size=self.batch_size)
+            MediaItem.objects.bulk_update(
+                list(self.to_update.values()), ["folder", "file_size", "file_mtime"], batch_size=self.batch_size
+            )
+            MediaItem.objects.bulk_update(probed, PROBE_FIELDS, batch_size=self.batch_size)
+
+        for item, tracks in zip(created, new_tracks):
+            self.existing[item.file_path] = (
+                item.id, item.folder_id, item.file_size, item.poster, item.is_video, True, item.file_mtime
+            )
+            if self.library.sync and item.is_video:
+                self.enrich_ids.add(item.id)
+            if tracks:
+                self.subtitle_tracks[item.id] = tracks
+
+        self.rows += len(new_items) + len(self.to_update) + len(probed)
+        self.to_create = []
+        self.to_update = {}
+        self.to_reprobe = {}
+
+    def video_of(self, sub_path):
+        """Known video a subtitle file belongs to: "Movie.srt" / "Movie.en.srt" -> "Movie.<ext>"."""
+        folder, name = os.path.split(sub_path)
+        stem = os.path.splitext(name)[0]
+        for base in (stem, os.path.splitext(stem)[0]):
+            for ext in ALLOWED_VIDEO_EXTS:
+                for candidate in (base + ext, base + ext.upper()):
+                    known = self.existing.get(os.path.join(folder, candidate))
+                    if known is not None and known[4]:
+                        return os.path.join(folder, candidate), known[0]
         return None, None
 
-def store_image(path, url):
-    if not path.exists():
+    def match_sidecars(self):
+        """Add the subtitle files not imported yet to the tracks of their videos."""
+        if not self.sidecars:
+            return
+        imported = set(
+            SubtitleItem.objects.filter(media_item__library=self.library, path__startswith="local/")
+                .values_list("path", flat=True)
+        )
+        for sub_path in self.sidecars:
+            video_path, item_id = self.video_of(sub_path)
+            if item_id is None:
+                continue
+            try:
+                if local_path(sub_path) in imported:
+                    continue
+            except OSError:
+                continue
+            self.subtitle_tracks.setdefault(item_id, []).append(
+                {"file": sub_path, "lang": sidecar_language(sub_path, video_path)}
+            )
+
+    def close(self):
+        """Release the probe threads of a walk that failed, queued probes are dropped (no-op after finish())."""
+        self.pool.shutdown(cancel=True)
+
+    def finish(self):
         try:
-            resp = requests.get(url, stream=True, timeout=20)
-            if resp.status_code == 200:
-                with open(path, "wb") as fh:
-                    for chunk in resp.iter_content(1024):
-                        fh.write(chunk)
-        except Exception:
-            pass
-
-def scan_folder(library, path, parent_folder=None):
+            self.flush()
+        finally:
+            self.pool.shutdown()
+        queue_enrichment(self.enrich_ids)
+        # the ladder of a rewritten file is encoded again, queue_encodes creates the new state
+        rewritten = list(self.rewritten)
+        for i in range(0, len(rewritten), self.batch_size):
+            EncodeState.objects.filter(media_item_id__in=rewritten[i:i + self.batch_size]).delete()
+        self.match_sidecars()
+        # converted / extracted to VTT on the django-q workers, the player only lists the results
+        queue_local_subtitles(self.subtitle_tracks)
+        elapsed = time.monotonic() - self.started
+        if self.rows:
+            print(f"Scanned {self.library.name}: {self.rows} rows written in {elapsed:.1f}s "
+                  f"({self.rows / max(elapsed, 1e-6):.0f} rows/s)")
+
+def delete_ids(model, ids, chunk_size=None):
+    """Delete rows of `model` by primary key, one query per chunk instead of one per row."""
+    ids = list(ids)
+    chunk_size = chunk_size or settings.SCAN_BATCH_SIZE
+    for i in range(0, len(ids), chunk_size):
+        model.objects.filter(id__in=ids[i:i + chunk_size]).delete()
+    return len(ids)
+
+def prune_library(library, seen_files, seen_dirs):
+    """Remove items, folders and directory states of `library` that were not seen during a full walk."""
+    stale_items = [
+        pk for pk, path in library.items.values_list("id", "file_path").iterator()
+        if path not in seen_files
+    ]
+    stale_folders = [
+        pk for pk, path in library.folders.values_list("id", "path").iterator()
+        if path not in seen_dirs
+    ]
+    stale_states = [
+        pk for pk, path in library.directory_states.values_list("id", "path").iterator()
+        if path not in seen_dirs and path != library.path
+    ]
+
+    removed_items = delete_ids(MediaItem, stale_items)
+    removed_folders = delete_ids(FolderItem, stale_folders)
+    delete_ids(DirectoryState, stale_states)
+
+    if removed_items or removed_folders:
+        print(f"Pruned {library.name}: {removed_items} files, {removed_folders} folders removed")
+
+# every folder of a library paired with itself and all folders below it, summed up per ancestor
+FOLDER_TOTALS_SQL = """
+WITH RECURSIVE tree(ancestor, folder) AS (
+    SELECT id, id FROM {folders} WHERE library_id = %s
+    UNION ALL
+    SELECT tree.ancestor, f.id FROM tree JOIN {folders} f ON f.parent_id = tree.folder
+),
+totals(id, size, items) AS (
+    SELECT tree.ancestor, COALESCE(SUM(m.file_size), 0), COUNT(m.id)
+    FROM tree LEFT JOIN {items} m ON m.folder_id = tree.folder
+    GROUP BY tree.ancestor
+)
+UPDATE {folders} SET
+    total_size = (SELECT size FROM totals WHERE totals.id = {folders}.id),
+    total_items = (SELECT items FROM totals WHERE totals.id = {folders}.id)
+WHERE library_id = %s
+"""
+
+def update_folder_totals(library):
+    """Recompute FolderItem.total_size / total_items of the whole library with one recursive query."""
+    sql = FOLDER_TOTALS_SQL.format(folders=FolderItem._meta.db_table, items=MediaItem._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [library.id, library.id])
+
+def dir_fingerprint(path):
+    """Return the (mtime_ns, inode) pair used to detect directory changes."""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_ino
+
+def scan_folder(library, path, parent_folder=None, full=True, writer=None):
     """
     Recursively scan a folder, create FolderItem and MediaItem objects.
     :param library: Library instance
     :param path: absolute path of the folder to scan
     :param parent_folder: FolderItem instance of parent folder (None for root)
+    :param full: if False, directories whose mtime/inode did not change since
+                 the last scan are not listed again, only their known subfolders are visited
+    :param writer: ScanWriter shared by the whole walk (created and flushed here if None)
     """
 
+    if writer is None:
+        writer = ScanWriter(library, preload=full)
+        try:
+            scan_folder(library, path, parent_folder, full=full, writer=writer)
+            writer.finish()
+        finally:
+            writer.close()
+        return
+
+    try:
+        mtime, inode = dir_fingerprint(path)
+    except FileNotFoundError:
+        return
+
+    unchanged = not full and writer.dir_state(path) == (mtime, inode)
+
     if path != library.path:
-        folder_name = os.path.basename(path.rstrip("/")) or path  # handle root
-        poster = get_first_image(path)  # your function to get first image
-        folder_item, _ = FolderItem.objects.update_or_create(
-            library=library,
-            parent=parent_folder,
-            path=path,
-            defaults={
-                "name": folder_name,
-                "poster": poster
-            }
-        )
+        folder_item = None
+        if unchanged:
+            folder_item = writer.known_folder(path)
+            unchanged = folder_item is not None
+
+        if not unchanged:
+            folder_name = os.path.basename(path.rstrip("/")) or path  # handle root
+            poster = get_first_image(path)  # your function to get first image
+            folder_item, _ = FolderItem.objects.update_or_create(
+                library=library,
+                parent=parent_folder,
+                path=path,
+                defaults={
+                    "name": folder_name,
+                    "poster": poster
+                }
+            )
     else:
         folder_item = None
 
+    if unchanged:
+        # nothing was added or removed directly in here, only descend into the known subfolders
+        for sub in writer.subfolders(folder_item):
+            scan_folder(library, sub.path, parent_folder=folder_item, full=full, writer=writer)
+        return
+
+    seen_files = set()
+    seen_dirs = set()
+    files = []
+
     # Scan directory
     with os.scandir(path) as it:
         for entry in it:
             full_path = entry.path
             if entry.is_dir():
+                seen_dirs.add(full_path)
+                writer.seen_dirs.add(full_path)
                 # Recursively scan subfolder
-                scan_folder(library, full_path, parent_folder=folder_item)
+                scan_folder(library, full_path, parent_folder=folder_item, full=full, writer=writer)
             elif entry.is_file():
+                seen_files.add(full_path)
+                writer.seen_files.add(full_path)
+                files.append(entry)
+
+    writer.load(seen_files)
+    for entry in files:
+        writer.add(entry, folder_item)
+
+    if not full:
+        # reconcile deletions inside this directory only
+        # files moved into a directory that was already listed are pending an update, keep them
+        removed_files = list(
+            library.items.filter(folder=folder_item)
+            .exclude(file_path__in=seen_files)
+            .exclude(id__in=writer.pending_ids())
+            .values_list("id", "file_path")
+        )
+        for _, file_path in removed_files:
+            print(f"File removed, deleting {file_path}")
+        writer.forget(file_path for _, file_path in removed_files)
+        delete_ids(MediaItem, [pk for pk, _ in removed_files])
+
+        if folder_item:
+            known_dirs = folder_item.subfolders.all()
+        else:
+            known_dirs = library.folders.filter(parent__isnull=True)
+        for folder in known_dirs.exclude(path__in=seen_dirs):
+            print(f"Folder removed, deleting {folder.path}")
+            # files moved out of the removed tree must be re-parented before the cascade
+            writer.flush()
+            prefix = folder.path.rstrip("/") + "/"
+            library.directory_states.filter(Q(path=folder.path) | Q(path__startswith=prefix)).delete()
+            writer.forget(library.items.filter(file_path__startswith=prefix).values_list("file_path", flat=True))
+            folder.delete()
+
+    DirectoryState.objects.update_or_create(
+        library=library,
+        path=path,
+        defaults={"mtime": mtime, "inode": inode}
+    )
+
+
+def scan_once(full=False, only=None):
+    """
+    Synchronise the database with all libraries from config.yaml.
+    :param full: re-list every directory and check every known file on disk,
+                 instead of only looking into directories that changed since the last scan
+    :param only: names of the libraries to scan (default all), libraries no longer
+                 in config.yaml are removed either way
+    """
+    # mediahub.ladder imports this module (through hls)
+    from .ladder import prune_ladder, queue_encodes
 
-                if not MediaItem.objects.filter(file_path = full_path).exists():
-                    ext = os.path.splitext(entry.name)[-1].lower()
-                    if ext not in ALLOWED_VIDEO_EXTS | ALLOWED_IMAGE_EXTS:
-                        continue
-
-                    is_video = ext in ALLOWED_VIDEO_EXTS
-                    width, height = get_image_size(full_path)
-                    size = os.path.getsize(full_path)
-
-                    name = os.path.splitext(entry.name)[0]
-                    name = name.replace("-", " ").replace("_", " ").strip()
-
-                    match = re.search(r"(.*)\b(\d{4})$", name)
-                    if match:
-                        title = match.group(1).strip()
-                        year = int(match.group(2))
-                    else:
-                        title = name.strip()
-                        year = None
-
-                    media_item, _ = MediaItem.objects.update_or_create(
-                        file_path=full_path,
-                        library=library,
-                        folder=folder_item,
-                        width=width,
-                        height=height,
-                        file_size=size,
-                        defaults={
-                            "title": title,
-                            "year": year,
-                            "poster": None,
-                            "is_video": is_video,
-                            "ext": ext
-                        }
-                    )
-                else:
-                    media_item = MediaItem.objects.get(file_path = full_path)
-                
-                if media_item.library.sync and media_item.is_video and media_item.poster == None:
-                    async_task("mediahub.scanner.tmdb_get", media_item.id)
-
-
-def scan_once():
     _scan_lock.acquire()
+    _scanning.all = only is None
+    rewritten = False
+
+    try:
+        config = get_config()
+        library_names = config.library_names()
+
+        for db_lib in Library.objects.all():
+            if db_lib.name not in library_names:
+                print(f"Removing library {db_lib.name} (not in config)")
+                db_lib.delete()
+                viewcache.bump(db_lib.slug)
+
+        for lib in config.libraries:
+            if only is not None and lib.name not in only:
+                continue
+
+            old_path = Library.objects.filter(slug=lib.slug).values_list("path", flat=True).first()
+            library, _ = Library.objects.update_or_create(
+                slug=lib.slug,
+                defaults={
+                    "name": lib.name,
+                    "path": lib.path,
+                    "hidden": lib.hidden,
+                    "sync": lib.sync,
+                    "pre_encode": lib.pre_encode,
+                    "type": lib.type
+                },
+            )
 
-    cfg = load_config()
-    libraries = cfg.get("libraries", [])
+            # a moved library is walked completely, the prune drops everything from the old location
+            lib_full = full or (old_path is not None and old_path != library.path)
 
-    library_names = set(lib["name"] for lib in libraries)
+            writer = ScanWriter(library, reprobe=lib_full, preload=lib_full)
+            try:
+                scan_folder(library, library.path, parent_folder=None, full=lib_full, writer=writer)
+                writer.finish()
+            finally:
+                writer.close()
 
-    for db_lib in Library.objects.all():
-        if db_lib.name not in library_names:
-            print(f"Removing library {db_lib.name} (not in config)")
-            db_lib.delete()
+            # never prune an unmounted / missing library root, that would wipe the whole library
+            if lib_full and os.path.isdir(library.path):
+                prune_library(library, writer.seen_files, writer.seen_dirs)
 
-    for item in MediaItem.objects.all():
-        if not os.path.exists(item.file_path):
-            print(f"File removed, deleting {item.file_path}")
-            item.delete()
-        
-    for folder in FolderItem.objects.all():
-        if not os.path.exists(folder.path):
-            print(f"Folder removed, deleting {folder.path}")
-            folder.delete()
+            update_folder_totals(library)
+            viewcache.bump(library.slug)
 
-    for lib in libraries:
-        lib_slug = slugify(lib["name"])
-        library, _ = Library.objects.update_or_create(
-            slug=lib_slug,
-            defaults={
-                "name": lib["name"],
-                "path": lib["path"],
-                "hidden": lib.get("hidden", False),
-                "sync": lib.get("sync", False),
-                "type": lib.get("type", "other")
-            },
-        )
+            queue_encodes(library)
+            rewritten = rewritten or bool(writer.rewritten)
 
-        scan_folder(library, library.path, parent_folder=None)
+        # ladders are keyed by path and mtime, a rewritten file leaves its old one behind
+        if full or rewritten:
+            prune_ladder()
 
-    _scan_lock.release()
+        mark_changed()
+    finally:
+        _scanning.all = False
+        _scan_lock.release()
 
-def scan_once_safe():
+def scan_directories(paths):
+    """
+    Apply changes below the given directories only, instead of a scan_once over all libraries.
+    Used by the watch_libraries command; every path is re-listed even if its mtime did not change.
+    :param paths: iterable of absolute directory paths that saw filesystem events
+    """
+    # mediahub.ladder imports this module (through hls)
+    from .ladder import prune_ladder, queue_encodes
+
+    rewritten = False
+    with _scan_lock:
+        for library in Library.objects.all():
+            root = library.path.rstrip("/")
+            targets = {}
+
+            for path in paths:
+                path = path.rstrip("/")
+                if path != root and not path.startswith(root + "/"):
+                    continue
+
+                # new or removed directories are handled by re-listing their closest known ancestor
+                folder = None
+                while path != root:
+                    folder = FolderItem.objects.filter(library=library, path=path).first()
+                    if folder and os.path.isdir(path):
+                        break
+                    folder = None
+                    path = os.path.dirname(path)
+
+                targets[folder.path if folder else library.path] = folder
+
+            # subdirectories are visited by their ancestor's scan anyway
+            roots = sorted(targets, key=len)
+            for path in roots:
+                if any(path.startswith(other.rstrip("/") + "/") for other in roots if other != path):
+                    del targets[path]
+
+            if not targets:
+                continue
+
+            # forget the fingerprints so the targets are listed again
+            library.directory_states.filter(path__in=list(targets)).delete()
+            writer = ScanWriter(library, preload=False)
+            try:
+                for path, folder in targets.items():
+                    scan_folder(library, path, parent_folder=folder.parent if folder else None, full=False, writer=writer)
+                writer.finish()
+            finally:
+                writer.close()
+            update_folder_totals(library)
+            viewcache.bump(library.slug)
+            queue_encodes(library)
+            rewritten = rewritten or bool(writer.rewritten)
+
+        if rewritten:
+            prune_ladder()
+        mark_changed()
+
+def rescan_changed(sender, added, changed, removed, stamp, **kwargs):
+    """
+    config_changed receiver: scan only the libraries that were added or changed in config.yaml.
+    Every web worker and the qcluster reload the file, the first one to claim the edit (in the
+    shared cache) queues the scan.
+    """
+    if not cache.add(f"config:rescan:{stamp[0]}:{stamp[1]}", True, 24 * 3600):
+        return
+    if getattr(_scanning, "all", False):
+        return  # noticed by a scan of every library, which uses the new config already
+
+    names = [lib.name for lib in added + changed]
+    logger.info("config.yaml changed, scanning %s", ", ".join(names) or "no libraries")
+    async_task("mediahub.scanner.scan_once", False, names)
+
+def scan_once_safe(full=False):
     lock = _scan_lock.locked()
 
     if not lock:
-        async_task("mediahub.scanner.scan_once")
+        async_task("mediahub.scanner.scan_once", full)
 
     return lock
-
-def capture_frame(video_path, output_path, time="00:00:05"):
-    """Capture a frame at 5 seconds (default)"""
-    subprocess.run([
-        "ffmpeg", "-y", "-ss", time, "-i", video_path,
-        "-vframes", "1", "-q:v", "2", str(output_path)
-    ], check=True)
-
-def get_preview(path):
-    # For videos → extract frame with ffmpeg
-    thumb_path = settings.CACHE_DIR / f"preview_{os.path.basename(path)}.jpg"
-    
-    if not thumb_path.exists():
-        try:
-            subprocess.run(
-                ["ffmpeg", "-y", "-i", path, "-ss", "00:00:02.000", "-vframes", "1", str(thumb_path)],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-        except Exception:
-            return None
-    
-    return thumb_path
\ No newline at end of file
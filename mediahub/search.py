@@ -0,0 +1,169 @@
+import re
+from django.db import connection
+from .models import FolderItem, Library, MediaItem
+
+# FTS5 tables over MediaItem title / description / genre and FolderItem name. They are
+# external content tables (the text stays in the model tables, only the index is stored),
+# kept in sync by triggers, so every write of the scanner (bulk_create, bulk_update, cascading
+# deletes) updates them in the same transaction.
+MEDIA_INDEX = "mediahub_search_media"
+FOLDER_INDEX = "mediahub_search_folder"
+
+# ids of MediaItems / FolderItems whose searchable columns changed, in order, filled by triggers
+# as well. The in-memory fuzzy index reads the entries after the last one it applied instead of
+# reloading every row; the oldest are pruned, an index that fell further behind reloads fully.
+CHANGES = "mediahub_search_changes"
+CHANGES_KEPT = 50_000
+
+# title matches count more than genre and description matches, folder names as much as titles
+MEDIA_RANK = "bm25(10.0, 1.0, 2.0)"
+FOLDER_RANK = "bm25(10.0)"
+
+SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {MEDIA_INDEX} USING fts5(
+        title, description, genre,
+        content='{MediaItem._meta.db_table}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FOLDER_INDEX} USING fts5(
+        name,
+        content='{FolderItem._meta.db_table}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS {CHANGES} (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, item INTEGER NOT NULL
+    )""",
+]
+
+def _triggers(index, table, columns, watched):
+    cols = ", ".join(columns)
+    new = ", ".join(f"new.{c}" for c in columns)
+    old = ", ".join(f"old.{c}" for c in columns)
+    delete = f"INSERT INTO {index}({index}, rowid, {cols}) VALUES ('delete', old.id, {old});"
+    insert = f"INSERT INTO {index}(rowid, {cols}) VALUES (new.id, {new});"
+    return {
+        f"{index}_ai": f"CREATE TRIGGER {index}_ai AFTER INSERT ON {table} BEGIN {insert} END",
+        f"{index}_ad": f"CREATE TRIGGER {index}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+        # only text changes touch the index, not the size / folder updates of every scan
+        f"{index}_au": f"CREATE TRIGGER {index}_au AFTER UPDATE OF {watched} ON {table} BEGIN {delete} {insert} END",
+    }
+
+def _change_triggers(kind, table, watched):
+    name = f"{CHANGES}_{kind}"
+    return {
+        f"{name}_ai": f"CREATE TRIGGER {name}_ai AFTER INSERT ON {table} BEGIN INSERT INTO {CHANGES}(kind, item) VALUES ('{kind}', new.id); END",
+        f"{name}_ad": f"CREATE TRIGGER {name}_ad AFTER DELETE ON {table} BEGIN INSERT INTO {CHANGES}(kind, item) VALUES ('{kind}', old.id); END",
+        f"{name}_au": f"CREATE TRIGGER {name}_au AFTER UPDATE OF {watched} ON {table} BEGIN INSERT INTO {CHANGES}(kind, item) VALUES ('{kind}', new.id); END",
+    }
+
+TRIGGERS = {
+    **_triggers(MEDIA_INDEX, MediaItem._meta.db_table, ["title", "description", "genre"], "title, description, genre"),
+    **_triggers(FOLDER_INDEX, FolderItem._meta.db_table, ["name"], "name"),
+}
+
+# the columns the fuzzy index keeps per document
+CHANGE_TRIGGERS = {
+    **_change_triggers("m", MediaItem._meta.db_table, "title, library_id, file_path, is_video, folder_id"),
+    **_change_triggers("f", FolderItem._meta.db_table, "name, library_id, path"),
+}
+
+def available():
+    return connection.vendor == "sqlite"
+
+def install(**kwargs):
+    """
+    post_migrate receiver: create the index tables and triggers, rebuilding the index if any
+    trigger was missing. Django recreates a table to alter it on SQLite, which drops its triggers,
+    so this runs after every migrate and not only once.
+    """
+    if not available():
+        return
+
+    with connection.cursor() as cursor:
+        for sql in SCHEMA:
+            cursor.execute(sql)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        existing = {name for name, in cursor.fetchall()}
+        missing = [sql for name, sql in TRIGGERS.items() if name not in existing]
+        for sql in missing + [sql for name, sql in CHANGE_TRIGGERS.items() if name not in existing]:
+            cursor.execute(sql)
+        if missing:
+            for index in (MEDIA_INDEX, FOLDER_INDEX):
+                cursor.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
+
+def last_change():
+    """Sequence number of the newest change ever logged, 0 if there was none."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [CHANGES])
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+def changes_since(seq):
+    """
+    (last seq, {("m" / "f", id), ...}) of the changes after `seq`, or None if some of them were
+    pruned already and the caller has to reload everything.
+    """
+    last = last_change()
+    if seq >= last:
+        return last, set()
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT MIN(seq) FROM {CHANGES}")
+        first, = cursor.fetchone()
+        if first is None or first > seq + 1:
+            return None
+        cursor.execute(f"SELECT kind, item FROM {CHANGES} WHERE seq > %s AND seq <= %s", [seq, last])
+        return last, set(cursor.fetchall())
+
+def prune_changes():
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {CHANGES} WHERE seq <= (SELECT MAX(seq) FROM {CHANGES}) - %s", [CHANGES_KEPT])
+
+def fts_query(text):
+    """Every word of `text` as a quoted prefix term, all of them must match. None if there are no words."""
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{w}"*' for w in words)
+
+def search(text, show_hidden=False, limit=5):
+    """
+    Best `limit` MediaItems and FolderItems for `text`, ranked by bm25 in SQLite.
+    The objects carry what search_view renders (library slug, folder path).
+    """
+    match = fts_query(text)
+    if match is None:
+        return []
+
+    hidden = "" if show_hidden else "AND l.hidden = 0"
+    # a single letter matches most of the library, ranking all of that costs more than it is worth
+    order = "ORDER BY s.rank" if max(len(w) for w in re.findall(r"\w+", text)) > 1 else ""
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT 'm', s.rowid, s.rank FROM {MEDIA_INDEX} s
+            JOIN {MediaItem._meta.db_table} m ON m.id = s.rowid
+            JOIN {Library._meta.db_table} l ON l.id = m.library_id
+            WHERE {MEDIA_INDEX} MATCH %s AND s.rank MATCH %s {hidden}
+            {order} LIMIT %s
+        """, [match, MEDIA_RANK, limit])
+        hits = cursor.fetchall()
+        cursor.execute(f"""
+            SELECT 'f', s.rowid, s.rank FROM {FOLDER_INDEX} s
+            JOIN {FolderItem._meta.db_table} f ON f.id = s.rowid
+            JOIN {Library._meta.db_table} l ON l.id = f.library_id
+            WHERE {FOLDER_INDEX} MATCH %s AND s.rank MATCH %s {hidden}
+            {order} LIMIT %s
+        """, [match, FOLDER_RANK, limit])
+        hits += cursor.fetchall()
+
+    # bm25 is lower for better matches
+    hits = sorted(hits, key=lambda h: h[2])[:limit]
+
+    media = MediaItem.objects.select_related("library", "folder").only(
+        "id", "title", "file_path", "is_video", "ext", "library__slug", "folder__path"
+    ).in_bulk([pk for kind, pk, _ in hits if kind == "m"])
+    folders = FolderItem.objects.select_related("library").only(
+        "id", "name", "library__slug"
+    ).in_bulk([pk for kind, pk, _ in hits if kind == "f"])
+
+    found = [(media if kind == "m" else folders).get(pk) for kind, pk, _ in hits]
+    return [obj for obj in found if obj is not None]
@@ -0,0 +1,307 @@
+import os
+import uuid
+import asyncio
+import threading
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+
+
+# more ranges than this in one request are answered with the whole file
+MAX_RANGES = 20
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, file_size):
+    """
+    Parse a Range header into a list of inclusive (start, end) byte ranges.
+    Handles "bytes=500-", "bytes=-500" (last 500 bytes) and "bytes=0-99,200-299"; overlapping
+    and adjacent ranges are merged, so no byte is sent twice.
+    Returns None if the header is missing or malformed (the full file is sent then),
+    raises RangeNotSatisfiable if no range overlaps the file.
+    """
+    if not header:
+        return None
+
+    unit, _, spec = header.strip().partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        start, sep, end = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if not start:
+                # suffix range: the last `end` bytes
+                length = int(end)
+                if length <= 0:
+                    continue
+                start, end = max(file_size - length, 0), file_size - 1
+            else:
+                start = int(start)
+                end = min(int(end), file_size - 1) if end else file_size - 1
+        except ValueError:
+            return None
+
+        if start > end or start >= file_size:
+            continue
+        ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+class RangeFile:
+    """
+    Read-only view on `length` bytes of an open file starting at `start`.
+
+    fileno() exposes the real descriptor positioned at `start`, so WSGI servers with
+    a sendfile-capable wsgi.file_wrapper (e.g. gunicorn) hand the range to the kernel
+    with os.sendfile, bounded by Content-Length. Everywhere else read() serves it in
+    blocks of the response's block_size.
+    """
+
+    def __init__(self, f, start, length):
+        self.f = f
+        self.remaining = length
+        f.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+
+
+def iter_ranges(path, ranges, block_size):
+    with open(path, "rb") as f:
+        for start, end in ranges:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(block_size, remaining))
+                if not data:
+                    return
+                yield data
+                remaining -= len(data)
+
+
+def multipart_parts(ranges, file_size, mime_type):
+    """Boundary, per-range part headers, closing delimiter and total length of a multipart/byteranges body."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, end in ranges:
+        head = (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {mime_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+        ).encode()
+        parts.append((head, start, end))
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    length = sum(len(head) + end - start + 1 for head, start, end in parts) + len(tail)
+    return boundary, parts, tail, length
+
+
+def multipart_response(path, ranges, file_size, mime_type):
+    """multipart/byteranges response for requests asking for more than one range."""
+    boundary, parts, tail, length = multipart_parts(ranges, file_size, mime_type)
+    block_size = settings.STREAM_BUFFER_SIZE
+
+    def body():
+        for head, start, end in parts:
+            yield head
+            yield from iter_ranges(path, [(start, end)], block_size)
+        yield tail
+
+    resp = StreamingHttpResponse(body(), status=206, content_type=f"multipart/byteranges; boundary={boundary}")
+    resp["Content-Length"] = str(length)
+    return resp
+
+
+def offload_response(path, mime_type):
+    """
+    Let the reverse proxy send the file, it takes care of ranges itself.
+    x-accel: nginx internal location STREAM_ACCEL_PREFIX that aliases the filesystem root,
+    x-sendfile: Apache mod_xsendfile / lighttpd.
+    """
+    resp = HttpResponse(content_type=mime_type)
+    if settings.STREAM_BACKEND == "x-accel":
+        resp["X-Accel-Redirect"] = settings.STREAM_ACCEL_PREFIX.rstrip("/") + quote(path)
+        resp["X-Accel-Buffering"] = "no"
+    else:
+        resp["X-Sendfile"] = path
+    return resp
+
+
+def file_response(request, path, mime_type):
+    """Full or partial (Range) response for the file at `path`, using settings.STREAM_BACKEND."""
+    if settings.STREAM_BACKEND in ("x-accel", "x-sendfile"):
+        return offload_response(path, mime_type)
+
+    file_size = os.path.getsize(path)
+
+    try:
+        ranges = parse_range(request.headers.get("Range"), file_size)
+    except RangeNotSatisfiable:
+        resp = HttpResponse(status=416)
+        resp["Content-Range"] = f"bytes */{file_size}"
+        return resp
+
+    if ranges and len(ranges) > 1:
+        resp = multipart_response(path, ranges, file_size, mime_type)
+    else:
+        start, end = ranges[0] if ranges else (0, file_size - 1)
+        length = max(end - start + 1, 0)
+
+        resp = FileResponse(RangeFile(open(path, "rb"), start, length), content_type=mime_type)
+        resp.block_size = settings.STREAM_BUFFER_SIZE
+        resp["Content-Length"] = str(length)
+        if ranges:
+            resp.status_code = 206
+            resp["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+
+    resp["Accept-Ranges"] = "bytes"
+    return resp
+
+
+class StreamLimiter:
+    """Counts open async streams per client address and in total for this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+        self.clients = {}
+
+    def acquire(self, client):
+        with self.lock:
+            if self.total >= settings.STREAM_MAX_TOTAL:
+                return False
+            if self.clients.get(client, 0) >= settings.STREAM_MAX_PER_CLIENT:
+                return False
+            self.total += 1
+            self.clients[client] = self.clients.get(client, 0) + 1
+            return True
+
+    def release(self, client):
+        with self.lock:
+            self.total -= 1
+            self.clients[client] -= 1
+            if not self.clients[client]:
+                del self.clients[client]
+
+
+limiter = StreamLimiter()
+
+
+class LimitedStreamingResponse(StreamingHttpResponse):
+    """Gives its StreamLimiter slot back when the response is closed, also if the client went away early."""
+
+    def __init__(self, *args, on_close=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self.on_close:
+                on_close, self.on_close = self.on_close, None
+                on_close()
+
+
+async def aiter_ranges(path, ranges, block_size):
+    """
+    Async version of iter_ranges, file I/O runs in the default executor. The ASGI server
+    only asks for the next chunk once the previous one was sent, so a slow or paused
+    client holds one buffer and no thread.
+    """
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        for start, end in ranges:
+            await asyncio.to_thread(f.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = await asyncio.to_thread(f.read, min(block_size, remaining))
+                if not data:
+                    return
+                yield data
+                remaining -= len(data)
+    finally:
+        f.close()
+
+
+async def async_file_response(request, path, mime_type):
+    """file_response() for ASGI: non-blocking reads and at most STREAM_MAX_PER_CLIENT / STREAM_MAX_TOTAL open streams."""
+    if settings.STREAM_BACKEND in ("x-accel", "x-sendfile"):
+        return offload_response(path, mime_type)
+
+    file_size = await asyncio.to_thread(os.path.getsize, path)
+
+    try:
+        ranges = parse_range(request.headers.get("Range"), file_size)
+    except RangeNotSatisfiable:
+        resp = HttpResponse(status=416)
+        resp["Content-Range"] = f"bytes */{file_size}"
+        return resp
+
+    client = request.META.get("REMOTE_ADDR", "")
+    if not limiter.acquire(client):
+        resp = HttpResponse("Too many open streams", status=503)
+        resp["Retry-After"] = "5"
+        return resp
+
+    block_size = settings.STREAM_BUFFER_SIZE
+    release = lambda: limiter.release(client)
+
+    if ranges and len(ranges) > 1:
+        boundary, parts, tail, length = multipart_parts(ranges, file_size, mime_type)
+
+        async def body():
+            for head, start, end in parts:
+                yield head
+                async for data in aiter_ranges(path, [(start, end)], block_size):
+                    yield data
+            yield tail
+
+        resp = LimitedStreamingResponse(
+            body(), status=206, content_type=f"multipart/byteranges; boundary={boundary}", on_close=release
+        )
+        resp["Content-Length"] = str(length)
+    else:
+        start, end = ranges[0] if ranges else (0, file_size - 1)
+        length = max(end - start + 1, 0)
+
+        resp = LimitedStreamingResponse(
+            aiter_ranges(path, [(start, end)], block_size), content_type=mime_type, on_close=release
+        )
+        resp["Content-Length"] = str(length)
+        if ranges:
+            resp.status_code = 206
+            resp["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+
+    resp["Accept-Ranges"] = "bytes"
+    return resp
@@ -3,10 +3,32 @@ import zipfile
 import os
 import io
 import re
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 from .models import SubtitleItem, MediaItem, Language
 from django_q.tasks import async_task
 
+# subtitle files next to a video ("Movie.srt", "Movie.en.srt") that the scanner picks up
+SUBTITLE_EXTS = {".srt", ".vtt"}
+# embedded subtitle codecs ffmpeg can write as WebVTT, bitmap ones (PGS, VobSub) are left out
+TEXT_SUBTITLE_CODECS = {"subrip", "ass", "ssa", "webvtt", "mov_text", "text"}
+
+# language tags of subtitle files (ISO 639-1) and tracks (ISO 639-2) -> Language code and name
+LANGUAGES = {
+    "en": "English", "de": "German", "fr": "French", "es": "Spanish", "it": "Italian",
+    "nl": "Dutch", "pt": "Portuguese", "ru": "Russian", "pl": "Polish", "cs": "Czech",
+    "sv": "Swedish", "da": "Danish", "no": "Norwegian", "fi": "Finnish", "tr": "Turkish",
+    "ja": "Japanese", "zh": "Chinese", "ko": "Korean", "ar": "Arabic", "th": "Thai",
+}
+ISO_639_2 = {
+    "eng": "en", "ger": "de", "deu": "de", "fre": "fr", "fra": "fr", "spa": "es", "ita": "it",
+    "dut": "nl", "nld": "nl", "por": "pt", "rus": "ru", "pol": "pl", "cze": "cs", "ces": "cs",
+    "swe": "sv", "dan": "da", "nor": "no", "fin": "fi", "tur": "tr", "jpn": "ja", "chi": "zh",
+    "zho": "zh", "kor": "ko", "ara": "ar", "tha": "th",
+}
+
 def search_subtitles_by_tmdb(tmdb_id: int, languages: str):
     """Search for subtitles via SubDL API given a TMDB ID, filtering by languages."""
     url = "https://api.subdl.com/api/v1/subtitles"
@@ -68,8 +90,12 @@ def download_subdl_subtitle(sub_info: dict, path: str) -> bool:
     except:
         return False
 
-def fetch_subtitles(vid: MediaItem):
-    """Main: fetch English subtitle via SubDL, store it under SUBTITLES_DIR/tmdb_id/."""
+def fetch_subtitles(item_id: int):
+    """django-q task: fetch English subtitles via SubDL, store them under SUBTITLES_DIR/tmdb_id/."""
+    vid = MediaItem.objects.filter(id=item_id).first()
+    if vid is None or not vid.tmdb_id or vid.subtitles.exists():
+        return
+
     tmdb_id = vid.tmdb_id
     languages = "EN" # comma separated list
     subs = search_subtitles_by_tmdb(tmdb_id, languages)
@@ -87,22 +113,157 @@ def fetch_subtitles(vid: MediaItem):
         if download_subdl_subtitle(sub, path):
             store_subtitle(vid=vid, path=f"{vid.tmdb_id}/{lang}/{fname}", lang=lang, language=sub.get("lang"))
 
-def get_or_fetch(vid: MediaItem):
-    subtitles = vid.subtitles.all()
-    if not subtitles:
-        async_task(fetch_subtitles, vid)
-    return subtitles
+def queue_subdl(item_id: int):
+    """Look for SubDL subtitles once, after TMDB matched the item (never from the player)."""
+    if settings.SUBDL_API_KEY:
+        async_task("mediahub.subtitles.fetch_subtitles", item_id)
 
 def srt_to_vtt(srt_path: str, vtt_path: str):
-    with open(srt_path, "r", encoding="utf-8") as srt_file:
-        srt_content = srt_file.read()
+    with open(srt_path, "rb") as srt_file:
+        raw = srt_file.read()
+    try:
+        srt_content = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        srt_content = raw.decode("latin-1")
 
-    # Replace commas with dots in timecodes
-    vtt_content = "WEBVTT\n\n" + srt_content.replace(",", ".")
+    # Replace commas with dots in timecodes (only there, the text keeps its commas)
+    vtt_content = "WEBVTT\n\n" + re.sub(r"(\d{2}:\d{2}:\d{2}),(\d{3})", r"\1.\2", srt_content.replace("\r\n", "\n"))
 
     with open(vtt_path, "w", encoding="utf-8") as vtt_file:
         vtt_file.write(vtt_content)
 
+def language_of(tag):
+    """(code, name) of a language tag such as "en", "eng" or None."""
+    tag = (tag or "").lower()
+    code = ISO_639_2.get(tag, tag)
+    if code in LANGUAGES:
+        return code.upper(), LANGUAGES[code]
+    return "UN", "Unknown"
+
+def sidecar_language(sub_path, video_path):
+    """Language tag of "Movie.en.srt" next to "Movie.mkv", None for "Movie.srt"."""
+    video_stem = os.path.splitext(os.path.basename(video_path))[0]
+    stem = os.path.splitext(os.path.basename(sub_path))[0]
+    return stem[len(video_stem) + 1:] or None
+
+def local_path(source, stream=None):
+    """VTT of a subtitle file or embedded track, relative to SUBTITLES_DIR."""
+    st = os.stat(source)
+    key = hashlib.sha1(f"{source}:{stream}:{st.st_mtime_ns}:{st.st_size}".encode()).hexdigest()
+    return f"local/{key[:2]}/{key}.vtt"
+
+def sidecars_of(video_path, names):
+    """Subtitle files among `names` (the listing of the video's directory) that belong to the video."""
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    found = []
+    for name in names:
+        sub_stem, ext = os.path.splitext(name)
+        if ext.lower() in SUBTITLE_EXTS and (sub_stem == stem or os.path.splitext(sub_stem)[0] == stem):
+            found.append(os.path.join(os.path.dirname(video_path), name))
+    return found
+
+def queue_local_subtitles(tracks):
+    """Convert the subtitles the scanner found, {media item id: [track, ...]}, on the django-q workers."""
+    for item_id, item_tracks in tracks.items():
+        async_task("mediahub.subtitles.import_subtitles", item_id, item_tracks)
+
+def find_local_subtitles(library_names=None):
+    """
+    Discover the subtitles of videos that were scanned before the scanner looked for them (it only
+    probes new or changed files): ffprobe every video without local subtitles, look for subtitle
+    files next to it and queue import_subtitles. Returns the number of videos queued.
+    :param library_names: only these libraries, default all
+    """
+    from .probe import probe_video
+
+    videos = MediaItem.objects.filter(is_video=True).exclude(subtitles__path__startswith="local/")
+    if library_names:
+        videos = videos.filter(library__name__in=library_names)
+    videos = list(videos.values_list("id", "file_path"))
+
+    listings = {}
+    queued = 0
+    with ThreadPoolExecutor(max_workers=settings.SCAN_PROBE_WORKERS) as pool:
+        for i in range(0, len(videos), settings.SCAN_BATCH_SIZE):
+            batch = videos[i:i + settings.SCAN_BATCH_SIZE]
+            probes = pool.map(lambda video: probe_video(video[1], subtitles=True), batch)
+            tracks = {}
+            for (item_id, path), info in zip(batch, probes):
+                folder = os.path.dirname(path)
+                if folder not in listings:
+                    try:
+                        listings[folder] = os.listdir(folder)
+                    except OSError:
+                        listings[folder] = []
+                item_tracks = info.get("subtitle_tracks", []) + [
+                    {"file": sub, "lang": sidecar_language(sub, path)} for sub in sidecars_of(path, listings[folder])
+                ]
+                if item_tracks:
+                    tracks[item_id] = item_tracks
+            queue_local_subtitles(tracks)
+            queued += len(tracks)
+    return queued
+
+def import_subtitles(item_id: int, tracks: list):
+    """
+    django-q task: write the subtitles of one video as VTT under SUBTITLES_DIR/local/ and list them
+    for the player. A track is {"file": path, "lang": tag} for a subtitle file next to the video or
+    {"stream": index, "lang": tag} for an embedded one; all embedded tracks come out of one ffmpeg run.
+    """
+    vid = MediaItem.objects.filter(id=item_id).first()
+    if vid is None:
+        return
+
+    known = set(vid.subtitles.values_list("path", flat=True))
+    done = []
+    embedded = []
+    for track in tracks:
+        try:
+            path = local_path(track.get("file", vid.file_path), track.get("stream"))
+        except OSError:
+            continue
+        if path in known:
+            continue
+        out = settings.SUBTITLES_DIR / path
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if "stream" in track:
+            embedded.append((track, path, out))
+            continue
+        try:
+            if track["file"].lower().endswith(".vtt"):
+                with open(track["file"], "rb") as src, open(out, "wb") as dst:
+                    dst.write(src.read())
+            else:
+                srt_to_vtt(track["file"], out)
+            done.append((track, path))
+        except OSError as e:
+            print(f"Could not convert {track['file']}: {e}")
+
+    if embedded:
+        # written under temporary names, a killed or failed ffmpeg must not leave truncated tracks
+        # behind that would be listed (and never extracted again)
+        parts = [out.with_name(out.name + ".part") for _, _, out in embedded]
+        cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", vid.file_path]
+        for (track, _, _), part in zip(embedded, parts):
+            cmd += ["-map", f"0:{track['stream']}", "-c:s", "webvtt", "-f", "webvtt", str(part)]
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                    timeout=settings.SUBTITLE_EXTRACT_TIMEOUT)
+            ok = result.returncode == 0
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"Could not extract subtitles of {vid.file_path}: {e}")
+            ok = False
+        for (track, path, out), part in zip(embedded, parts):
+            if ok and part.exists() and part.stat().st_size:
+                os.replace(part, out)
+                done.append((track, path))
+            elif part.exists():
+                part.unlink()
+
+    for track, path in done:
+        code, name = language_of(track.get("lang"))
+        store_subtitle(vid=vid, path=path, lang=code, language=name)
+
 def store_subtitle(vid: MediaItem, path: str, lang: str, language: str): 
 
     langItem,_ = Language.objects.get_or_create(
@@ -1,3 +1,1117 @@
-from django.test import TestCase
+import fcntl
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+import requests
+import yaml
+from PIL import Image
+from django.core.cache import cache
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .config import Config, ConfigError, config_changed, get_config, parse_config
+from .models import Collection, DirectoryState, EncodeState, FolderItem, Library, MediaItem, Language, PlaybackProgress, SubtitleItem
+from . import artwork, enrichment, fuzzy, hls, ladder, previews, streaming, progress, remux, scanner, search, subtitles, tmdb, viewcache, views
 
-# Create your tests here.
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+@mock.patch("mediahub.views.get_config", return_value=Config(libraries=()))
+class QueryBudgetTests(TestCase):
+    """The listing views must issue a fixed number of queries, however many rows they show."""
+
+    def setUp(self):
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = Library.objects.create(slug="movies", name="Movies", path="/m", type="movies")
+        cls.pictures = Library.objects.create(slug="pictures", name="Pictures", path="/p", type="pictures")
+
+        for c in range(3):
+            col = Collection.objects.create(tmdb_id=c, name=f"Saga {c}")
+            for i in range(5):
+                MediaItem.objects.create(
+                    library=cls.movies, file_path=f"/m/saga{c}-{i}.mkv", title=f"Saga {c} part {i}",
+                    is_video=True, ext=".mkv", year=2000 + i, collection=col,
+                )
+
+        # /p/a/b/c with pictures and subfolders on every level
+        parent = None
+        path = "/p"
+        for name in "abc":
+            path = f"{path}/{name}"
+            parent = FolderItem.objects.create(library=cls.pictures, parent=parent, name=name, path=path)
+            for i in range(10):
+                FolderItem.objects.create(library=cls.pictures, parent=parent, name=f"sub{i}", path=f"{path}/sub{i}")
+                MediaItem.objects.create(
+                    library=cls.pictures, folder=parent, file_path=f"{path}/pic{i}.jpg", title=f"pic {i}",
+                    ext=".jpg", width=400, height=300, file_size=100,
+                )
+        cls.deepest = parent
+
+    def test_index(self, _):
+        # libraries, newest videos, collection ids, collections, their movies, continue watching
+        with self.assertNumQueries(6):
+            self.client.get("/")
+
+    def test_library_movies(self, _):
+        # library, item totals, first page
+        with self.assertNumQueries(3):
+            self.client.get("/library/movies/")
+
+    def test_library_pictures_root(self, _):
+        # library, folder totals, item totals, subfolders, pictures
+        with self.assertNumQueries(5):
+            self.client.get("/library/pictures/")
+
+    def test_library_pictures_nested(self, _):
+        # library, folder, breadcrumb folders, folder totals, item totals, subfolders, pictures
+        with self.assertNumQueries(7):
+            resp = self.client.get(f"/library/pictures/?folder={self.deepest.id}")
+        self.assertContains(resp, "/Pictures/a/b/c")
+
+    @override_settings(LIBRARY_PAGE_SIZE=4)
+    def test_library_pages(self, _):
+        url = f"/library/pictures/page/?folder={self.deepest.parent_id}"
+        titles = []
+        after = ""
+        while True:
+            # library, folder, subfolders and / or pictures
+            with CaptureQueriesContext(connection) as queries:
+                page = self.client.get(url + (f"&after={after}" if after else "")).json()
+            self.assertLessEqual(len(queries), 4)
+            titles += [it["title"] for it in page["items"]]
+            if not page["next"]:
+                break
+            after = page["next"]
+
+        self.assertEqual(len(titles), 21)  # c, sub0-9, pic 0-9
+        self.assertEqual(titles[:2], ["c", "sub0"])
+        self.assertEqual(titles[-1], "pic 9")
+
+    def test_search(self, _):
+        FolderItem.objects.create(library=self.pictures, name="Extras", path="/p/Extras")
+        MediaItem.objects.create(library=self.movies, file_path="/m/extras.mkv", title="Extras", ext=".mkv")
+
+        # media index, folder index, media items, folders
+        with self.assertNumQueries(4):
+            resp = self.client.get("/search/?q=extra")
+        self.assertEqual({r["type"] for r in resp.json()}, {"media", "folder"})
+        self.assertTrue(all("lib_slug" in r for r in resp.json()))
+
+    @mock.patch("mediahub.views.sample", lambda ids, k: ids[:k])  # the same collections twice
+    def test_cached_until_scanned(self, _):
+        url = f"/library/pictures/?folder={self.deepest.id}"
+        self.client.get("/")
+        self.client.get(url)
+        # continue watching is per profile, not cached
+        with self.assertNumQueries(1):
+            self.client.get("/")
+            resp = self.client.get(url)
+        self.assertContains(resp, "pic 9")
+
+        MediaItem.objects.filter(folder=self.deepest, title="pic 9").update(title="pic 99")
+        viewcache.bump("movies")
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), "pic 9<")
+
+        viewcache.bump("pictures")
+        self.assertContains(self.client.get(url), "pic 99")
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+    def test_cache_key_ignores_other_parameters(self, _):
+        url = f"/library/pictures/?folder={self.deepest.id}"
+        page = f"/library/pictures/page/?folder={self.deepest.parent_id}"
+        self.client.get(url)
+        first = self.client.get(page).json()
+        with self.assertNumQueries(0):
+            self.client.get(url + "&junk=1")
+            self.client.get(f"/library/pictures/?junk=2&folder={self.deepest.id}")
+            self.assertEqual(self.client.get(page + "&junk=3").json(), first)
+        self.assertEqual(self.client.get("/library/pictures/?folder=abc").status_code, 404)
+        self.assertEqual(self.client.get("/library/pictures/page/?after=junk").status_code, 404)
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.lib = Library.objects.create(slug="movies", name="Movies", path="/m", type="movies")
+        self.hidden = Library.objects.create(slug="secret", name="Secret", path="/s", hidden=True)
+
+    def titles(self, q, show_hidden=False):
+        return [getattr(obj, "title", getattr(obj, "name", None)) for obj in search.search(q, show_hidden)]
+
+    def test_prefix_and_ranking(self):
+        MediaItem.objects.create(library=self.lib, file_path="/m/1.mkv", title="Interstellar", ext=".mkv",
+                                 description="Cooper leaves earth")
+        MediaItem.objects.create(library=self.lib, file_path="/m/2.mkv", title="Inception", ext=".mkv",
+                                 description="An interstellar heist")
+        FolderItem.objects.create(library=self.lib, name="Interviews", path="/m/Interviews")
+
+        self.assertEqual(self.titles("interstel"), ["Interstellar", "Inception"])
+        self.assertEqual(self.titles("inter"), ["Interstellar", "Interviews", "Inception"])
+        self.assertEqual(self.titles("coop earth"), ["Interstellar"])
+        self.assertEqual(self.titles('"('), [])
+
+    def test_index_follows_writes(self):
+        item = MediaItem.objects.create(library=self.lib, file_path="/m/1.mkv", title="Alien", ext=".mkv")
+        MediaItem.objects.filter(id=item.id).update(title="Aliens")
+        MediaItem.objects.filter(id=item.id).update(file_size=10)  # no index change
+        self.assertEqual(self.titles("aliens"), ["Aliens"])
+
+        item.delete()
+        self.assertEqual(self.titles("alien"), [])
+
+    def test_hidden_libraries(self):
+        MediaItem.objects.create(library=self.hidden, file_path="/s/1.jpg", title="Beach", ext=".jpg")
+        self.assertEqual(self.titles("beach"), [])
+        self.assertEqual(self.titles("beach", show_hidden=True), ["Beach"])
+
+
+class FuzzyIndexTests(TestCase):
+    def setUp(self):
+        self.lib = Library.objects.create(slug="movies", name="Movies", path="/m", type="movies")
+        self.hidden = Library.objects.create(slug="secret", name="Secret", path="/s", hidden=True)
+        self.index = fuzzy.FuzzyIndex()
+
+    def titles(self, q, show_hidden=False):
+        return [r["title"] for r in self.index.search(q, show_hidden)]
+
+    def test_typos(self):
+        MediaItem.objects.create(library=self.lib, file_path="/m/1.mkv", title="Interstellar", ext=".mkv")
+        MediaItem.objects.create(library=self.lib, file_path="/m/2.mkv", title="Inception", ext=".mkv")
+        FolderItem.objects.create(library=self.lib, name="Amélie", path="/m/Amélie")
+        self.index.refresh()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles("interstelar"), ["Interstellar"])
+            self.assertEqual(self.titles("intersetllar"), ["Interstellar"])
+            self.assertEqual(self.titles("amelie"), ["Amélie"])
+            self.assertEqual(self.titles("incep"), ["Inception"])
+            self.assertEqual(self.titles("xyzzy"), [])
+            self.assertIsNone(self.index.search("in"))
+
+    def test_refresh_and_hidden(self):
+        item = MediaItem.objects.create(library=self.lib, file_path="/m/1.mkv", title="Alien", ext=".mkv")
+        MediaItem.objects.create(library=self.hidden, file_path="/s/1.jpg", title="Alien Beach", ext=".jpg")
+        self.index.refresh()
+        self.assertEqual(self.titles("alien"), ["Alien"])
+        self.assertEqual(self.titles("alien", show_hidden=True), ["Alien", "Alien Beach"])
+
+        MediaItem.objects.filter(id=item.id).update(title="Aliens")
+        self.index.refresh()
+        self.assertEqual(self.titles("aliens"), ["Aliens"])
+
+        item.delete()
+        self.index.refresh()
+        self.assertEqual(self.titles("alien"), [])
+
+    def test_refresh_reads_only_changes(self):
+        items = [
+            MediaItem(library=self.lib, file_path=f"/m/{i}.mkv", title=f"Movie {i}", ext=".mkv") for i in range(10)
+        ]
+        items = MediaItem.objects.bulk_create(items)
+        self.index.refresh()
+
+        MediaItem.objects.filter(id=items[3].id).update(title="Interstellar")
+        MediaItem.objects.filter(id=items[4].id).update(file_size=123)  # not indexed, not logged
+        items[5].delete()
+        # libraries, log position, log start, logged changes, changed media rows
+        with self.assertNumQueries(5):
+            self.index.refresh()
+        self.assertEqual(self.titles("interstelar"), ["Interstellar"])
+        self.assertEqual(len(self.index.by_key), 9)
+
+        with self.assertNumQueries(2):
+            self.index.refresh()  # nothing new
+
+        with mock.patch("mediahub.search.CHANGES_KEPT", 0):
+            MediaItem.objects.filter(id=items[6].id).update(title="Inception")
+            search.prune_changes()
+        self.index.refresh()  # its entries were pruned, reloads everything
+        self.assertEqual(self.titles("inception"), ["Inception"])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ConfigTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "config.yaml"
+        override = override_settings(BASE_DIR=Path(tmp.name))
+        override.enable()
+        self.addCleanup(override.disable)
+        for patch in (mock.patch("mediahub.config._config", None), mock.patch("mediahub.config._config_stamp", None)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.write(libraries=[{"name": "Movies", "path": "/m", "sync": True}], hidden_pin=1234)
+
+    def write(self, **data):
+        self.path.write_text(yaml.safe_dump(data))
+        # a new mtime even within the timestamp resolution of the filesystem
+        os.utime(self.path, ns=(0, self.path.stat().st_mtime_ns + 1_000_000_000))
+
+    def test_reload_on_change(self):
+        config = get_config()
+        self.assertEqual(config.hidden_pin, "1234")
+        self.assertEqual(config.libraries[0].slug, "movies")
+        self.assertIs(get_config(), config)
+        old = config
+
+        events = []
+        receiver = lambda **kwargs: events.append(kwargs)
+        config_changed.connect(receiver)
+        self.addCleanup(config_changed.disconnect, receiver)
+        with mock.patch("mediahub.scanner.async_task") as task:
+            self.write(libraries=[{"name": "Movies", "path": "/m2", "sync": True}, {"name": "Pictures", "path": "/p"}])
+            config = get_config()
+        self.assertIsNone(config.hidden_pin)
+        self.assertEqual([lib.name for lib in events[0]["added"]], ["Pictures"])
+        self.assertEqual([lib.path for lib in events[0]["changed"]], ["/m2"])
+        task.assert_called_once_with("mediahub.scanner.scan_once", False, ["Pictures", "Movies"])
+
+        # another process that loaded the old file reloads the same edit, but queues no second scan
+        with mock.patch("mediahub.config._config", old), mock.patch("mediahub.config._config_stamp", None), \
+                mock.patch("mediahub.scanner.async_task") as task:
+            get_config()
+        self.assertEqual(len(events), 2)
+        task.assert_not_called()
+
+    def test_invalid(self):
+        get_config()
+        self.write(libraries=[{"name": "Movies"}])
+        with self.assertRaises(ConfigError):
+            get_config()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+@mock.patch("mediahub.views.get_config", return_value=Config(libraries=()))
+@mock.patch("mediahub.progress._start_flusher")
+class ProgressTests(TestCase):
+    def setUp(self):
+        lib = Library.objects.create(slug="movies", name="Movies", path="/m", type="movies")
+        self.item = MediaItem.objects.create(library=lib, file_path="/m/1.mkv", title="Alien", ext=".mkv", is_video=True)
+
+    def test_buffered_until_flush(self, *_):
+        with self.assertNumQueries(0):
+            self.client.post(f"/api/save_progress/{self.item.id}/", {"time": "30"})
+            self.client.post(f"/api/save_progress/{self.item.id}/", {"time": "45.7", "final": "1"})
+        self.assertFalse(PlaybackProgress.objects.exists())
+        self.assertEqual(progress.pending_position("Default", self.item.id), 45)
+
+        self.assertEqual(progress.flush(), 1)
+        self.assertEqual(PlaybackProgress.objects.get().position, 45)
+
+        progress.record_position("Default", self.item.id, 60)
+        progress.record_position("Default", self.item.id + 1, 10)  # deleted meanwhile
+        progress.record_position("Kids", self.item.id, 95, duration=100)
+        self.assertEqual(progress.flush(), 2)
+        self.assertEqual(
+            set(PlaybackProgress.objects.values_list("profile", "position", "finished")),
+            {("Default", 60, False), ("Kids", 95, True)},
+        )
+        self.assertIsNone(progress.pending_position("Default", self.item.id))
+
+    def test_profile_from_player(self, _, get_config):
+        get_config.return_value = Config(libraries=(), profiles=("Default", "Kids"))
+        self.client.post("/profile/", {"profile": "Kids"})  # the browser has a session now
+        with self.assertNumQueries(0):
+            self.client.post(f"/api/save_progress/{self.item.id}/", {"time": "30", "profile": "Kids"})
+            self.client.post(f"/api/save_progress/{self.item.id}/", {"time": "40", "profile": "Nobody"})
+        self.assertEqual(progress.pending_position("Kids", self.item.id), 30)
+        self.assertEqual(progress.pending_position("Default", self.item.id), 40)
+        progress.flush()
+
+    def test_continue_watching(self, _, get_config):
+        get_config.return_value = Config(libraries=(), profiles=("Default", "Kids"))
+        lib = self.item.library
+        other = MediaItem.objects.create(library=lib, file_path="/m/2.mkv", title="Aliens", ext=".mkv", is_video=True)
+        done = MediaItem.objects.create(library=lib, file_path="/m/3.mkv", title="Alien 3", ext=".mkv", is_video=True)
+        progress.record_position("Default", self.item.id, 30, duration=100)
+        progress.record_position("Default", done.id, 99, duration=100)
+        progress.record_position("Kids", other.id, 30, duration=100)
+        progress.flush()
+
+        resp = self.client.get("/")
+        self.assertEqual([it.title for it in resp.context["continue_watching"]], ["Alien"])
+
+        self.client.post("/profile/", {"profile": "Kids"})
+        resp = self.client.get("/")
+        self.assertEqual([it.title for it in resp.context["continue_watching"]], ["Aliens"])
+
+
+class SubtitleTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        root = Path(self.dir.name)
+        lib = Library.objects.create(slug="movies", name="Movies", path=str(root), type="movies")
+        self.item = MediaItem.objects.create(library=lib, file_path=str(root / "Alien.mkv"), title="Alien", ext=".mkv", is_video=True)
+        (root / "Alien.mkv").write_bytes(b"")
+        (root / "Alien.de.srt").write_bytes("1\r\n00:00:01,500 --> 00:00:02,000\r\nHallo, Welt\r\n".encode("latin-1"))
+        (root / "Alien.vtt").write_text("WEBVTT\n\n00:01.000 --> 00:02.000\nHello\n")
+        self.tracks = [
+            {"file": str(root / "Alien.de.srt"), "lang": "de"},
+            {"file": str(root / "Alien.vtt"), "lang": None},
+        ]
+
+    def test_import_sidecars(self):
+        with override_settings(SUBTITLES_DIR=Path(self.dir.name) / "subs"):
+            subtitles.import_subtitles(self.item.id, self.tracks)
+            subtitles.import_subtitles(self.item.id, self.tracks)  # already converted
+
+            subs = {s.lang.code: s.path for s in SubtitleItem.objects.select_related("lang")}
+            self.assertEqual(set(subs), {"DE", "UN"})
+            vtt = (Path(self.dir.name) / "subs" / subs["DE"]).read_text()
+        self.assertEqual(vtt, "WEBVTT\n\n1\n00:00:01.500 --> 00:00:02.000\nHallo, Welt\n")
+        self.assertEqual(subtitles.language_of("ger"), ("DE", "German"))
+
+    def test_extraction_timeout_keeps_nothing(self):
+        def killed(cmd, **kwargs):
+            Path(cmd[-1]).write_text("WEBVTT\n\n00:01.000 --> 00:02.000\nHal")  # cut off mid-track
+            raise subprocess.TimeoutExpired(cmd, 50)
+
+        subs_dir = Path(self.dir.name) / "subs"
+        with override_settings(SUBTITLES_DIR=subs_dir), mock.patch("mediahub.subtitles.subprocess.run", side_effect=killed), \
+                mock.patch("builtins.print"):
+            subtitles.import_subtitles(self.item.id, [{"stream": 2, "lang": "ger"}])
+        self.assertFalse(SubtitleItem.objects.exists())
+        self.assertEqual([p for p in subs_dir.rglob("*") if p.is_file()], [])
+
+    @mock.patch("mediahub.subtitles.async_task")
+    @mock.patch("mediahub.probe.probe_video", return_value={"subtitle_tracks": [{"stream": 2, "lang": "eng"}]})
+    def test_find_local_subtitles(self, _, async_task):
+        (Path(self.dir.name) / "Aliens.en.srt").write_text("")  # another movie's
+        self.assertEqual(subtitles.find_local_subtitles(), 1)
+        name, item_id, tracks = async_task.call_args.args
+        self.assertEqual(item_id, self.item.id)
+        self.assertCountEqual(tracks, [{"stream": 2, "lang": "eng"}, *self.tracks])
+
+        SubtitleItem.objects.create(media_item=self.item, path="local/ab/abc.vtt", lang=Language.objects.create(code="EN", language="English"))
+        self.assertEqual(subtitles.find_local_subtitles(), 0)
+
+
+class ScannerTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.root = Path(self.dir.name) / "pics"
+        self.root.mkdir()
+        self.lib = Library.objects.create(slug="pics", name="Pics", path=str(self.root), type="pictures")
+        tmp = Path(self.dir.name)
+        (tmp / "ladder").mkdir()
+        # scan_once takes the scan lock, touches the search stamp and prunes the ladder, all outside the checkout
+        patcher = override_settings(
+            CACHES=LOCMEM_CACHE, THUMB_DIR=tmp / "thumbs", PREVIEW_PREGENERATE=False,
+            SCAN_LOCK_FILE=tmp / "scan.lock", SEARCH_STAMP=tmp / "library.stamp", HLS_LADDER_DIR=tmp / "ladder",
+        )
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def image(self, name, color="red"):
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.new("RGB", (40, 30), color).save(path, "PNG")
+        return path
+
+    def scan(self, full=True):
+        with mock.patch("builtins.print"):
+            scanner.scan_folder(self.lib, str(self.root), full=full)
+
+    def test_failed_walk_releases_probe_threads(self):
+        self.image("a.png")
+        self.image("sub/b.png")
+        with mock.patch("mediahub.scanner.get_first_image", side_effect=PermissionError), self.assertRaises(PermissionError):
+            self.scan()
+        self.assertFalse([t for t in threading.enumerate() if t.name.startswith("mediahub-probe")])
+
+    def test_scan_lock_across_processes(self):
+        with override_settings(SCAN_LOCK_FILE=Path(self.dir.name) / "scan.lock"):
+            # another process scanning: flock conflicts between open files, within one process too
+            fd = os.open(Path(self.dir.name) / "scan.lock", os.O_RDWR | os.O_CREAT)
+            self.addCleanup(os.close, fd)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            with mock.patch("mediahub.scanner.async_task") as task:
+                self.assertTrue(scanner.scan_once_safe())
+                task.assert_not_called()
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                self.assertFalse(scanner.scan_once_safe())
+                task.assert_called_once()
+            with scanner._scan_lock:
+                self.assertTrue(scanner._scan_lock.locked())
+            self.assertFalse(scanner._scan_lock.locked())
+
+    def test_rewritten_picture_gets_new_thumbnail_url(self):
+        path = self.image("a.png")
+        self.scan()
+        item = MediaItem.objects.get()
+        views.decorate_tile(item, self.lib, None)
+        before = item.poster_url
+
+        self.image("a.png", "blue")  # same size on disk
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.scan()
+        item = MediaItem.objects.get()
+        self.assertEqual(item.file_size, st.st_size)
+        views.decorate_tile(item, self.lib, None)
+        self.assertNotEqual(item.poster_url, before)
+        self.assertIn(f"v={item.file_mtime}", item.poster_url)
+
+    def test_writes_in_batches(self):
+        for i in range(7):
+            self.image(f"{i}.png")
+        table = MediaItem._meta.db_table
+        with override_settings(SCAN_BATCH_SIZE=3), CaptureQueriesContext(connection) as queries:
+            self.scan()
+        inserts = [q for q in queries.captured_queries if q["sql"].startswith(f'INSERT INTO "{table}"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(MediaItem.objects.count(), 7)
+
+        # a rewritten file keeps its row, size and metadata are updated in place
+        item = MediaItem.objects.get(file_path=str(self.root / "3.png"))
+        Image.new("RGB", (80, 60), "blue").save(self.root / "3.png", "PNG")
+        self.scan()
+        updated = MediaItem.objects.get(file_path=str(self.root / "3.png"))
+        self.assertEqual(updated.id, item.id)
+        self.assertEqual((updated.width, updated.file_size), (80, (self.root / "3.png").stat().st_size))
+        self.assertEqual(MediaItem.objects.count(), 7)
+
+    def test_rewritten_video_is_enriched(self):
+        Library.objects.filter(id=self.lib.id).update(sync=True)
+        self.lib.refresh_from_db()
+        video = self.root / "film.mkv"
+        video.write_bytes(b"mkv")
+        with mock.patch("mediahub.scanner.queue_enrichment") as queue_enrichment:
+            self.scan()
+            item = MediaItem.objects.get()
+            self.assertEqual(queue_enrichment.call_args.args[0], {item.id})
+
+            video.write_bytes(b"mkv, longer")
+            self.scan()
+        self.assertEqual(queue_enrichment.call_args.args[0], {item.id})
+        self.assertEqual(MediaItem.objects.get().file_size, video.stat().st_size)
+
+    def test_incremental_scan(self):
+        self.image("a/x.png")
+        gone = self.image("b/y.png")
+        self.scan()
+        self.assertEqual(MediaItem.objects.count(), 2)
+
+        # nothing changed: no directory is listed again, the walk reads the directory states and folders once
+        with mock.patch.object(scanner.os, "scandir", wraps=os.scandir) as scandir, \
+                CaptureQueriesContext(connection) as queries:
+            self.scan(full=False)
+        scandir.assert_not_called()
+        self.assertEqual(len(queries.captured_queries), 2)
+
+        gone.unlink()
+        with mock.patch.object(scanner.os, "scandir", wraps=os.scandir) as scandir:
+            self.scan(full=False)
+        self.assertEqual({c.args[0] for c in scandir.call_args_list}, {str(self.root / "b")})
+        self.assertEqual(list(MediaItem.objects.values_list("file_path", flat=True)), [str(self.root / "a/x.png")])
+        self.assertTrue(FolderItem.objects.filter(path=str(self.root / "b")).exists())
+
+        # another library on one of these directories keeps its own state of it
+        other = Library.objects.create(slug="b", name="B", path=str(self.root / "b"), type="pictures")
+        with mock.patch("builtins.print"):
+            scanner.scan_folder(other, other.path, full=False)
+        self.assertEqual(DirectoryState.objects.filter(path=other.path).count(), 2)
+
+    def test_folder_totals(self):
+        def folder(name, parent=None):
+            return FolderItem.objects.create(library=self.lib, parent=parent, path=str(self.root / name), name=name)
+
+        def item(name, folder, size):
+            MediaItem.objects.create(library=self.lib, folder=folder, file_path=str(self.root / name), title=name, ext=".png", file_size=size)
+
+        def totals():
+            return dict(FolderItem.objects.values_list("name", "total_size").order_by())
+
+        a = folder("a")
+        b = folder("b", a)
+        folder("empty", a)
+        item("top.png", None, 1)
+        item("a1.png", a, 10)
+        item("b1.png", b, 100)
+        scanner.update_folder_totals(self.lib)
+        self.assertEqual(totals(), {"a": 110, "b": 100, "empty": 0})
+
+        # a file two levels down counts for every ancestor
+        c = folder("c", b)
+        item("c1.png", c, 1000)
+        scanner.update_folder_totals(self.lib)
+        self.assertEqual(totals(), {"a": 1110, "b": 1100, "c": 1000, "empty": 0})
+        self.assertEqual(FolderItem.objects.get(name="a").total_items, 3)
+
+    def test_watcher_queues_and_requeues_ladder(self):
+        Library.objects.filter(id=self.lib.id).update(pre_encode=True)
+        video = self.root / "a/film.mkv"
+        video.parent.mkdir()
+        video.write_bytes(b"mkv")
+        with mock.patch("mediahub.ladder.async_task") as task, mock.patch("builtins.print"):
+            scanner.scan_directories([str(video.parent)])
+            state = EncodeState.objects.get()
+            self.assertEqual(state.status, EncodeState.PENDING)
+            task.assert_called_with("mediahub.ladder.encode_next")
+
+            EncodeState.objects.update(status=EncodeState.DONE)
+            old_ladder = ladder.ladder_dir(state.media_item)
+            old_ladder.mkdir()
+
+            # rewritten in place: the finished ladder is stale
+            video.write_bytes(b"mkv, longer")
+            st = video.stat()
+            os.utime(video, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            scanner.scan_directories([str(video.parent)])
+        self.assertEqual(EncodeState.objects.get().status, EncodeState.PENDING)
+        self.assertFalse(old_ladder.exists())
+
+    def test_full_scan_keeps_missing_library(self):
+        self.image("a/x.png")
+        stale = self.image("a/y.png")
+        config = parse_config({"libraries": [{"name": "Pics", "path": str(self.root), "type": "pictures"}]})
+        with mock.patch("mediahub.scanner.get_config", return_value=config), mock.patch("builtins.print"):
+            scanner.scan_once(full=True)
+            self.assertEqual(MediaItem.objects.count(), 2)
+
+            # an unmounted library root looks empty, its items must survive a full scan
+            moved = Path(self.dir.name) / "unmounted"
+            self.root.rename(moved)
+            scanner.scan_once(full=True)
+            self.assertEqual(MediaItem.objects.count(), 2)
+            self.assertEqual(FolderItem.objects.count(), 1)
+
+            moved.rename(self.root)
+            stale.unlink()
+            scanner.scan_once(full=True)
+        self.assertEqual(list(MediaItem.objects.values_list("file_path", flat=True)), [str(self.root / "a/x.png")])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, TMDB_API_KEY="key")
+@mock.patch("mediahub.enrichment.async_task")
+class EnrichmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        lib = Library.objects.create(slug="movies", name="Movies", path="/m", type="movies", sync=True)
+        self.items = [
+            MediaItem.objects.create(library=lib, file_path=f"/m/{i}.mkv", title=f"Movie {i}", ext=".mkv", is_video=True)
+            for i in range(3)
+        ]
+
+    def test_one_worker_chain(self, async_task):
+        self.assertEqual(enrichment.queue_enrichment([self.items[0].id]), 1)
+        # refreshes during the lookups queue more items, but start no second chain
+        self.assertEqual(enrichment.queue_enrichment([self.items[0].id, self.items[1].id]), 1)
+        self.assertEqual(enrichment.queue_enrichment([self.items[0].id]), 0)
+        self.assertEqual(async_task.call_count, 1)
+
+        with mock.patch("mediahub.scanner.tmdb_get", return_value=False):
+            enrichment.process_queue(batch_size=1)
+        self.assertEqual(async_task.call_count, 2)  # the chain continues with the second item
+        with mock.patch("mediahub.scanner.tmdb_get", return_value=False):
+            enrichment.process_queue(batch_size=1)
+        self.assertEqual(async_task.call_count, 2)  # done, nothing left
+
+        enrichment.queue_enrichment([self.items[2].id])
+        self.assertEqual(async_task.call_count, 3)
+
+
+class ArtworkTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        posters = Path(self.dir.name) / "posters"
+        backdrops = Path(self.dir.name) / "backdrop"
+        posters.mkdir()
+        backdrops.mkdir()
+        patcher = override_settings(POSTER_DIR=posters, BACKDROP_DIR=backdrops)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.posters = posters
+
+        lib = Library.objects.create(slug="movies", name="Movies", path="/m", type="movies", sync=True)
+        self.item = MediaItem.objects.create(library=lib, file_path="/m/1.mkv", title="Alien", ext=".mkv", poster="w500_used.jpg")
+        now = time.time()
+        for age, name in enumerate(["w500_used.jpg", "w500_orphan.jpg", "w500_old.jpg"]):
+            (posters / name).write_bytes(b"x" * 100)
+            os.utime(posters / name, (now - age * 1000, now - age * 1000))
+
+    def test_evicts_unreferenced_before_used(self):
+        MediaItem.objects.create(library=self.item.library, file_path="/m/2.mkv", title="Aliens", ext=".mkv", poster="w500_old.jpg")
+        self.assertEqual(artwork.evict_lru(max_bytes=150), (2, 200))
+        # the orphan goes although it was used more recently, then the least recently used reference
+        self.assertEqual(os.listdir(self.posters), ["w500_used.jpg"])
+        self.assertEqual(MediaItem.objects.filter(poster__isnull=False).count(), 2)
+
+    def test_serving_marks_used(self):
+        old = (self.posters / "w500_old.jpg").stat().st_mtime
+        with override_settings(ARTWORK_TOUCH_INTERVAL=100):
+            resp = self.client.get("/static_cache/posters/w500_old.jpg")
+        self.assertEqual(resp.status_code, 200)
+        self.assertGreater((self.posters / "w500_old.jpg").stat().st_mtime, old)
+
+        os.remove(self.posters / "w500_used.jpg")
+        resp = self.client.get("/static_cache/posters/w500_used.jpg")
+        self.assertRedirects(resp, "https://image.tmdb.org/t/p/w500/used.jpg", fetch_redirect_response=False)
+
+
+class FakeTMDB(BaseHTTPRequestHandler):
+    """Answers with the scripted (status, headers, body) responses in turn, then with 200."""
+    responses = []
+    paths = []
+
+    def do_GET(self):
+        FakeTMDB.paths.append(self.path)
+        status, headers, body = FakeTMDB.responses.pop(0) if FakeTMDB.responses else (200, {}, {"results": []})
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class TMDBClientTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTMDB)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        FakeTMDB.responses = []
+        FakeTMDB.paths = []
+        session = requests.Session()
+        self.addCleanup(session.close)
+        url = f"http://127.0.0.1:{self.server.server_port}/3"
+        with override_settings(TMDB_API_URL=url, TMDB_RATE_LIMIT=50, TMDB_RATE_BURST=2):
+            self.client_ = tmdb.TMDBClient(api_key="secret", max_retries=3, session=session)
+
+    def test_rate_limit(self):
+        started = time.monotonic()
+        for i in range(6):
+            self.client_.request("search/movie", {"query": i})
+        # a burst of 2, then 50 per second
+        self.assertGreaterEqual(time.monotonic() - started, 4 / 50)
+        self.assertEqual(len(FakeTMDB.paths), 6)
+
+    @override_settings(TMDB_RETRY_MAX_DELAY=30)
+    @mock.patch("mediahub.tmdb.time.sleep")
+    def test_retry_after(self, sleep):
+        self.client_.bucket = tmdb.TokenBucket(1000, 100)  # only the retries sleep
+        FakeTMDB.responses = [
+            (429, {"Retry-After": "3"}, {}),
+            (503, {"Retry-After": "86400"}, {}),
+            (502, {}, {}),
+            (200, {}, {"results": [{"id": 1}]}),
+        ]
+        with self.assertLogs("mediahub.tmdb", "WARNING"):
+            self.assertEqual(self.client_.request("search/movie", {"query": "alien"}), {"results": [{"id": 1}]})
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [3.0, 30, 4])
+
+        FakeTMDB.responses = [(500, {}, {})] * 4
+        with self.assertLogs("mediahub.tmdb", "WARNING"), self.assertRaisesMessage(tmdb.TMDBError, "HTTP 500 after 4 attempts"):
+            self.client_.request("movie/1", {})
+        FakeTMDB.responses = [(404, {}, {})]
+        with self.assertRaisesMessage(tmdb.TMDBError, "HTTP 404"):
+            self.client_.request("movie/2", {})
+
+    def test_cached_resync(self):
+        FakeTMDB.responses = [(200, {}, {"results": [{"id": 348, "title": "Alien"}]})]
+        first = self.client_.search_movie("Alien", 1979)
+        self.assertIn("api_key=secret", FakeTMDB.paths[0])
+        self.assertEqual(self.client_.search_movie("Alien", 1979), first)
+        self.assertEqual(len(FakeTMDB.paths), 1)
+
+        self.client_.search_movie("Aliens", 1986)
+        self.assertEqual(len(FakeTMDB.paths), 2)
+
+
+class HLSJobTests(TestCase):
+    def job(self, idle, out_dir=None, prefix="job-1-00000"):
+        """A TranscodeJob whose ffmpeg is a paused `sleep`."""
+        if out_dir is None:
+            tmp = tempfile.TemporaryDirectory()
+            self.addCleanup(tmp.cleanup)
+            out_dir = Path(tmp.name)
+        job = hls.TranscodeJob.__new__(hls.TranscodeJob)
+        job.out_dir, job.start, job.last_requested, job.produced = out_dir, 0, 0, -1
+        job.prefix = prefix
+        job.list_path = out_dir / f"{prefix}.list"
+        job.proc = subprocess.Popen(["sleep", "60"])
+        job.proc.send_signal(hls.signal.SIGSTOP)
+        job.paused = True
+        job.touched = time.monotonic() - idle
+        return job
+
+    @override_settings(HLS_JOB_IDLE=60)
+    def test_reap_idle_jobs_without_requests(self):
+        idle, active = self.job(idle=120), self.job(idle=0)
+        with mock.patch.dict(hls._jobs, {("a", "720p"): idle, ("b", "720p"): active}, clear=True):
+            self.assertTrue(hls.reap())
+            self.assertEqual(list(hls._jobs), [("b", "720p")])
+        self.assertIsNotNone(idle.proc.poll())
+        active.stop()
+
+    def test_stop_keeps_parts_of_other_jobs(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        out_dir = Path(tmp.name)
+        # a job of this process and one of another process, both at segment 0
+        job, other = self.job(0, out_dir, "job-1-00000"), self.job(0, out_dir, "job-2-00000")
+        (out_dir / "job-1-00000-00000.ts").write_bytes(b"done")
+        (out_dir / "job-1-00000.list").write_text("job-1-00000-00000.ts\n")
+        (out_dir / "job-1-00000-00001.ts").write_bytes(b"trunc")
+        (out_dir / "job-2-00000-00001.ts").write_bytes(b"writing")
+        job.stop()
+        self.assertEqual(sorted(p.name for p in out_dir.iterdir()), ["job-2-00000-00001.ts", "seg00000.ts"])
+        other.stop()
+
+
+
+@override_settings(LADDER_MAX_JOBS=2)
+@mock.patch("mediahub.ladder.async_task")
+class LadderTests(TestCase):
+    def setUp(self):
+        lib = Library.objects.create(slug="movies", name="Movies", path="/m", type="movies", pre_encode=True)
+        self.states = [
+            EncodeState.objects.create(media_item=MediaItem.objects.create(
+                library=lib, file_path=f"/m/{i}.mkv", title=f"Movie {i}", ext=".mkv", is_video=True
+            ))
+            for i in range(4)
+        ]
+
+    def test_claims_at_most_max_jobs(self, async_task):
+        encoded = []
+
+        def encode_chunk(item):
+            encoded.append(item.id)
+            self.assertLessEqual(EncodeState.objects.filter(status=EncodeState.RUNNING).count(), 2)
+            # another worker picks up a queued task while this encode runs
+            ladder.encode_next()
+            return True
+
+        with mock.patch("mediahub.ladder.encode_chunk", side_effect=encode_chunk):
+            ladder.encode_next()
+        self.assertEqual(encoded, [s.media_item_id for s in self.states[:2]])
+        self.assertEqual(
+            list(EncodeState.objects.order_by("id").values_list("status", flat=True)),
+            [EncodeState.DONE, EncodeState.DONE, EncodeState.PENDING, EncodeState.PENDING],
+        )
+        async_task.assert_called_with("mediahub.ladder.encode_next")
+
+    def test_reclaims_expired_lease(self, async_task):
+        now = timezone.now()
+        # one live claim and one of a crashed worker
+        EncodeState.objects.filter(id=self.states[0].id).update(status=EncodeState.RUNNING, next_retry_at=now + timedelta(minutes=5))
+        EncodeState.objects.filter(id=self.states[1].id).update(status=EncodeState.RUNNING, next_retry_at=now - timedelta(minutes=5))
+        with mock.patch("mediahub.ladder.encode_chunk", return_value=False) as encode_chunk:
+            ladder.encode_next()
+        encode_chunk.assert_called_once()
+        self.assertEqual(encode_chunk.call_args.args[0].id, self.states[1].media_item_id)
+        self.assertEqual(EncodeState.objects.get(id=self.states[1].id).status, EncodeState.PENDING)
+
+
+class FakeFFmpeg:
+    """Popen stand-in that writes `output` to its output file and exits with `returncode` once `release` is set."""
+    release = None
+    returncode = 0
+    output = b"mp4"
+
+    def __init__(self, cmd, **kwargs):
+        Path(cmd[-1]).write_bytes(self.output)
+
+    def wait(self, timeout=None):
+        self.release.wait(5)
+        return self.returncode
+
+
+class RemuxTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        override = override_settings(REMUX_DIR=self.dir / "remux")
+        override.enable()
+        self.addCleanup(override.disable)
+        (self.dir / "remux").mkdir()
+        lib = Library.objects.create(slug="movies", name="Movies", path=str(self.dir), type="movies")
+        (self.dir / "a.mkv").write_bytes(b"mkv")
+        self.item = MediaItem.objects.create(library=lib, file_path=str(self.dir / "a.mkv"), title="A", ext=".mkv", is_video=True)
+        for patch in (mock.patch.object(remux, "_failed", set()), mock.patch.dict(remux._remuxes, clear=True)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_one_remux_per_file(self):
+        FakeFFmpeg.release = threading.Event()
+        barrier = threading.Barrier(8)
+        results = []
+
+        def play():
+            barrier.wait()
+            results.append(remux.get_remux(self.item))
+
+        with mock.patch("mediahub.remux.subprocess.Popen", side_effect=FakeFFmpeg) as popen:
+            threads = [threading.Thread(target=play) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        popen.assert_called_once()
+        self.assertEqual({cached for cached, _ in results}, {None})
+        self.assertEqual(len({id(job) for _, job in results}), 1)
+
+        FakeFFmpeg.release.set()
+        results[0][1].done.wait(5)
+        self.assertEqual(remux.get_remux(self.item), (remux.remux_path(self.item), None))
+        self.assertEqual(remux._remuxes, {})
+        self.assertEqual([p.name for p in (self.dir / "remux").iterdir()], [remux.remux_path(self.item).name])
+
+    def test_failed_remux_is_not_retried(self):
+        FakeFFmpeg.release = threading.Event()
+        FakeFFmpeg.release.set()
+        with mock.patch("mediahub.remux.subprocess.Popen", side_effect=FakeFFmpeg) as popen, \
+                mock.patch.object(FakeFFmpeg, "returncode", 1):
+            _, job = remux.get_remux(self.item)
+            job.done.wait(5)
+            self.assertEqual(remux.get_remux(self.item), (None, None))
+        popen.assert_called_once()
+        self.assertEqual(list((self.dir / "remux").iterdir()), [])
+
+    def test_missing_ffmpeg(self):
+        with mock.patch("mediahub.remux.subprocess.Popen", side_effect=FileNotFoundError("ffmpeg")):
+            self.assertEqual(remux.get_remux(self.item), (None, None))
+        self.assertEqual(remux._remuxes, {})
+        self.assertEqual(remux._failed, {remux.remux_path(self.item).stem})
+
+    def test_failed_remux_sends_the_file(self):
+        MediaItem.objects.filter(id=self.item.id).update(video_codec="h264", audio_codec="aac")
+        FakeFFmpeg.release = threading.Event()
+        FakeFFmpeg.release.set()
+        with mock.patch("mediahub.remux.subprocess.Popen", side_effect=FakeFFmpeg), \
+                mock.patch.object(FakeFFmpeg, "returncode", 1), mock.patch.object(FakeFFmpeg, "output", b""):
+            resp = self.client.get("/media/stream/", {"path": self.item.file_path})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp["Content-Type"], "video/mp4")
+        self.assertEqual(b"".join(resp.streaming_content), b"mkv")
+        resp.close()
+
+
+@override_settings(PREVIEW_WORKERS=2)
+class PreviewTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        override = override_settings(PREVIEW_DIR=self.dir / "previews")
+        override.enable()
+        self.addCleanup(override.disable)
+        self.video = self.dir / "a.mkv"
+        self.video.write_bytes(b"mkv")
+        for patch in (mock.patch.object(previews, "_failed", set()), mock.patch.dict(previews._jobs, clear=True)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def extract(self, frame):
+        """subprocess.run stand-in for ffmpeg writing `frame` once self.release is set."""
+        self.release = threading.Event()
+
+        def run(cmd, **kwargs):
+            self.release.wait(5)
+            Path(cmd[-1]).write_bytes(frame)
+        return mock.patch("mediahub.previews.subprocess.run", side_effect=run)
+
+    def test_one_extraction_per_file(self):
+        barrier = threading.Barrier(8)
+        results = []
+
+        def load():
+            barrier.wait()
+            results.append(previews.get_preview(str(self.video)))
+
+        with self.extract(b"jpeg") as run:
+            threads = [threading.Thread(target=load) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(results, [None] * 8)
+            [job] = previews._jobs.values()
+            self.release.set()
+            job.result(5)
+        run.assert_called_once()
+
+        out = previews.get_preview(str(self.video))
+        self.assertEqual(out.read_bytes(), b"jpeg")
+        self.assertEqual(list(out.parent.iterdir()), [out])
+        resp = self.client.get("/media/preview/", {"path": str(self.video)})
+        self.assertEqual(b"".join(resp.streaming_content), b"jpeg")
+        resp.close()
+
+    def test_failed_extraction_is_not_retried(self):
+        with self.extract(b"") as run:
+            self.release.set()
+            previews.get_preview(str(self.video))
+            [job] = previews._jobs.values()
+            self.assertIsNone(job.result(5))
+            self.assertIsNone(previews.get_preview(str(self.video)))
+        run.assert_called_once()
+
+    def test_job_finished_before_callback(self):
+        submit = previews._executor.submit
+
+        def finished_submit(*args):
+            future = submit(*args)
+            future.result(5)
+            return future
+
+        request = threading.Thread(target=previews.get_preview, args=(str(self.video),), daemon=True)
+        with mock.patch("mediahub.previews.generate_preview", return_value=None), \
+                mock.patch.object(previews._executor, "submit", side_effect=finished_submit):
+            request.start()
+            request.join(5)
+        self.assertFalse(request.is_alive())
+        self.assertEqual((previews._jobs, previews._failed), ({}, {previews.thumb_key(str(self.video))}))
+
+class RangeTests(SimpleTestCase):
+    def test_parse_range(self):
+        parse = streaming.parse_range
+        self.assertIsNone(parse(None, 1000))
+        self.assertIsNone(parse("items=0-1", 1000))
+        self.assertIsNone(parse("bytes=abc", 1000))
+        self.assertEqual(parse("bytes=0-99", 1000), [(0, 99)])
+        self.assertEqual(parse("bytes=500-", 1000), [(500, 999)])
+        self.assertEqual(parse("bytes=900-5000", 1000), [(900, 999)])
+        # suffix ranges: the last N bytes, all of a file shorter than N
+        self.assertEqual(parse("bytes=-100", 1000), [(900, 999)])
+        self.assertEqual(parse("bytes=-5000", 1000), [(0, 999)])
+        self.assertEqual(parse("bytes=0-99, 200-299", 1000), [(0, 99), (200, 299)])
+        # overlapping and adjacent ranges are sent once
+        self.assertEqual(parse("bytes=500-599,0-99,50-149,150-199", 1000), [(0, 199), (500, 599)])
+        self.assertEqual(parse("bytes=-100,950-", 1000), [(900, 999)])
+        # unsatisfiable parts are dropped, only unsatisfiable ones give a 416
+        self.assertEqual(parse("bytes=2000-3000,0-9", 1000), [(0, 9)])
+        for header in ("bytes=1000-", "bytes=-0", "bytes=5-1"):
+            with self.assertRaises(streaming.RangeNotSatisfiable):
+                parse(header, 1000)
+        self.assertIsNone(parse("bytes=" + ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(30)), 1000))
+
+    def test_responses(self):
+        tmp = tempfile.NamedTemporaryFile(suffix=".mp4")
+        self.addCleanup(tmp.close)
+        data = bytes(range(256)) * 4
+        tmp.write(data)
+        tmp.flush()
+
+        def get(header):
+            request = RequestFactory().get("/", HTTP_RANGE=header) if header else RequestFactory().get("/")
+            resp = streaming.file_response(request, tmp.name, "video/mp4")
+            return resp, b"".join(resp.streaming_content) if resp.streaming else resp.content
+
+        resp, body = get(None)
+        self.assertEqual((resp.status_code, body), (200, data))
+        resp, body = get("bytes=-24")
+        self.assertEqual((resp.status_code, resp["Content-Range"], body), (206, "bytes 1000-1023/1024", data[-24:]))
+        resp, _ = get("bytes=2000-")
+        self.assertEqual((resp.status_code, resp["Content-Range"]), (416, "bytes */1024"))
+
+        resp, body = get("bytes=0-9,100-109")
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(int(resp["Content-Length"]), len(body))
+        boundary = resp["Content-Type"].split("boundary=")[1]
+        parts = body.split(f"--{boundary}".encode())
+        self.assertIn(b"Content-Range: bytes 0-9/1024\r\n\r\n" + data[0:10] + b"\r\n", parts[1])
+        self.assertIn(b"Content-Range: bytes 100-109/1024\r\n\r\n" + data[100:110] + b"\r\n", parts[2])
+        self.assertEqual(parts[3], b"--\r\n")
+
+
+@override_settings(STREAM_BACKEND="sendfile", STREAM_BUFFER_SIZE=16, STREAM_MAX_PER_CLIENT=2, STREAM_MAX_TOTAL=3)
+class AsyncStreamTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.NamedTemporaryFile(suffix=".mp4")
+        self.addCleanup(tmp.close)
+        self.data = bytes(range(256)) * 4
+        tmp.write(self.data)
+        tmp.flush()
+        self.path = tmp.name
+        patch = mock.patch.object(streaming, "limiter", streaming.StreamLimiter())
+        self.limiter = patch.start()
+        self.addCleanup(patch.stop)
+
+    async def get(self, header=None, client="10.0.0.1"):
+        headers = {"Range": header} if header else {}
+        request = AsyncRequestFactory().get("/media/stream/", headers=headers)
+        request.META["REMOTE_ADDR"] = client
+        return await streaming.async_file_response(request, self.path, "video/mp4")
+
+    async def read(self, resp):
+        try:
+            return b"".join([chunk async for chunk in resp.streaming_content])
+        finally:
+            resp.close()
+
+    async def test_range(self):
+        resp = await self.get("bytes=100-199")
+        self.assertEqual((resp.status_code, resp["Content-Range"], resp["Content-Length"]), (206, "bytes 100-199/1024", "100"))
+        self.assertEqual(await self.read(resp), self.data[100:200])
+        resp = await self.get()
+        self.assertEqual((resp.status_code, await self.read(resp)), (200, self.data))
+        resp = await self.get("bytes=5000-")
+        self.assertEqual((resp.status_code, resp["Content-Range"]), (416, "bytes */1024"))
+        self.assertEqual(self.limiter.total, 0)
+
+    async def test_multipart(self):
+        resp = await self.get("bytes=0-9,100-109")
+        self.assertEqual(resp.status_code, 206)
+        body = await self.read(resp)
+        self.assertEqual(int(resp["Content-Length"]), len(body))
+        self.assertIn(b"Content-Range: bytes 100-109/1024\r\n\r\n" + self.data[100:110], body)
+
+    async def test_limits(self):
+        first = [await self.get(client="10.0.0.1") for _ in range(2)]
+        refused = await self.get(client="10.0.0.1")
+        self.assertEqual((refused.status_code, refused["Retry-After"]), (503, "5"))
+
+        other = await self.get(client="10.0.0.2")
+        self.assertEqual(other.status_code, 200)
+        refused = await self.get(client="10.0.0.3")
+        self.assertEqual(refused.status_code, 503)
+
+        for resp in first + [other]:
+            resp.close()
+        self.assertEqual((self.limiter.total, self.limiter.clients), (0, {}))
+
+    async def test_slot_freed_when_client_leaves(self):
+        resp = await self.get()
+        content = resp.streaming_content
+        self.assertEqual(await anext(content), self.data[:16])
+        self.assertEqual(self.limiter.total, 1)
+        # the ASGI handler closes the response when the client disconnects mid-stream
+        resp.close()
+        await content.aclose()
+        self.assertEqual(self.limiter.total, 0)
+        resp.close()
+        self.assertEqual(self.limiter.total, 0)
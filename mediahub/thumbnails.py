@@ -0,0 +1,83 @@
+import os
+import hashlib
+import tempfile
+from django.conf import settings
+from PIL import Image, ImageOps
+
+THUMB_EXTS = {"WEBP": ".webp", "JPEG": ".jpg"}
+
+
+def thumb_key(path, st=None):
+    """Digest of path + mtime + size, a rewritten file gets new thumbnails."""
+    st = st or os.stat(path)
+    h = hashlib.sha1()
+    h.update(str(path).encode())
+    h.update(str(st.st_mtime_ns).encode())
+    h.update(str(st.st_size).encode())
+    return h.hexdigest()
+
+def thumb_path(key, width):
+    # sharded as thumbs/ab/cd/<key>_<width>.webp to keep directories small
+    ext = THUMB_EXTS[settings.THUMB_FORMAT]
+    return settings.THUMB_DIR / key[:2] / key[2:4] / f"{key}_{width}{ext}"
+
+def snap_width(width):
+    """Smallest configured rendition at least `width` pixels wide (the largest one otherwise)."""
+    for w in sorted(settings.THUMB_WIDTHS):
+        if w >= width:
+            return w
+    return max(settings.THUMB_WIDTHS)
+
+def generate_thumbnails(path, widths=None):
+    """
+    Write all missing renditions of the image at `path`, largest first, from one decode.
+    Returns the cache key, or None if the file is not a readable image.
+    """
+    widths = sorted(widths or settings.THUMB_WIDTHS, reverse=True)
+    try:
+        key = thumb_key(path)
+    except OSError:
+        return None
+
+    missing = [w for w in widths if not thumb_path(key, w).exists()]
+    if not missing:
+        return key
+
+    try:
+        with Image.open(path) as img:
+            # let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding
+            if img.format == "JPEG" and img.width:
+                target = missing[0]
+                img.draft("RGB", (target, target * img.height // img.width))
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+            if settings.THUMB_FORMAT == "JPEG" and img.mode != "RGB":
+                img = img.convert("RGB")
+
+            for width in missing:
+                if img.width > width:
+                    img = img.resize((width, max(1, img.height * width // img.width)), Image.LANCZOS)
+
+                out = thumb_path(key, width)
+                out.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=out.parent, suffix=".part")
+                try:
+                    with os.fdopen(fd, "wb") as fh:
+                        img.save(fh, settings.THUMB_FORMAT, quality=settings.THUMB_QUALITY)
+                    os.replace(tmp, out)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+    except Exception:
+        return None
+
+    return key
+
+def get_thumbnail(path, width):
+    """Path of the rendition closest to `width`, generated on the spot if the scanner has not made it yet."""
+    width = snap_width(width)
+    out = thumb_path(thumb_key(path), width)
+    if not out.exists() and not generate_thumbnails(path):
+        return None
+    return out
@@ -0,0 +1,144 @@
+import time
+import json
+import hashlib
+import logging
+import threading
+import requests
+from datetime import timedelta
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.utils import timezone
+from .models import TmdbCache
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+_client = None
+
+
+class TMDBError(Exception):
+    """TMDB could not be reached or kept failing after all retries."""
+
+
+def get_session():
+    """Process wide requests.Session, so connections to TMDB (api + images) are reused."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _session.headers.update({"accept": "application/json"})
+        return _session
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class TMDBClient:
+    """
+    Small TMDB v3 client: pooled session, token bucket rate limiting, retries with
+    exponential backoff on 429 / 5xx and a TmdbCache table so repeated lookups
+    (rescans, re-syncs) never hit the API again until their TTL expires.
+    """
+
+    def __init__(self, api_key=None, base_url=None, rate=None, burst=None, max_retries=None, session=None):
+        self.api_key = api_key if api_key is not None else settings.TMDB_API_KEY
+        self.base_url = (base_url or settings.TMDB_API_URL).rstrip("/")
+        self.bucket = TokenBucket(rate or settings.TMDB_RATE_LIMIT, burst or settings.TMDB_RATE_BURST)
+        self.max_retries = settings.TMDB_MAX_RETRIES if max_retries is None else max_retries
+        self.session = session or get_session()
+
+    def cache_key(self, endpoint, params):
+        raw = json.dumps([endpoint, sorted(params.items())], default=str)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def request(self, endpoint, params):
+        params = {**params, "api_key": self.api_key}
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                r = self.session.get(url, params=params, timeout=10)
+            except requests.RequestException as e:
+                # the exception text contains the url, keep the api key out of logs / task results
+                error = str(e).replace(self.api_key, "***") if self.api_key else str(e)
+                delay = 2 ** attempt
+            else:
+                if r.status_code == 200:
+                    return r.json()
+                if r.status_code not in RETRY_STATUS:
+                    raise TMDBError(f"{endpoint}: HTTP {r.status_code}")
+                error = f"HTTP {r.status_code}"
+                try:
+                    delay = float(r.headers.get("Retry-After", 2 ** attempt))
+                except ValueError:
+                    delay = 2 ** attempt
+            # a misbehaving server (or proxy) must not park the worker for hours
+            delay = min(max(delay, 0), settings.TMDB_RETRY_MAX_DELAY)
+
+            if attempt < self.max_retries:
+                logger.warning("TMDB %s failed (%s), retrying in %.0fs", endpoint, error, delay)
+                time.sleep(delay)
+
+        raise TMDBError(f"{endpoint}: {error} after {self.max_retries + 1} attempts")
+
+    def get(self, endpoint, params, ttl):
+        """GET `endpoint`, answered from TmdbCache while the cached response is younger than `ttl` seconds."""
+        key = self.cache_key(endpoint, params)
+
+        cached = TmdbCache.objects.filter(key=key, expires_at__gt=timezone.now()).values_list("data", flat=True).first()
+        if cached is not None:
+            return cached
+
+        data = self.request(endpoint, params)
+        TmdbCache.objects.update_or_create(
+            key=key,
+            defaults={
+                "endpoint": endpoint,
+                "data": data,
+                "expires_at": timezone.now() + timedelta(seconds=ttl),
+            },
+        )
+        return data
+
+    def search_movie(self, title, year=None):
+        params = {"query": title, "include_adult": True, "language": "en", "page": 1}
+        if year:
+            params["year"] = year
+        return self.get("search/movie", params, settings.TMDB_SEARCH_TTL)
+
+    def movie(self, tmdb_id):
+        return self.get(f"movie/{tmdb_id}", {"language": "en"}, settings.TMDB_DETAIL_TTL)
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = TMDBClient()
+    return _client
@@ -1,15 +1,25 @@
 from django.urls import path
+from django.conf import settings
 from . import views
 
 urlpatterns = [
     path("", views.index, name="index"),
     path("library/<slug:lib_slug>/", views.library_view, name="library"),
+    path("library/<slug:lib_slug>/page/", views.library_page_view, name="library_page"),
     path("refresh/", views.refresh_view, name="refresh"),
-    path("media/stream/", views.stream_media, name="stream_media"),
+    path("media/stream/", views.stream_media_async if settings.STREAM_ASYNC else views.stream_media, name="stream_media"),
+    path("media/hls/<int:item_id>/master.m3u8", views.hls_master, name="hls_master"),
+    path("media/hls/<int:item_id>/<str:profile>/index.m3u8", views.hls_playlist, name="hls_playlist"),
+    path("media/hls/<int:item_id>/<str:profile>/seg<int:number>.ts", views.hls_segment, name="hls_segment"),
     path("media/preview/", views.preview_media, name="preview_media"),
+    # posters / backdrops go through a view for the LRU stamp (see artwork.touch)
+    path("static_cache/posters/<str:name>", views.artwork_media, {"field": "poster"}, name="poster_media"),
+    path("static_cache/backdrop/<str:name>", views.artwork_media, {"field": "backdrop"}, name="backdrop_media"),
+    path("media/thumb/", views.thumbnail_media, name="thumbnail_media"),
     path("media/player/", views.player_view, name="player_view"),
     path("show_hidden/", views.show_hidden, name="show_hidden"),
     path("hide_hidden/", views.hide_hidden, name="hide_hidden"),
+    path("profile/", views.switch_profile, name="switch_profile"),
     path("search/", views.search_view, name="search"),
     path("set_poster/<int:item_id>/", views.set_poster, name="set_poster"),
     path("api/save_progress/<int:item_id>/", views.save_progress, name="save_progess"),
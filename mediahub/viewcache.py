@@ -0,0 +1,62 @@
+import time
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+
+# Rendered fragments and page contexts are cached under the generation of the libraries they
+# show. The scanner and the metadata tasks start a new generation after writing to a library,
+# entries of older generations are never read again and expire. The tasks run in the qcluster
+# process, the generations live in the (file based, shared) default cache for that reason.
+
+# generation of everything, renewed with every library; for pages showing several libraries
+ALL = "*"
+
+def _key(slug):
+    return f"generation:{slug}"
+
+def bump(*slugs):
+    """Start a new generation of the libraries `slugs` (and of ALL)."""
+    token = time.time_ns()
+    cache.set_many({_key(slug): token for slug in (*slugs, ALL)}, timeout=None)
+
+def generation(*slugs):
+    """
+    Current generation of `slugs` (default ALL) as a key part. A generation that is missing (new
+    library, cache cleared or culled) is started here, with a value no earlier entry used.
+    """
+    keys = [_key(slug) for slug in slugs or (ALL,)]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+    return "-".join(str(found[key]) for key in keys)
+
+def _cache_key(name, gen):
+    # request paths and cursors can be long, the cache wants short keys
+    return "view:" + hashlib.md5(f"{name}:{gen}".encode()).hexdigest()
+
+def cached(name, slugs, build):
+    """The value of build() for `name`, computed once per generation of `slugs`."""
+    key = _cache_key(name, generation(*slugs))
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, settings.VIEW_CACHE_TIMEOUT)
+    return value
+
+def cached_many(name, ids, slugs, build):
+    """
+    cached() for a fragment per id, {id: value}. build(missing_ids) computes all missing
+    fragments at once and returns them as {id: value}.
+    """
+    gen = generation(*slugs)
+    keys = {pk: _cache_key(f"{name}:{pk}", gen) for pk in ids}
+    found = cache.get_many(keys.values())
+    values = {pk: found[key] for pk, key in keys.items() if key in found}
+    missing = [pk for pk in ids if pk not in values]
+    if missing:
+        built = build(missing)
+        cache.set_many({keys[pk]: value for pk, value in built.items()}, settings.VIEW_CACHE_TIMEOUT)
+        values.update(built)
+    return values
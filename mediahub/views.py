@@ -1,16 +1,38 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import StreamingHttpResponse, Http404, FileResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.http import Http404, FileResponse, HttpResponse, HttpResponseRedirect, JsonResponse
 from .models import Library, MediaItem, FolderItem, PlaybackProgress, Collection
-from .scanner import scan_once_safe, load_config, get_preview
-from .subtitles import get_or_fetch
-import os, mimetypes, subprocess
-from wsgiref.util import FileWrapper
+from .scanner import scan_once_safe
+from .config import get_config
+from .previews import generate_preview, get_preview
+from .progress import pending_position, record_position
+from .thumbnails import get_thumbnail
+from .streaming import file_response, async_file_response
+from .hls import TranscoderBusy, ensure_duration, get_segment, master_playlist, needs_remux, needs_transcode, variant_playlist
+from .remux import get_remux, progressive_response
+from .artwork import ARTWORK_FIELDS, artwork_url, touch
+from . import fuzzy, search, viewcache
+import os, mimetypes
+import asyncio
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Count, Prefetch, Q, Sum
 from urllib.parse import quote, unquote
 import json
+import base64
 from random import sample
 
+def thumb_url(path, width, version=None):
+    url = f"/media/thumb/?path={quote(path)}&w={width}"
+    # versioned urls are cached by the browser for good
+    return url + f"&v={version}" if version is not None else url
+
+# columns posterize() and the tile templates read, for .only()
+TILE_FIELDS = ("id", "title", "poster", "file_path", "library__slug")
+
+def tile_items():
+    """MediaItems for posterize(), library joined in the same query."""
+    return MediaItem.objects.select_related("library").only(*TILE_FIELDS)
+
 def posterize(media_items):
     for it in media_items:
         if it.poster:
@@ -20,142 +42,270 @@ def posterize(media_items):
 
         it.viewer_url = f"/media/player/?path={quote(it.file_path)}&lib={it.library.slug}"
 
-def index(request):
-    cfg = load_config()
-    pin_required = cfg.get("hidden_pin", None)
-
-    if request.session.get("show_hidden"):
-        libs = Library.objects.all()
-    else:
-        libs = Library.objects.filter(hidden=False)
-
-    media_items = list(
-        MediaItem.objects
-        .filter(library__hidden=False, is_video=True)
-        .order_by("-id")[:10]
-    )
-
+def current_profile(request):
+    """Profile of the session, the first one in config.yaml until another is picked."""
+    profiles = get_config().profiles
+    name = request.session.get("profile")
+    return name if name in profiles else profiles[0]
+
+def continue_watching(profile, show_hidden, limit=10):
+    """Started, unfinished videos of `profile`, last played first, in one query on the progress index."""
+    progress = PlaybackProgress.objects.filter(profile_id=profile, finished=False, position__gt=0)
+    if not show_hidden:
+        progress = progress.filter(media_item__library__hidden=False)
+    progress = progress.select_related("media_item__library").only(
+        "media_item", *(f"media_item__{field}" for field in TILE_FIELDS)
+    ).order_by("-updated_at")[:limit]
+
+    media_items = [p.media_item for p in progress]
     posterize(media_items=media_items)
+    return media_items
 
-    all_collections = list(Collection.objects.all())
-    collections_to_show = sample(all_collections, 2) if len(all_collections) >= 2 else all_collections
+def index(request):
+    config = get_config()
+    pin_required = config.hidden_pin
+    show_hidden = request.session.get("show_hidden", False)
+    profile = current_profile(request)
 
-    collections_data = []
+    def build_page():
+        if show_hidden:
+            libs = Library.objects.all()
+        else:
+            libs = Library.objects.filter(hidden=False)
 
-    for col in collections_to_show:
-        movies = col.items.filter().order_by("year")
-        posterize(media_items=movies)
-        collections_data.append({
-            "collection": col,
-            "movies": movies,
-        })
+        media_items = list(
+            tile_items()
+            .filter(library__hidden=False, is_video=True)
+            .order_by("-id")[:10]
+        )
+        posterize(media_items=media_items)
+
+        return {
+            "libraries": list(libs),
+            "newest": render_to_string("_tile_row.html", {"row_id": "collectionRowZ", "items": media_items}),
+            "collection_ids": list(Collection.objects.values_list("id", flat=True)),
+        }
+
+    def build_collections(ids):
+        # the movies of all missing collections in one query
+        collections = Collection.objects.filter(id__in=ids).prefetch_related(
+            Prefetch("items", queryset=tile_items().only("collection", *TILE_FIELDS).order_by("year"))
+        )
+        rows = {}
+        for col in collections:
+            movies = col.items.all()
+            posterize(media_items=movies)
+            rows[col.id] = render_to_string("_collection_row.html", {
+                "collection": col,
+                "movies": movies,
+                "row_id": f"collectionRow{col.id}",
+            })
+        return rows
+
+    page = viewcache.cached(f"index:{show_hidden}", (), build_page)
+    all_collections = page["collection_ids"]
+    collection_ids = sample(all_collections, 2) if len(all_collections) >= 2 else all_collections
+    rows = viewcache.cached_many("collection", collection_ids, (), build_collections)
 
     return render(request, "index.html", {
-        "libraries": libs,
+        "libraries": page["libraries"],
         "pin_required": pin_required is not None,
-        "show_hidden": request.session.get("show_hidden", False),
-        "media_items": media_items,
-        "collections": collections_data,
+        "show_hidden": show_hidden,
+        "profiles": config.profiles,
+        "profile": profile,
+        # per profile and changing with every playback, not cached
+        "continue_watching": continue_watching(profile, show_hidden),
+        "newest": page["newest"],
+        "collections": [rows[pk] for pk in collection_ids if pk in rows],
     })
 
-def get_folder_size(folder):
-    size = 0
-    for it in folder.items.all():
-        if isinstance(it, FolderItem):
-            size += get_folder_size(it)
+# MediaItem columns used by library_view and library.html
+MEDIA_TILE_FIELDS = ("id", "library", "title", "poster", "file_path", "file_mtime", "is_video", "width", "height")
+
+def encode_cursor(kind, label, pk):
+    """Opaque cursor pointing after the tile (kind "f" folder / "m" media, name or title, id)."""
+    return base64.urlsafe_b64encode(json.dumps([kind, label, pk]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        kind, label, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if kind in ("f", "m") and isinstance(label, str) and isinstance(pk, int):
+            return kind, label, pk
+    except (ValueError, TypeError):
+        pass
+    raise Http404("Invalid cursor")
+
+def library_scope(lib, folder):
+    """Subfolders and items listed for `folder` (None: the library root)."""
+    if lib.type != "pictures":
+        # Movies / other types list every item of the library, no folders
+        return FolderItem.objects.none(), lib.items.all()
+    if folder:
+        return folder.subfolders.all(), folder.items.all()
+    return lib.folders.filter(parent__isnull=True), lib.items.filter(folder__isnull=True)
+
+def library_page(lib, folder, cursor=None, limit=None):
+    """
+    One page of a library listing: folders by name, then items by title, ties broken by id.
+    Keyset pagination, a page after `cursor` costs the same however deep into the listing it is.
+    Returns the decorated tiles and the cursor of the next page (None on the last one).
+    """
+    limit = limit or settings.LIBRARY_PAGE_SIZE
+    kind, label, pk = cursor or ("f", None, None)
+    subfolders, items = library_scope(lib, folder)
+    tiles = []
+
+    # the foreign keys are read by the related managers to attach lib / folder to each row
+    if kind == "f":
+        if label is not None:
+            subfolders = subfolders.filter(Q(name__gt=label) | Q(name=label, id__gt=pk))
+        subfolders = subfolders.only("id", "library", "parent", "name", "poster", "total_size")
+        tiles += subfolders.order_by("name", "id")[:limit + 1]
+    elif label is not None:
+        items = items.filter(Q(title__gt=label) | Q(title=label, id__gt=pk))
+
+    if len(tiles) <= limit:
+        items = items.only("folder", *MEDIA_TILE_FIELDS)
+        tiles += items.order_by("title", "id")[:limit + 1 - len(tiles)]
+
+    next_cursor = None
+    if len(tiles) > limit:
+        tiles = tiles[:limit]
+        last = tiles[-1]
+        if isinstance(last, FolderItem):
+            next_cursor = encode_cursor("f", last.name, last.id)
         else:
-            size += it.file_size
-    return size
+            next_cursor = encode_cursor("m", last.title, last.id)
+
+    for it in tiles:
+        decorate_tile(it, lib, folder)
+    return tiles, next_cursor
+
+def decorate_tile(it, lib, folder):
+    """Set the urls library.html renders for a FolderItem / MediaItem tile."""
+    if isinstance(it, FolderItem):
+        it.item_type = "folder"
+        it.viewer_url = f"?folder={it.id}"  # drill-down
+        it.poster_url = thumb_url(it.poster, 320) if it.poster else "/static/images/mediahub-placeholder.jpg"
+        return
+
+    it.item_type = "media"
+    if not it.is_video:
+        # the thumbnails on disk are keyed by path + mtime + size, a rewritten picture gets a new url
+        it.poster_url = thumb_url(it.file_path, 320, it.file_mtime)
+        it.full_url = thumb_url(it.file_path, 1920, it.file_mtime)
+    elif lib.hidden:
+        it.poster_url = f"/media/preview/?path={quote(it.file_path)}"
+    elif it.poster:
+        it.poster_url = "/static_cache/posters/" + it.poster
+    else:
+        it.poster_url = "/static/images/mediahub-placeholder.jpg"
 
-def library_view(request, lib_slug):
+    ext = os.path.splitext(it.file_path)[1].lower()
+    if ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
+        it.viewer_url = f"/media/image/?lib={lib.slug}&id={it.id}"
+    else:
+        it.viewer_url = f"/media/player/?path={quote(it.file_path)}&lib={lib.slug}"
+    if lib.type == "pictures":
+        it.viewer_url += f"&folder={folder.path if folder else None}"
+
+def get_library_folder(request, lib_slug):
     lib = get_object_or_404(Library, slug=lib_slug)
     if lib.hidden and not request.session.get("show_hidden"):
         raise Http404("Library hidden")
 
     # Get optional folder id for drill-down
     folder_id = request.GET.get("folder")  # None for root
-    current_path = []
-
     folder = None
+    if lib.type == "pictures" and folder_id:
+        folder = get_object_or_404(FolderItem, id=folder_id, library=lib)
+    return lib, folder
 
-    if lib.type == "pictures":
-        if folder_id:
-            folder = get_object_or_404(FolderItem, id=folder_id, library=lib)
-            subfolders = folder.subfolders.all().order_by("name")
-            pictures = folder.items.all().order_by("title")
-
-            f = folder
-            while f:
-                current_path.insert(0, f.name)
-                f = f.parent
-        else:
-            # root-level folders and pictures
-            subfolders = lib.folders.filter(parent__isnull=True).order_by("name")
-            pictures = lib.items.filter(folder__isnull=True).order_by("title")
-
-        # Combine folders and pictures, folders first
-        items = list(subfolders) + list(pictures)
-
-        # Build URLs for each item
-        for it in items:
-            if isinstance(it, FolderItem):
-                it.viewer_url = f"?folder={it.id}"  # drill-down
-                it.poster_url = f"/media/preview/?path={it.poster}" if it.poster else "/static/images/mediahub-placeholder.jpg"
-            else:  # MediaItem
-                if lib.hidden:
-                    it.poster_url = f"/media/preview/?path={quote(it.file_path)}"
-                elif it.poster:
-                    it.poster_url = "/static_cache/posters/" + it.poster
-                else:
-                    it.poster_url = "/static/images/mediahub-placeholder.jpg"
-
-                ext = os.path.splitext(it.file_path)[1].lower()
-                if ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
-                    it.viewer_url = f"/media/image/?lib={lib.slug}&id={it.id}&folder={folder.path if folder else None}"
-                else:
-                    it.viewer_url = f"/media/player/?path={quote(it.file_path)}&lib={lib.slug}&folder={folder.path if folder else None}"
+def listing_params(request):
+    """
+    The folder id and cursor of a listing request, validated without the database. Cache keys are
+    built from these, any other query string shares their entry.
+    """
+    folder_id = request.GET.get("folder") or None
+    if folder_id is not None and not folder_id.isdigit():
+        raise Http404("Invalid folder")
+    after = request.GET.get("after")
+    return (int(folder_id) if folder_id else None), (decode_cursor(after) if after else None)
 
-    else:
-        # Movies / other types remain as before
-        items = lib.items.all().order_by("title")
-        for it in items:
-            if lib.hidden:
-                it.poster_url = f"/media/preview/?path={quote(it.file_path)}"
-            elif it.poster:
-                it.poster_url = "/static_cache/posters/" + it.poster
-            else:
-                it.poster_url = "/static/images/mediahub-placeholder.jpg"
-
-            ext = os.path.splitext(it.file_path)[1].lower()
-            if ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
-                it.viewer_url = f"/media/image/?lib={lib.slug}&id={it.id}"
-            else:
-                it.viewer_url = f"/media/player/?path={quote(it.file_path)}&lib={lib.slug}"
-
-    size = 0
-    for it in items:
-        if isinstance(it, FolderItem):
-            it.item_type = "folder"
-            size += get_folder_size(it)
-        else:
-            it.item_type = "media"
-            size += it.file_size
-
-    current_path.insert(0, lib.name)
-    breadcrumb_path = "/" + "/".join(current_path)
-    parent_id = folder.parent.id if folder and folder.parent else None
-
-    return render(request, "library.html", {
-        "library": lib, 
-        "size": size,
-        "items": items, 
-        "breadcrumb_path": breadcrumb_path, 
-        "parent_id": parent_id,
-        "item_count": len(items),
-    })
+def library_view(request, lib_slug):
+    """First page of the listing, library.html fetches the following ones from library_page_view while scrolling."""
+    show_hidden = request.session.get("show_hidden", False)
+
+    def build():
+        lib, folder = get_library_folder(request, lib_slug)
+        current_path = []
+
+        if folder:
+            # the ancestors are the folders at the parent paths, fetched at once instead of walking .parent
+            ancestor_paths = []
+            p = folder.path
+            while len(p) > len(lib.path.rstrip("/")) and os.path.dirname(p) != p:
+                ancestor_paths.append(p)
+                p = os.path.dirname(p)
+            ancestors = lib.folders.filter(path__in=ancestor_paths).only("library", "name", "path")
+            current_path = [f.name for f in sorted(ancestors, key=lambda f: len(f.path))]
+
+        # totals of the whole listing, not only of the first page
+        subfolders, items = library_scope(lib, folder)
+        folder_totals = subfolders.aggregate(n=Count("id"), size=Sum("total_size")) if lib.type == "pictures" else {}
+        item_totals = items.aggregate(n=Count("id"), size=Sum("file_size"))
+
+        tiles, next_cursor = library_page(lib, folder)
+
+        current_path.insert(0, lib.name)
+        breadcrumb_path = "/" + "/".join(current_path)
+        parent_id = folder.parent_id if folder else None
+
+        return {
+            "library": lib, 
+            "size": (folder_totals.get("size") or 0) + (item_totals["size"] or 0),
+            "tiles": render_to_string("_library_tiles.html", {"items": tiles}),
+            "next_cursor": next_cursor,
+            "folder_id": folder.id if folder else "",
+            "breadcrumb_path": breadcrumb_path, 
+            "parent_id": parent_id,
+            "item_count": (folder_totals.get("n") or 0) + item_totals["n"],
+        }
+
+    # the page shell (navbar with its csrf token) is rendered per request, the listing comes from the cache
+    folder_id, _ = listing_params(request)
+    context = viewcache.cached(f"library:{lib_slug}:{folder_id}:{show_hidden}", (lib_slug,), build)
+    return render(request, "library.html", context)
+
+def library_page_view(request, lib_slug):
+    """JSON page of tiles after ?after=<cursor>, for the infinite scroll in library.html."""
+    show_hidden = request.session.get("show_hidden", False)
+
+    folder_id, cursor = listing_params(request)
+
+    def build():
+        lib, folder = get_library_folder(request, lib_slug)
+        tiles, next_cursor = library_page(lib, folder, cursor)
+
+        return {
+            "items": [{
+                # pictures open in the lightbox, like the {% if %} in _library_tiles.html
+                "lightbox": hasattr(it, "full_url"),
+                "url": getattr(it, "full_url", it.viewer_url),
+                "poster_url": it.poster_url,
+                "title": it.display_label,
+                "width": getattr(it, "width", None),
+                "height": getattr(it, "height", None),
+            } for it in tiles],
+            "next": next_cursor,
+        }
+
+    key = f"page:{lib_slug}:{folder_id}:{json.dumps(cursor)}:{show_hidden}"
+    return JsonResponse(viewcache.cached(key, (lib_slug,), build))
 
 def refresh_view(request):
-    lock = scan_once_safe()
+    # ?full=1 re-lists every directory instead of only the changed ones
+    lock = scan_once_safe(full=request.GET.get("full") == "1")
     return JsonResponse({"lock": lock})
 
 def stream_media(request):
@@ -164,46 +314,71 @@ def stream_media(request):
     if not path or not os.path.exists(path):
         raise Http404("File not found")
 
-    file_size = os.path.getsize(path)
+    # browser-compatible streams in another container (mkv ...) are remuxed to mp4 once
+    item = MediaItem.objects.filter(file_path=path).only("file_path", "ext", "video_codec", "audio_codec").first()
+    if item and needs_remux(item):
+        cached, job = get_remux(item)
+        if cached:
+            return file_response(request, str(cached), "video/mp4")
+        # a remux that fails right away (broken file ...) falls back to the raw file
+        if job and job.ready(settings.REMUX_START_TIMEOUT):
+            return progressive_response(job)
+
     mime_type, _ = mimetypes.guess_type(path)
     mime_type = mime_type or "application/octet-stream"
 
-    range_header = request.headers.get("Range")
-    if range_header:
-        # Example: "Range: bytes=1000-"
-        bytes_range = range_header.strip().split("=")[1]
-        start, end = bytes_range.split("-")[0], bytes_range.split("-")[1] or None
-        start = int(start) if start else 0
-        end = int(end) if end else file_size - 1
-        length = end - start + 1
-
-        def file_gen(path, start, length, block_size=8192):
-            with open(path, "rb") as f:
-                f.seek(start)
-                remaining = length
-                while remaining > 0:
-                    chunk_size = min(block_size, remaining)
-                    data = f.read(chunk_size)
-                    if not data:
-                        break
-                    yield data
-                    remaining -= len(data)
-
-        resp = StreamingHttpResponse(
-            file_gen(path, start, length),
-            status=206,
-            content_type=mime_type,
-        )
-        resp["Content-Length"] = str(length)
-        resp["Content-Range"] = f"bytes {start}-{end}/{file_size}"
-        resp["Accept-Ranges"] = "bytes"
+    return file_response(request, path, mime_type)
+
+async def stream_media_async(request):
+    """stream_media for ASGI deployments (settings.STREAM_ASYNC), see streaming.async_file_response."""
+    path = unquote(request.GET.get("path", ""))
+
+    if not path or not await asyncio.to_thread(os.path.exists, path):
+        raise Http404("File not found")
+
+    item = await MediaItem.objects.filter(file_path=path).only("file_path", "ext", "video_codec", "audio_codec").afirst()
+    if item and needs_remux(item):
+        cached, job = await asyncio.to_thread(get_remux, item)
+        if cached:
+            return await async_file_response(request, str(cached), "video/mp4")
+        if job and await asyncio.to_thread(job.ready, settings.REMUX_START_TIMEOUT):
+            return progressive_response(job, asynchronous=True)
+
+    mime_type, _ = mimetypes.guess_type(path)
+    mime_type = mime_type or "application/octet-stream"
+
+    return await async_file_response(request, path, mime_type)
+
+def hls_master(request, item_id):
+    item = get_object_or_404(MediaItem, id=item_id, is_video=True)
+    return HttpResponse(master_playlist(item), content_type="application/vnd.apple.mpegurl")
+
+def hls_playlist(request, item_id, profile):
+    item = get_object_or_404(MediaItem, id=item_id, is_video=True)
+    if profile not in settings.HLS_PROFILES:
+        raise Http404("Unknown profile")
+
+    duration = ensure_duration(item)
+    if not duration:
+        raise Http404("Duration unknown")
+
+    return HttpResponse(variant_playlist(duration), content_type="application/vnd.apple.mpegurl")
+
+def hls_segment(request, item_id, profile, number):
+    item = get_object_or_404(MediaItem, id=item_id, is_video=True)
+    if profile not in settings.HLS_PROFILES:
+        raise Http404("Unknown profile")
+
+    try:
+        seg = get_segment(item, profile, number)
+    except TranscoderBusy:
+        resp = HttpResponse("Transcoder busy", status=503)
+        resp["Retry-After"] = "5"
         return resp
 
-    # If no Range header → normal full response
-    resp = StreamingHttpResponse(FileWrapper(open(path, "rb")), content_type=mime_type)
-    resp["Content-Length"] = str(file_size)
-    resp["Accept-Ranges"] = "bytes"
-    return resp
+    if not seg:
+        raise Http404("Segment not available")
+    return FileResponse(open(seg, "rb"), content_type="video/mp2t")
 
 def preview_media(request):
     path = unquote(request.GET.get("path"))
@@ -217,10 +392,53 @@ def preview_media(request):
     thumb_path = get_preview(path)
 
     if not thumb_path:
-        raise Http404("Preview not available")
+        # the frame is being extracted (or cannot be): placeholder, asked again on the next load
+        resp = HttpResponseRedirect("/static/images/mediahub-placeholder.jpg")
+        resp["Cache-Control"] = "no-store"
+        return resp
     else:
         return FileResponse(open(thumb_path, "rb"), content_type="image/jpeg")
 
+def artwork_media(request, field, name):
+    path = ARTWORK_FIELDS[field]() / name
+    if name.startswith(".") or not path.is_file():
+        # evicted from the cache (or never downloaded): the browser loads it from TMDB
+        url = artwork_url(name)
+        if not url:
+            raise Http404("Artwork not found")
+        return HttpResponseRedirect(url)
+
+    touch(path)
+    resp = FileResponse(open(path, "rb"), content_type=mimetypes.guess_type(name)[0])
+    # named after the TMDB image path, the content never changes
+    resp["Cache-Control"] = "public, max-age=86400"
+    return resp
+
+def thumbnail_media(request):
+    path = unquote(request.GET.get("path", ""))
+    if not path or not os.path.exists(path):
+        raise Http404("File not found")
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
+        raise Http404("Not an image")
+
+    try:
+        width = int(request.GET.get("w", 320))
+    except ValueError:
+        width = 320
+
+    thumb_path = get_thumbnail(path, width)
+    if not thumb_path:
+        raise Http404("Thumbnail not available")
+
+    resp = FileResponse(open(thumb_path, "rb"), content_type=mimetypes.guess_type(thumb_path)[0])
+    if request.GET.get("v"):
+        resp["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        resp["Cache-Control"] = "public, max-age=3600"
+    return resp
+
 def player_view(request):
     path = unquote(request.GET.get("path"))
     lib_slug = request.GET.get("lib")
@@ -229,34 +447,52 @@ def player_view(request):
         raise Http404("File not found")
     
     vid = MediaItem.objects.get(file_path=path)
-    progress = PlaybackProgress.objects.filter(media_item=vid.id).first()
+    # a position reported to this process may not be written yet
+    profile = current_profile(request)
+    position = pending_position(profile, vid.id)
+    if position is None:
+        progress = PlaybackProgress.objects.filter(profile_id=profile, media_item=vid.id).first()
+        position = progress.position if progress else 0
 
     if vid.library.sync:
         backdrop_url = "/static_cache/backdrop/" + vid.backdrop if vid.backdrop else vid.poster
     else:
-        backdrop_url = "/static_cache/" + os.path.basename(get_preview(path))
+        # preview_media serves a placeholder until the frame is extracted
+        backdrop_url = f"/media/preview/?path={quote(path)}"
 
-    subtitles = get_or_fetch(vid)
+    # found by the scanner / enrichment and converted in the background, nothing is fetched here
+    subtitles = vid.subtitles.select_related("lang")
+
+    # ?hls=1 forces the transcoded stream, e.g. for remote / slow clients
+    hls = request.GET.get("hls") == "1" or needs_transcode(vid)
 
     return render(request, "player.html", {
+        "hls": hls,
         "item": vid,
         "file_path": quote(path), 
         "backdrop_url": backdrop_url,
         "item_id": vid.id, 
         "lib_slug": lib_slug, 
         "breadcrumb_path": "/" + vid.title,
-        "progress": progress.position if progress else 0,
+        "progress": position,
+        "profile": profile,
         "subtitles": subtitles,
     })
 
 def show_hidden(request):
     if request.method == "POST":
         code = request.POST.get("code")
-        cfg = load_config()
-        if code == str(cfg.get("hidden_pin", "")):
+        if code == (get_config().hidden_pin or ""):
             request.session["show_hidden"] = True
     return redirect("/")
 
+def switch_profile(request):
+    if request.method == "POST":
+        name = request.POST.get("profile")
+        if name in get_config().profiles:
+            request.session["profile"] = name
+    return redirect("/")
+
 def hide_hidden(request):
     if request.method == "POST":
         request.session.pop("show_hidden", None)
@@ -285,14 +521,25 @@ def search_view(request):
     show_hidden = request.session.get("show_hidden", False)
     results = []
 
-    if query:
+    if query and settings.SEARCH_FUZZY:
+        # typo-tolerant matches from the in-memory index, no database query per keystroke
+        found = fuzzy.search(query, show_hidden, limit=5)
+        if found is not None:
+            return JsonResponse(found, safe=False)
+
+    if query and search.available():
+        # ranked prefix search in the FTS5 index, limited in the database
+        results = search.search(query, show_hidden, limit=5)
+    elif query:
         # Search in movies / pictures / folders
         media_qs = MediaItem.objects.filter(
             Q(title__icontains=query)
+        ).select_related("library", "folder").only(
+            "id", "title", "file_path", "is_video", "ext", "library__slug", "folder__path"
         )
         folder_qs = FolderItem.objects.filter(
             Q(name__icontains=query)
-        )
+        ).select_related("library").only("id", "name", "library__slug")
 
         # If hidden is disabled, exclude hidden libraries
         if not show_hidden:
@@ -306,27 +553,26 @@ def search_view(request):
         # Limit to 5 overall
         results = [obj for obj, _ in results][:5]
 
-        final_results = []
-        # Combine results
-        for item in results:
-            if hasattr(item, 'ext'):
-                final_results.append({
-                    "type": "media",
-                    "title": item.title,
-                    "id": item.id,
-                    "lib_slug": item.library.slug,
-                    "file_path": item.file_path,
-                    "isvideo": item.is_video,
-                    "folder": item.folder.path if item.folder else None
-                })
-            else:
-                final_results.append({
-                    "type": "folder",
-                    "title": item.name,
-                    "id": item.id,
-                    "lib_slug": item.library.slug
-                })
-
+    final_results = []
+    # Combine results
+    for item in results:
+        if hasattr(item, 'ext'):
+            final_results.append({
+                "type": "media",
+                "title": item.title,
+                "id": item.id,
+                "lib_slug": item.library.slug,
+                "file_path": item.file_path,
+                "isvideo": item.is_video,
+                "folder": item.folder.path if item.folder else None
+            })
+        else:
+            final_results.append({
+                "type": "folder",
+                "title": item.name,
+                "id": item.id,
+                "lib_slug": item.library.slug
+            })
 
     return JsonResponse(final_results, safe=False)
 
@@ -339,15 +585,8 @@ def set_poster(request, item_id):
         data = json.loads(request.body)
         seconds = int(data.get("time", 5))
         
-        thumb_path = settings.CACHE_DIR / f"preview_{os.path.basename(item.file_path)}.jpg"
-
-        subprocess.run([
-            "ffmpeg", "-y",
-            "-ss", str(seconds),
-            "-i", item.file_path,
-            "-vframes", "1", "-q:v", "2",
-            str(thumb_path)
-        ], check=True)
+        if not generate_preview(item.file_path, seconds=seconds):
+            return JsonResponse({"success": False, "error": "No frame at this position"})
 
         return JsonResponse({"success": True})
     except MediaItem.DoesNotExist:
@@ -356,12 +595,22 @@ def set_poster(request, item_id):
         return JsonResponse({"success": False, "error": str(e)})
     
 def save_progress(request, item_id):
-    data = json.loads(request.body)
-    time = int(data.get("time", 0))
-    item = MediaItem.objects.get(id=item_id)
-
-    progress, _ = PlaybackProgress.objects.update_or_create(
-        media_item=item,
-        defaults={"position": time}
-    )
+    """Position reports of player.html, buffered in memory and written in batches (no query here)."""
+    if request.content_type == "application/json":
+        data = json.loads(request.body)
+    else:
+        data = request.POST  # navigator.sendBeacon posts a FormData
+    try:
+        time = int(float(data.get("time", 0)))
+        duration = int(float(data["duration"])) if data.get("duration") else None
+    except (TypeError, ValueError):
+        return JsonResponse({"success": False, "error": "Invalid time"}, status=400)
+
+    # the player sends the profile it was opened with: reading the session here would cost a query per report
+    profiles = get_config().profiles
+    profile = data.get("profile")
+    if profile not in profiles:
+        profile = profiles[0]
+
+    record_position(profile, item_id, time, duration, final=bool(data.get("final")))
     return JsonResponse({"success": True})
\ No newline at end of file
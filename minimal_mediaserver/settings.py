@@ -130,15 +130,139 @@ CACHE_DIR = BASE_DIR / "cache"
 POSTER_DIR = CACHE_DIR / "posters"
 BACKDROP_DIR = CACHE_DIR / "backdrop"
 SUBTITLES_DIR = CACHE_DIR / "subtitles"
+THUMB_DIR = CACHE_DIR / "thumbs"
+HLS_DIR = CACHE_DIR / "hls"
+HLS_LADDER_DIR = CACHE_DIR / "hls_ladder"
+REMUX_DIR = CACHE_DIR / "remux"
+PREVIEW_DIR = CACHE_DIR / "previews"
 CACHE_DIR.mkdir(exist_ok=True)
 POSTER_DIR.mkdir(parents=True, exist_ok=True)
 BACKDROP_DIR.mkdir(parents=True, exist_ok=True)
 SUBTITLES_DIR.mkdir(parents=True, exist_ok=True)
+THUMB_DIR.mkdir(parents=True, exist_ok=True)
+HLS_DIR.mkdir(parents=True, exist_ok=True)
+HLS_LADDER_DIR.mkdir(parents=True, exist_ok=True)
+REMUX_DIR.mkdir(parents=True, exist_ok=True)
+PREVIEW_DIR.mkdir(parents=True, exist_ok=True)
 
 OMDB_API_KEY = os.environ.get("OMDB_API_KEY", "")
 TMDB_API_KEY = os.environ.get("TMDB_API_KEY", "")
 SUBDL_API_KEY = os.environ.get("SUBDL_API_KEY", "")
 
+TMDB_API_URL = os.environ.get("TMDB_API_URL", "https://api.themoviedb.org/3")
+TMDB_RATE_LIMIT = 4  # requests per second and process
+TMDB_RATE_BURST = 20
+TMDB_MAX_RETRIES = 4
+TMDB_RETRY_MAX_DELAY = 60  # seconds, upper bound for Retry-After and the backoff
+TMDB_SEARCH_TTL = 7 * 24 * 3600  # seconds a cached search / detail response stays valid
+TMDB_DETAIL_TTL = 30 * 24 * 3600
+
+# TMDB lookups: items per worker task, retry backoff for failed lookups and
+# how long a claimed item stays "running" before another worker may take it (seconds)
+ENRICH_BATCH_SIZE = 10
+ENRICH_RETRY_BASE = 3600
+ENRICH_RETRY_MAX = 7 * 24 * 3600
+ENRICH_LEASE = 600
+
+# posters + backdrops are evicted least-recently-used first above this size (0 = unlimited)
+ARTWORK_CACHE_MAX_BYTES = 2 * 1024 ** 3
+ARTWORK_TRIM_INTERVAL = 600  # seconds between automatic eviction runs
+ARTWORK_TOUCH_INTERVAL = 3600  # seconds between "last used" updates of a served poster / backdrop
+
+# how /media/stream/ sends files:
+#   "sendfile"   - FileResponse, zero-copy os.sendfile under servers with a sendfile wsgi.file_wrapper
+#                  (gunicorn), STREAM_BUFFER_SIZE reads everywhere else
+#   "x-accel"    - X-Accel-Redirect to the nginx internal location STREAM_ACCEL_PREFIX
+#   "x-sendfile" - X-Sendfile header for Apache / lighttpd
+STREAM_BACKEND = "sendfile"
+STREAM_BUFFER_SIZE = 1024 * 1024
+STREAM_ACCEL_PREFIX = "/protected-media"
+# serve /media/stream/ from an async view, only for ASGI servers (uvicorn, daphne ...).
+# Open streams are limited per client address and per process, extra requests get a 503.
+STREAM_ASYNC = False
+STREAM_MAX_PER_CLIENT = 6
+STREAM_MAX_TOTAL = 64
+
+# on-the-fly HLS transcoding for files the browser can't play (or ?hls=1 on the player)
+HLS_PROFILES = {
+    "480p": {"height": 480, "video_bitrate": "1200k", "audio_bitrate": "96k"},
+    "720p": {"height": 720, "video_bitrate": "3000k", "audio_bitrate": "128k"},
+    "1080p": {"height": 1080, "video_bitrate": "6000k", "audio_bitrate": "160k"},
+}
+HLS_SEGMENT_SECONDS = 6
+HLS_PRESET = "veryfast"
+HLS_MAX_JOBS = 2  # concurrent ffmpeg processes
+HLS_MAX_AHEAD = 10  # segments a job may run ahead of the viewer before it is paused
+HLS_JOB_IDLE = 60  # seconds without requests before a job is killed
+HLS_REAP_INTERVAL = 10  # seconds between checks for idle jobs
+HLS_SEGMENT_TIMEOUT = 30
+HLS_CACHE_MAX_BYTES = 20 * 1024 ** 3
+
+# mkv & co. with H.264/AAC streams are copied into an mp4 container (no re-encoding) on first play
+REMUX_CACHE_MAX_BYTES = 20 * 1024 ** 3
+REMUX_START_TIMEOUT = 10  # seconds a request waits for the first bytes of a remux, the raw file is sent if it fails
+
+# background pre-encoding of all HLS_PROFILES for libraries with `pre_encode: true` in config.yaml.
+# Every task encodes LADDER_CHUNK_SEGMENTS segments and must finish within the Q_CLUSTER timeout,
+# ffmpeg is killed after LADDER_CHUNK_TIMEOUT seconds (finished segments are kept).
+LADDER_MAX_JOBS = 1  # concurrent encodes
+LADDER_NICE = 19
+LADDER_CHUNK_SEGMENTS = 10
+LADDER_CHUNK_TIMEOUT = 45
+LADDER_LEASE = 300  # seconds before an encode of a crashed worker is picked up again
+
+# tiles per page of a library listing, further pages are loaded while scrolling
+LIBRARY_PAGE_SIZE = 120
+
+# typo-tolerant type-ahead from a trigram index in the memory of every web process (instead of FTS5).
+# The scanner touches SEARCH_STAMP after writing, the processes then refresh their index.
+SEARCH_FUZZY = False
+SEARCH_STAMP = CACHE_DIR / "library.stamp"
+
+# rendered library listings and index rows, shared by the web and qcluster processes (the scanner
+# invalidates them); entries of older scans expire after VIEW_CACHE_TIMEOUT seconds
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": CACHE_DIR / "views",
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    }
+}
+VIEW_CACHE_TIMEOUT = 24 * 3600
+
+# playback positions reported by the players are kept in memory and written every
+# PROGRESS_FLUSH_INTERVAL seconds in one transaction (and right away when playback pauses)
+PROGRESS_FLUSH_INTERVAL = 10
+PROGRESS_FINISHED = 0.95  # share of the duration after which a video counts as watched
+
+# number of MediaItem rows the scanner writes per transaction
+SCAN_BATCH_SIZE = 500
+# worker threads reading image sizes / running ffprobe for new files while scanning
+SCAN_PROBE_WORKERS = 8
+# flock()ed by the process that is scanning, scans of the web / qcluster / watcher processes wait for each other
+SCAN_LOCK_FILE = CACHE_DIR / "scan.lock"
+
+# picture thumbnails: rendition widths, encoding, and whether the scanner creates them up front
+THUMB_WIDTHS = (320, 640, 1920)
+THUMB_FORMAT = "WEBP"  # or "JPEG"
+THUMB_QUALITY = 80
+THUMB_PREGENERATE = True
+
+# video frames shown for hidden library tiles and in the player of unsynced libraries: the scanner
+# extracts them for new videos, requests for missing ones are queued on PREVIEW_WORKERS threads
+PREVIEW_WORKERS = 2
+PREVIEW_PREGENERATE = True
+
+# subtitle files next to videos and embedded text tracks are written as VTT to SUBTITLES_DIR/local/
+# by a django-q task per video; ffmpeg gets this many seconds, below the Q_CLUSTER timeout. Embedded
+# tracks are interleaved, ffmpeg reads the whole file: raise both (and 'retry') for big files on slow shares
+SUBTITLE_EXTRACT_TIMEOUT = 50
+
+# watch_libraries: apply changes once no new event arrived for WATCH_DEBOUNCE seconds,
+# but never wait longer than WATCH_MAX_DELAY seconds during a continuous burst
+WATCH_DEBOUNCE = 2.0
+WATCH_MAX_DELAY = 30.0
+
 Q_CLUSTER = {
     'name': 'DjangoQ',
     'workers': 2,
@@ -22,7 +22,5 @@ urlpatterns = [
     path('', include("mediahub.urls")),
 ]
 
-urlpatterns += static("/static_cache/posters/", document_root=settings.POSTER_DIR)
-urlpatterns += static("/static_cache/backdrop/", document_root=settings.BACKDROP_DIR)
 urlpatterns += static("/static_cache/", document_root=settings.CACHE_DIR)
 urlpatterns += static("/static_cache/subtitles", document_root=settings.SUBTITLES_DIR)